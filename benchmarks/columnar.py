@@ -0,0 +1,91 @@
+"""Rows/sec of building a Zipf distribution from database batches:
+dict-of-dicts (the previous implementation) vs. columnar decoding into NumPy arrays
+
+Runs offline on synthetic documents shaped like the 1grams collections:
+
+    python benchmarks/columnar.py --rows 1000000
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import bson
+import numpy as np
+import pandas as pd
+from pymongo import MongoClient
+
+from storywrangling.query import Query
+from storywrangling.metadata import CollectionMetadata
+
+
+def synthetic_batches(rows: int, batch_size: int) -> list:
+    """Raw BSON batches of ngram documents, as returned by `find_raw_batches`"""
+    rng = np.random.default_rng(0)
+    counts = np.sort(rng.zipf(1.5, rows).clip(max=10 ** 9))[::-1]
+    total = counts.sum()
+    day = datetime(2020, 1, 1)
+
+    docs = [
+        bson.encode({
+            "word": f"w{i}",
+            "time": day,
+            "counts": int(c),
+            "count_noRT": int(c // 2),
+            "rank": float(i + 1),
+            "rank_noRT": float(i + 1),
+            "freq": c / total,
+            "freq_noRT": c / total,
+        })
+        for i, c in enumerate(counts)
+    ]
+    return [b"".join(docs[i:i + batch_size]) for i in range(0, rows, batch_size)]
+
+
+def dict_of_dicts(batches: list, q: Query) -> pd.DataFrame:
+    """Previous `Query.zipf_frame`: one dict per document, then `from_dict`"""
+    zipf = {}
+    for batch in batches:
+        for t in bson.decode_all(batch):
+            zipf[t["word"]] = {c: t[db] for c, db in zip(q.cols, q.db_cols)}
+
+    df = pd.DataFrame.from_dict(data=zipf, orient="index")
+    df.sort_values(by="count", ascending=False, inplace=True)
+    return df
+
+
+def columnar(batches: list, q: Query) -> pd.DataFrame:
+    """Current `Query.zipf_frame`"""
+    return q.zipf_frame(batches)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rows", type=int, default=1000000, help="number of documents")
+    parser.add_argument("--batch-size", type=int, default=10000, help="documents per raw batch")
+    parser.add_argument("--repeat", type=int, default=3, help="best of N runs")
+    args = parser.parse_args()
+
+    batches = synthetic_batches(args.rows, args.batch_size)
+    metadata = CollectionMetadata(datetime(2020, 1, 1), datetime(2020, 1, 1), "time", ())
+    q = Query("1grams", "en", client=MongoClient(connect=False), metadata=metadata)
+
+    results = {}
+    for name, build in [("dict-of-dicts", dict_of_dicts), ("columnar", columnar)]:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results[name] = build(batches, q)
+            timings.append(time.perf_counter() - start)
+
+        best = min(timings)
+        print(f"{name:>14}: {best:.2f}s ({args.rows / best:,.0f} rows/sec)")
+
+    pd.testing.assert_frame_equal(results["dict-of-dicts"], results["columnar"])
+
+
+if __name__ == "__main__":
+    main()
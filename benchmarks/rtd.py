@@ -0,0 +1,86 @@
+"""Time to compute rank-turbulence divergence between two Zipf distributions:
+outer join and Series.rank in pandas vs. `storywrangling.rtd` (single factorize pass over both vocabularies)
+
+Runs offline on synthetic Zipf distributions overlapping on most of their ngrams:
+
+    python benchmarks/rtd.py --types 10000000
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import pandas as pd
+
+from storywrangling.rtd import rank_turbulence_divergence
+
+
+def synthetic_zipf(vocabulary: pd.Index, types: int, rng: np.random.Generator) -> pd.DataFrame:
+    """Zipf distribution of `types` ngrams drawn from a vocabulary"""
+    counts = np.floor(1e9 / np.arange(1, types + 1) ** 1.1).clip(1)
+    rng.shuffle(counts)
+
+    return pd.DataFrame(
+        {"count": counts, "count_no_rt": np.floor(counts / 2)},
+        index=vocabulary[rng.choice(len(vocabulary), types, replace=False)],
+    )
+
+
+def joined(zipf_1: pd.DataFrame, zipf_2: pd.DataFrame, alpha: float) -> pd.DataFrame:
+    """Outer join of both distributions, ranked column by column with pandas"""
+    df = zipf_1.join(zipf_2, how='outer', lsuffix='_1', rsuffix='_2')
+    out = {}
+
+    for suffix in ("", "_no_rt"):
+        c1, c2 = df[f"count{suffix}_1"].where(lambda c: c > 0), df[f"count{suffix}_2"].where(lambda c: c > 0)
+        r1, r2 = c1.rank(ascending=False), c2.rank(ascending=False)
+        used = c1.notna() | c2.notna()
+
+        r1 = r1.fillna(c1.notna().sum() + ((used & c1.isna()).sum() + 1) / 2).where(used)
+        r2 = r2.fillna(c2.notna().sum() + ((used & c2.isna()).sum() + 1) / 2).where(used)
+        out[f"rd_contribution{suffix}"] = (alpha + 1) / alpha * (r1 ** -alpha - r2 ** -alpha).abs() ** (1 / (alpha + 1))
+
+    return pd.DataFrame(out).sort_values(by="rd_contribution", ascending=False)
+
+
+def vectorized(zipf_1: pd.DataFrame, zipf_2: pd.DataFrame, alpha: float) -> pd.DataFrame:
+    """`rank_turbulence_divergence`"""
+    return rank_turbulence_divergence(zipf_1, zipf_2, alpha=alpha)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--types", type=int, default=1000000, help="ngrams per distribution")
+    parser.add_argument("--overlap", type=float, default=0.7, help="fraction of ngrams shared by both distributions")
+    parser.add_argument("--alpha", type=float, default=1 / 4, help="rank-turbulence parameter")
+    parser.add_argument("--repeat", type=int, default=3, help="best of N runs")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vocabulary = pd.Index([f"ngram {i}" for i in range(int(args.types * (2 - args.overlap)))])
+    zipf_1, zipf_2 = synthetic_zipf(vocabulary, args.types, rng), synthetic_zipf(vocabulary, args.types, rng)
+
+    results = {}
+    for name, compute in [("outer join", joined), ("vectorized", vectorized)]:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results[name] = compute(zipf_1, zipf_2, args.alpha)
+            timings.append(time.perf_counter() - start)
+
+        print(f"{name:>11}: {min(timings):.2f}s for {args.types} ngrams per distribution")
+
+    cols = ["rd_contribution", "rd_contribution_no_rt"]
+    pd.testing.assert_frame_equal(
+        results["outer join"][cols].sort_index(),
+        results["vectorized"][cols].sort_index(),
+        check_names=False,
+        check_index_type=False,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Time to start up a short-lived worker:
+importing every API module (the previous `import storywrangling`) vs. the lazy package import,
+and unpickling the parser and language tables in every constructor vs. loading them once per process
+
+Runs offline (constructing the API objects does not connect to the database);
+each import is timed in a fresh interpreter:
+
+    python benchmarks/startup.py --objects 1000
+"""
+import sys
+import time
+import pickle
+import argparse
+import subprocess
+from pathlib import Path
+
+import ujson
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+IMPORTS = {
+    "eager": "import storywrangling.query, storywrangling.realtime_query, storywrangling.storywrangler, "
+             "storywrangling.realtime, storywrangling.regexr, storywrangling.async_storywrangler, "
+             "storywrangling.async_realtime, tqdm",
+    "lazy": "import storywrangling",
+    "Storywrangler": "from storywrangling import Storywrangler",
+}
+HEAVY = ("pandas", "numpy", "pymongo", "tqdm")
+
+
+def import_time(statement: str) -> (float, list):
+    """Seconds spent running an import statement in a fresh interpreter, and the heavy modules it loaded"""
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        f"{statement}\n"
+        "print(time.perf_counter() - start)\n"
+        f"print(' '.join(m for m in {HEAVY!r} if m in sys.modules))\n"
+    )
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    seconds, loaded = out.stdout.split("\n")[:2]
+    return float(seconds), loaded.split()
+
+
+def per_object() -> dict:
+    """Previous constructor: unpickle the parser and parse the language tables for each object"""
+    with open(ROOT / "resources" / "ngrams.bin", "rb") as f:
+        parser = pickle.load(f)
+
+    tables = {}
+    for table in ("ngrams", "indexed", "supported"):
+        with open(ROOT / "resources" / f"{table}_languages.json", "rb") as f:
+            tables[table] = ujson.load(f)
+
+    return {"parser": parser, **tables}
+
+
+def once_per_process():
+    """`Storywrangler()`, using its parser and language tables (loaded on first use)"""
+    from storywrangling import Storywrangler
+
+    api = Storywrangler()
+    api.parser, api.ngrams_languages, api.indexed_languages, api.supported_languages
+    return api
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--objects", type=int, default=1000, help="API objects constructed")
+    parser.add_argument("--repeat", type=int, default=5, help="best of N runs")
+    args = parser.parse_args()
+
+    loaded = {}
+    for name, statement in IMPORTS.items():
+        timings = []
+        for _ in range(args.repeat):
+            seconds, loaded[name] = import_time(statement)
+            timings.append(seconds)
+
+        print(f"{name:>14}: {min(timings) * 1000:.1f}ms to import ({', '.join(loaded[name]) or 'no heavy modules'})")
+
+    once_per_process()  # import the API outside of the timed loops
+
+    results = {}
+    for name, construct in [("per object", per_object), ("once", once_per_process)]:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results[name] = [construct() for _ in range(args.objects)]
+            timings.append(time.perf_counter() - start)
+
+        print(f"{name:>14}: {min(timings) * 1000:.1f}ms for {args.objects} objects")
+
+    assert not loaded["lazy"]
+    assert results["once"][0].parser is results["once"][-1].parser
+    assert results["once"][0].parser.pattern == results["per object"][0]["parser"].pattern
+    assert results["once"][0].indexed_languages == results["per object"][0]["indexed"]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Time to build an ngram timeseries from database batches:
+per-day dict skeleton filled cell by cell (the previous implementation) vs. columnar decoding
+reindexed onto a date range
+
+Runs offline on synthetic documents shaped like the 1grams collections:
+
+    python benchmarks/timeseries.py --days 5000
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+from datetime import datetime, timedelta
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import bson
+import numpy as np
+import pandas as pd
+from pymongo import MongoClient
+
+from storywrangling.query import Query
+from storywrangling.metadata import CollectionMetadata
+
+
+def synthetic_batches(days: int, coverage: float, batch_size: int) -> (list, dict):
+    """Raw BSON batches of an ngram used on a fraction of `days`, and the matching query"""
+    rng = np.random.default_rng(0)
+    start = datetime(2010, 1, 1)
+    used = np.flatnonzero(rng.random(days) < coverage)
+
+    docs = [
+        bson.encode({
+            "time": start + timedelta(days=int(d)),
+            "counts": int(c),
+            "count_noRT": int(c // 2),
+            "rank": float(r),
+            "rank_noRT": float(r),
+            "freq": c / 10 ** 9,
+            "freq_noRT": c / 10 ** 9,
+        })
+        for d, c, r in zip(used, rng.integers(1, 10 ** 6, len(used)), rng.integers(1, 10 ** 6, len(used)))
+    ]
+    query = {"time": {"$gte": start, "$lte": start + timedelta(days=days - 1)}}
+    return [b"".join(docs[i:i + batch_size]) for i in range(0, len(docs), batch_size)], query
+
+
+def dict_skeleton(batches: list, query: dict, q: Query) -> pd.DataFrame:
+    """Previous `Query.ngram_frame`: NaN dict of every day, filled one cell at a time"""
+    data = {
+        d: {c: np.nan for c in q.cols}
+        for d in pd.date_range(start=query["time"]["$gte"].date(), end=query["time"]["$lte"].date(), freq="D").date
+    }
+
+    for batch in batches:
+        for i in bson.decode_all(batch):
+            d = i["time"].date()
+            for c, db in zip(q.cols, q.db_cols):
+                data[d][c] = i[db]
+
+    df = pd.DataFrame.from_dict(data=data, orient="index")
+    return df.reindex(columns=q.cols)
+
+
+def columnar(batches: list, query: dict, q: Query) -> pd.DataFrame:
+    """Current `Query.ngram_frame`"""
+    return q.ngram_frame(batches, q.date_index(query))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--days", type=int, default=5000, help="length of the timeseries")
+    parser.add_argument("--coverage", type=float, default=0.5, help="fraction of days the ngram is used on")
+    parser.add_argument("--batch-size", type=int, default=1000, help="documents per raw batch")
+    parser.add_argument("--repeat", type=int, default=20, help="best of N runs")
+    args = parser.parse_args()
+
+    batches, query = synthetic_batches(args.days, args.coverage, args.batch_size)
+    metadata = CollectionMetadata(datetime(2010, 1, 1), datetime(2020, 1, 1), "time", ())
+    q = Query("1grams", "en", client=MongoClient(connect=False), metadata=metadata)
+
+    results = {}
+    for name, build in [("dict skeleton", dict_skeleton), ("columnar", columnar)]:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results[name] = build(batches, query, q)
+            timings.append(time.perf_counter() - start)
+
+        print(f"{name:>14}: {min(timings) * 1000:.1f}ms per timeseries")
+
+    pd.testing.assert_frame_equal(results["dict skeleton"], results["columnar"])
+
+
+if __name__ == "__main__":
+    main()
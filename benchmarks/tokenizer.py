@@ -0,0 +1,93 @@
+"""Time to find the ngram order of every ngram of a watchlist:
+one `nparser` call per ngram (the previous implementation, compiling its edge-case pattern on every call)
+vs. `ngram_orders` over the whole batch (precompiled patterns, memoized 1-grams), cold and warm
+
+Runs offline on the ngrams of the test fixtures, sampled with repeats into a watchlist of 1-, 2-, and 3-grams:
+
+    python benchmarks/tokenizer.py --size 100000
+"""
+import re
+import sys
+import time
+import pickle
+import argparse
+from pathlib import Path
+from collections import Counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import pandas as pd
+
+from storywrangling import regexr
+
+ROOT = Path(__file__).resolve().parents[1]
+FIXTURES = [
+    "ngrams_array_example.tsv",
+    "ngrams_indexed_only_example.tsv",
+    "ngrams_zipf_topk_example.tsv.gz",
+    "ngrams_divergence_example.tsv.gz",
+]
+
+
+def watchlist(size: int, unique: float) -> list:
+    """Ngrams of the test fixtures, joined into 1- to 3-grams, with a fraction `unique` of distinct ngrams"""
+    words = sorted(set().union(*(pd.read_csv(ROOT / "tests" / f, sep="\t")["ngram"].astype(str) for f in FIXTURES)))
+    rng = np.random.default_rng(0)
+
+    distinct = [
+        " ".join(rng.choice(words, size=rng.integers(1, 4)))
+        for _ in range(max(1, int(size * unique)))
+    ]
+    return [distinct[i] for i in rng.integers(0, len(distinct), size)]
+
+
+def per_ngram(ngrams: list, parser) -> list:
+    """Previous implementation: `len(nparser(w, parser, n=1))` for each ngram"""
+    orders = []
+    for w in ngrams:
+        text = re.sub(r"(([\-\.]{2,})|(\'\'))", r" \1 ", w)
+        tokens = [x[0] for x in parser.findall(text) if x[0] != ""]
+        orders.append(len(Counter(tokens)) if tokens else 0)
+
+    return orders
+
+
+def batched(ngrams: list, parser) -> list:
+    """`regexr.ngram_orders`, starting from an empty memo"""
+    regexr.pattern_tokens.cache_clear()
+    return regexr.ngram_orders(ngrams, parser)
+
+
+def memoized(ngrams: list, parser) -> list:
+    """`regexr.ngram_orders` again, with every ngram already memoized (e.g. polling the same watchlist)"""
+    return regexr.ngram_orders(ngrams, parser)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--size", type=int, default=100000, help="ngrams in the watchlist")
+    parser.add_argument("--unique", type=float, default=0.2, help="fraction of distinct ngrams in the watchlist")
+    parser.add_argument("--repeat", type=int, default=5, help="best of N runs")
+    args = parser.parse_args()
+
+    with open(ROOT / "resources" / "ngrams.bin", "rb") as f:
+        ngram_parser = pickle.load(f)
+
+    ngrams = watchlist(args.size, args.unique)
+
+    results = {}
+    for name, orders in [("per ngram", per_ngram), ("batched", batched), ("memoized", memoized)]:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results[name] = orders(ngrams, ngram_parser)
+            timings.append(time.perf_counter() - start)
+
+        print(f"{name:>10}: {min(timings) * 1000:.1f}ms for {args.size} ngrams")
+
+    assert results["per ngram"] == results["batched"] == results["memoized"]
+
+
+if __name__ == "__main__":
+    main()
@@ -19,8 +19,9 @@ setup(
     author_email="thayer.alshaabi@uvm.edu",
     packages=find_packages(),
     package_data={'storywrangling': ['resources/*.bin', 'resources/*.csv', 'resources/*.json']},
-    python_requires=">=3.6",
+    python_requires=">=3.7",
     install_requires=libs,
+    extras_require={"async": ["pymongo>=4.10"]},
     license="MIT",
     classifiers=[
         "Intended Audience :: Science/Research",
@@ -1,6 +1,32 @@
+"""Python API for the Storywrangler project
 
-from .query import Query
-from .realtime_query import RealtimeQuery
-from .storywrangler import Storywrangler
-from .realtime import Realtime
-from .regexr import nparser
+The API classes are imported on first access,
+so `import storywrangling` does not load pandas, pymongo, or the async clients until they are used.
+"""
+import importlib
+
+_exports = {
+    'Query': 'storywrangling.query',
+    'RealtimeQuery': 'storywrangling.realtime_query',
+    'Storywrangler': 'storywrangling.storywrangler',
+    'Realtime': 'storywrangling.realtime',
+    'nparser': 'storywrangling.regexr',
+    'AsyncStorywrangler': 'storywrangling.async_storywrangler',
+    'AsyncRealtime': 'storywrangling.async_realtime',
+    'ProgressHook': 'storywrangling.progress',
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name: str):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(_exports[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
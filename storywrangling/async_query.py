@@ -0,0 +1,166 @@
+import asyncio
+import inspect
+from typing import AsyncIterator, Callable, Optional, Union
+
+import pandas as pd
+
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+
+from storywrangling.query import Query, projection
+from storywrangling.realtime_query import RealtimeQuery
+from storywrangling.metadata import metadata_cache
+from storywrangling.progress import ProgressHook
+
+
+class AsyncQuery(Query):
+    """Asyncio counterpart of Query
+
+    Runs the same queries through an AsyncMongoClient
+    and builds the same dataframes as Query:
+    every `query_*` method returns an awaitable instead of a dataframe,
+    with at most `semaphore` queries in flight at once.
+    """
+
+    semaphore = None
+
+    @classmethod
+    async def create(cls,
+                     db: str,
+                     lang: str,
+                     client,
+                     semaphore: Optional[asyncio.Semaphore] = None,
+                     progress: Union[bool, Callable, ProgressHook, None] = True) -> 'AsyncQuery':
+        """Create a query, looking up collection metadata without blocking the event loop
+
+        Args:
+            db: database to use
+            lang: language collection to use
+            client: AsyncMongoClient to use
+            semaphore: bounds the number of concurrent queries
+            progress: progress of decoding query results, see `storywrangling.progress` (default: tqdm bars)
+
+        Returns:
+            an AsyncQuery
+        """
+        metadata = await metadata_cache.get_async(client[db][lang], cadence='D')
+        q = cls(db, lang, client=client, metadata=metadata, progress=progress)
+        q.semaphore = semaphore if semaphore else asyncio.Semaphore(1)
+        return q
+
+    async def run_query(self,
+                        query: dict,
+                        top_n: Optional[int] = None,
+                        projection: Optional[dict] = None,
+                        sort: Optional[dict] = None,
+                        raw: bool = False,
+                        per: Optional[str] = None):
+        method, kwargs = self.query_plan(query, top_n, projection, sort, raw, per, self.group_topn)
+
+        try:
+            cursor = getattr(self.database, method)(**kwargs)
+            return await cursor if inspect.isawaitable(cursor) else cursor
+
+        except OperationFailure as e:
+            if not self.lacks_topn(e, top_n, per):
+                raise
+
+            method, kwargs = self.query_plan(query, top_n, projection, sort, raw, per, self.group_topn)
+            cursor = getattr(self.database, method)(**kwargs)
+            return await cursor if inspect.isawaitable(cursor) else cursor
+
+    async def execute(self,
+                      query: dict,
+                      build: Callable,
+                      top_n: Optional[int] = None,
+                      projection: Optional[dict] = None,
+                      sort: Optional[dict] = None,
+                      raw: bool = False,
+                      per: Optional[str] = None):
+        async with self.semaphore:
+            cursor = await self.run_query(query, top_n, projection, sort, raw, per)
+            docs = await cursor.to_list(None)
+
+        return build(docs)
+
+    async def iter_day(self,
+                       date,
+                       max_rank: Optional[int] = None,
+                       min_count: Optional[int] = None,
+                       rt: bool = True,
+                       ngram_order: int = 1,
+                       ngram_filter: Optional[str] = None,
+                       columns: Optional[list] = None,
+                       chunk_size: int = 100000) -> AsyncIterator[pd.DataFrame]:
+        """Stream all ngrams in a single day, one cursor batch at a time (see Query.iter_day)"""
+        query = self.prepare_zipf_query(date, max_rank, min_count, rt, ngram_order, ngram_filter)
+        fields = projection("word", *self.ngram_fields(columns)[1])
+
+        async with self.semaphore:
+            async for batch in self.database.find_raw_batches(query, fields, batch_size=chunk_size):
+                chunk = self.zipf_chunk(batch, columns)
+                if not chunk.empty:
+                    yield chunk
+
+
+class AsyncRealtimeQuery(RealtimeQuery):
+    """Asyncio counterpart of RealtimeQuery (see AsyncQuery)"""
+
+    semaphore = None
+
+    @classmethod
+    async def create(cls,
+                     db: str,
+                     lang: str,
+                     client,
+                     semaphore: Optional[asyncio.Semaphore] = None,
+                     progress: Union[bool, Callable, ProgressHook, None] = True) -> 'AsyncRealtimeQuery':
+        """Create a query, looking up collection metadata without blocking the event loop
+
+        Args:
+            db: database to use
+            lang: language collection to use
+            client: AsyncMongoClient to use
+            semaphore: bounds the number of concurrent queries
+            progress: progress of decoding query results, see `storywrangling.progress` (default: tqdm bars)
+
+        Returns:
+            an AsyncRealtimeQuery
+        """
+        metadata = await metadata_cache.get_async(client[db][lang], cadence='15min')
+        q = cls(db, lang, client=client, metadata=metadata, progress=progress)
+        q.semaphore = semaphore if semaphore else asyncio.Semaphore(1)
+        return q
+
+    async def execute(self,
+                      query: dict,
+                      build: Callable,
+                      projection: Optional[dict] = None,
+                      raw: bool = False):
+        async with self.semaphore:
+            cursor = self.run_query(query, projection, raw)
+            cursor = await cursor if inspect.isawaitable(cursor) else cursor
+            docs = await cursor.to_list(None)
+
+        return build(docs)
+
+    async def iter_batches(self,
+                           start_time,
+                           end_time,
+                           max_rank: Optional[int] = None,
+                           min_count: Optional[int] = None,
+                           rt: bool = True,
+                           columns: Optional[list] = None) -> AsyncIterator[tuple]:
+        """Stream all ngrams of every batch in a time range, one batch at a time (see RealtimeQuery.iter_batches)"""
+        query = self.prepare_range_query(start_time, end_time, max_rank, min_count, rt)
+        fields = projection("word", "time", *self.batch_fields(rt, columns))
+
+        pending = None
+        async with self.semaphore:
+            async for chunk in self.database.find_raw_batches(query, fields, sort=[("time", ASCENDING)]):
+                batches, pending = self.complete_batches(chunk, pending, rt, columns)
+                for batch in batches:
+                    yield batch
+
+        for batch in self.complete_batches(None, pending, rt, columns)[0]:
+            yield batch
@@ -0,0 +1,256 @@
+import asyncio
+import logging
+import pandas as pd
+from typing import AsyncIterator, Callable, Optional, Union
+from datetime import datetime
+
+from storywrangling.realtime import RealtimeBase
+from storywrangling.async_query import AsyncRealtimeQuery
+from storywrangling.compact import compacting
+from storywrangling.progress import ProgressHook
+from storywrangling.connection import connect_async
+from storywrangling.regexr import ngram_order, ngram_orders
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRealtime(RealtimeBase):
+    """Asyncio API to access the realtime database
+
+    Every method is a coroutine returning the same dataframe as its Realtime counterpart.
+    Queries run concurrently on the event loop,
+    with at most `max_concurrency` of them in flight at once.
+
+    The result cache (`result_cache_size`) and `watch` are only available on Realtime.
+    """
+
+    def __init__(self,
+                 max_pool_size: int = 100,
+                 max_idle_time_ms: Optional[int] = 60000,
+                 max_concurrency: int = 10,
+                 compact: bool = False,
+                 progress: Union[bool, Callable, ProgressHook, None] = True) -> None:
+        """
+        Args:
+            max_pool_size: max number of concurrent connections to the database (default: 100)
+            max_idle_time_ms: close pooled connections idle for longer than this (default: 60000)
+            max_concurrency: max number of queries in flight at once (default: 10)
+            compact: return compact dtypes (see Storywrangler; default: False)
+            progress: progress reporting (see Storywrangler; default: True)
+        """
+        super().__init__(max_pool_size, max_idle_time_ms, compact=compact, progress=progress)
+        self.max_concurrency = max_concurrency
+        self._client = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    def __enter__(self):
+        raise TypeError("use 'async with'")
+
+    @property
+    def client(self):
+        """AsyncMongoClient of this object (created on the first query)"""
+        return self._client
+
+    async def connect(self):
+        """Create the AsyncMongoClient of this object, if needed"""
+        if self._client is None:
+            self._client = await connect_async(
+                max_pool_size=self.max_pool_size,
+                max_idle_time_ms=self.max_idle_time_ms,
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        return self._client
+
+    async def close(self) -> None:
+        """Close the connection pool of this object"""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    async def query(self, db: str, lang: str) -> AsyncRealtimeQuery:
+        """Create an AsyncRealtimeQuery on a database collection"""
+        client = await self.connect()
+        return await AsyncRealtimeQuery.create(db, lang, client, self._semaphore, progress=self.progress)
+
+    @compacting
+    async def get_ngram(self, ngram: str, lang: str = 'en', columns: Optional[list] = None) -> pd.DataFrame:
+        """Query database for an ngram timeseries (see Realtime.get_ngram)"""
+        if self.supported_languages.get(lang) is not None:
+            ngram = ngram.lower()
+            logger.info(f"Retrieving {self.supported_languages.get(lang)}: '{ngram}'")
+
+            n = ngram_order(ngram, self.parser)
+            q = await self.query(f'realtime_{n}grams', lang)
+            df = await q.query_ngram(ngram, columns=columns)
+            df.index.name = 'time'
+            df.index = pd.to_datetime(df.index)
+            return df
+
+        else:
+            logger.warning(f"Unsupported language: {lang}")
+
+    @compacting
+    async def get_ngrams_array(self,
+                               ngrams_list: list,
+                               lang: str = 'en',
+                               columns: Optional[list] = None) -> pd.DataFrame:
+        """Query database for an array ngram timeseries (see Realtime.get_ngrams_array)
+
+        Ngrams are partitioned by ngram order, and all collections are queried concurrently.
+        """
+        if self.supported_languages.get(lang) is not None:
+            groups = self.group_array(ngrams_list)
+            if not groups:
+                return None
+
+            async def query_group(n: int, words: list) -> pd.DataFrame:
+                logger.info(f"Retrieving timestamps for [{len(words)}] {n}grams ...")
+                q = await self.query(f'realtime_{n}grams', lang)
+                df = await q.query_ngrams_array(words, columns=columns)
+                df['time'] = pd.to_datetime(df['time'])
+                df.set_index(['time', 'ngram'], inplace=True)
+                return df
+
+            frames = await asyncio.gather(*[query_group(n, words) for n, words in groups.items()])
+            return frames[0] if len(frames) == 1 else pd.concat(frames)
+
+        else:
+            logger.warning(f"Unsupported language: {lang}")
+
+    @compacting
+    async def get_ngrams_tuples(self,
+                                ngrams_list: [(str, str)],
+                                columns: Optional[list] = None) -> pd.DataFrame:
+        """Query database for an array ngram timeseries (see Realtime.get_ngrams_tuples)
+
+        All tuples are queried concurrently (up to `max_concurrency` at once).
+        """
+        async def get_tuple(w: str, lang: str, n: int) -> pd.DataFrame:
+            q = await self.query(f'realtime_{n}grams', lang)
+            df = await q.query_ngram(w, columns=columns)
+
+            df["ngram"] = w
+            df["lang"] = self.supported_languages.get(lang) \
+                if self.supported_languages.get(lang) is not None else "en"
+
+            df.index.name = 'time'
+            df.index = pd.to_datetime(df.index)
+            df.set_index([df.index, 'ngram', 'lang'], inplace=True)
+            return df
+
+        logger.info(f"Retrieving: {len(ngrams_list)} ngrams ...")
+        words = [w.lower() for w, _ in ngrams_list]
+        ngrams = await asyncio.gather(*[
+            get_tuple(w, lang, n)
+            for w, (_, lang), n in zip(words, ngrams_list, ngram_orders(words, self.parser))
+        ])
+        return pd.concat(ngrams)
+
+    @compacting
+    async def get_zipf_dist(self,
+                            dtime: Optional[datetime] = None,
+                            lang: str = 'en',
+                            ngrams: str = '1grams',
+                            max_rank: Optional[int] = None,
+                            min_count: Optional[int] = None,
+                            rt: bool = True,
+                            columns: Optional[list] = None) -> pd.DataFrame:
+        """Query database for ngram Zipf distribution for a given 15-minute batch (see Realtime.get_zipf_dist)"""
+        if self.supported_languages.get(lang) is not None:
+            q = await self.query(f'realtime_{ngrams}', lang)
+
+            if dtime is None or dtime > q.last_updated:
+                dtime = q.last_updated
+            else:
+                dtime = pd.Timestamp(dtime).round(q.time_resolution).to_pydatetime()
+
+            if q.reference_date <= dtime <= q.last_updated:
+                logger.info(f"Retrieving {self.supported_languages.get(lang)} {ngrams} for {dtime} ...")
+
+                df = await q.query_batch(
+                    dtime,
+                    max_rank=max_rank,
+                    min_count=min_count,
+                    rt=rt,
+                    columns=columns,
+                )
+                df.index.name = 'ngram'
+                return df
+
+            else:
+                logger.warning(f"Date should be within the last 30 days")
+        else:
+            logger.warning(f"Unsupported language: {lang}")
+
+    @compacting
+    async def get_zipf_dists(self,
+                             start_time: datetime,
+                             end_time: Optional[datetime] = None,
+                             lang: str = 'en',
+                             ngrams: str = '1grams',
+                             max_rank: Optional[int] = None,
+                             min_count: Optional[int] = None,
+                             rt: bool = True,
+                             columns: Optional[list] = None,
+                             rollup: Optional[str] = None) -> pd.DataFrame:
+        """Query database for ngram Zipf distributions of every 15-minute batch in a time range
+        (see Realtime.get_zipf_dists)"""
+        if self.supported_languages.get(lang) is not None:
+            q = await self.query(f'realtime_{ngrams}', lang)
+            bounds = self.batch_range(q, start_time, end_time)
+
+            if bounds is not None:
+                logger.info(f"Retrieving {self.supported_languages.get(lang)} {ngrams} from {bounds[0]} to {bounds[1]} ...")
+
+                return await q.query_batches(
+                    *bounds,
+                    max_rank=max_rank,
+                    min_count=min_count,
+                    rt=rt,
+                    columns=columns,
+                    rollup=rollup,
+                )
+
+            else:
+                logger.warning(f"Dates should be within the last 30 days")
+        else:
+            logger.warning(f"Unsupported language: {lang}")
+
+    async def iter_zipf_dist(self,
+                             start_time: datetime,
+                             end_time: Optional[datetime] = None,
+                             lang: str = 'en',
+                             ngrams: str = '1grams',
+                             max_rank: Optional[int] = None,
+                             min_count: Optional[int] = None,
+                             rt: bool = True,
+                             columns: Optional[list] = None) -> AsyncIterator[tuple]:
+        """Stream ngram Zipf distributions of every 15-minute batch in a time range (see Realtime.iter_zipf_dist)"""
+        if self.supported_languages.get(lang) is not None:
+            q = await self.query(f'realtime_{ngrams}', lang)
+            bounds = self.batch_range(q, start_time, end_time)
+
+            if bounds is not None:
+                logger.info(f"Streaming {self.supported_languages.get(lang)} {ngrams} from {bounds[0]} to {bounds[1]} ...")
+
+                async for t, df in q.iter_batches(
+                    *bounds,
+                    max_rank=max_rank,
+                    min_count=min_count,
+                    rt=rt,
+                    columns=columns,
+                ):
+                    df.index.name = 'ngram'
+                    yield t, df
+
+            else:
+                logger.warning(f"Dates should be within the last 30 days")
+        else:
+            logger.warning(f"Unsupported language: {lang}")
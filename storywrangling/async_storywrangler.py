@@ -0,0 +1,507 @@
+import asyncio
+import logging
+import pandas as pd
+from typing import AsyncIterator, Callable, Optional, Union
+from datetime import datetime
+
+from storywrangling.storywrangler import StorywranglerBase, get_ngram_int
+from storywrangling.async_query import AsyncQuery
+from storywrangling.compact import compacting
+from storywrangling.progress import ProgressHook
+from storywrangling.connection import connect_async
+from storywrangling.regexr import nparser, ngram_order
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncStorywrangler(StorywranglerBase):
+    """Asyncio API to access the Storywrangler database
+
+    Every method is a coroutine returning the same dataframe as its Storywrangler counterpart.
+    Queries run concurrently on the event loop,
+    with at most `max_concurrency` of them in flight at once.
+
+    The on-disk caches (`cache_dir`, `snapshot_dir`), the result cache (`result_cache_size`),
+    local backends (`backend`) and `prefetch_snapshots` are only available on Storywrangler.
+    """
+
+    def __init__(self,
+                 database: str = 'ALL',
+                 max_pool_size: int = 100,
+                 max_idle_time_ms: Optional[int] = 60000,
+                 max_concurrency: int = 10,
+                 compact: bool = False,
+                 progress: Union[bool, Callable, ProgressHook, None] = True) -> None:
+        """
+        Args:
+            database: desired database to query,
+            please refer to README.rst to see all available options (default: ALL)
+            max_pool_size: max number of concurrent connections to the database (default: 100)
+            max_idle_time_ms: close pooled connections idle for longer than this (default: 60000)
+            max_concurrency: max number of queries in flight at once (default: 10)
+            compact: return compact dtypes (see Storywrangler; default: False)
+            progress: progress reporting (see Storywrangler; default: True)
+        """
+        super().__init__(database, max_pool_size, max_idle_time_ms, compact=compact, progress=progress)
+        self.max_concurrency = max_concurrency
+        self._client = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    def __enter__(self):
+        raise TypeError("use 'async with'")
+
+    @property
+    def client(self):
+        """AsyncMongoClient of this object (created on the first query)"""
+        return self._client
+
+    async def connect(self):
+        """Create the AsyncMongoClient of this object, if needed"""
+        if self._client is None:
+            self._client = await connect_async(
+                max_pool_size=self.max_pool_size,
+                max_idle_time_ms=self.max_idle_time_ms,
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        return self._client
+
+    async def close(self) -> None:
+        """Close the connection pool of this object"""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    async def query(self, db: str, lang: str) -> AsyncQuery:
+        """Create an AsyncQuery on a database collection"""
+        client = await self.connect()
+        return await AsyncQuery.create(db, lang, client, self._semaphore, progress=self.progress)
+
+    async def select_database(self, ngrams: str = '1grams', lang: str = 'en') -> AsyncQuery:
+        if self.database == 'ALL':
+            return await self.query(ngrams, lang)
+        else:
+            return await self.query(f"{self.database}_{ngrams}", lang)
+
+    @compacting
+    async def get_rank(self,
+                       rank: int,
+                       lang: str = 'en',
+                       ngram: str = '1grams',
+                       start_time: Optional[datetime] = None,
+                       end_time: Optional[datetime] = None,
+                       columns: Optional[list] = None) -> pd.DataFrame:
+        """Query database for a rank timeseries (see Storywrangler.get_rank)"""
+        if self.supported_languages.get(lang) is not None:
+            logger.info(f"Retrieving {self.supported_languages.get(lang)} {ngram}: Rank [{rank}]")
+
+            q = await self.select_database(ngram, lang)
+            df = await q.query_rank(rank, start_time=start_time, end_time=end_time, columns=columns)
+            df.index.name = 'time'
+            df.index = pd.to_datetime(df.index)
+            return df
+
+        else:
+            logger.warning(f"Unsupported language: {lang}")
+
+    @compacting
+    async def get_ngram(self,
+                        ngram: str,
+                        lang: str = 'en',
+                        start_time: Optional[datetime] = None,
+                        end_time: Optional[datetime] = None,
+                        only_indexed: bool = False,
+                        columns: Optional[list] = None) -> pd.DataFrame:
+        """Query database for an ngram timeseries (see Storywrangler.get_ngram)"""
+        n = ngram_order(ngram, self.parser)
+
+        if self.check_if_indexed(lang, n) != n:
+
+            logger.warning(f"{n}grams not indexed for {lang}")
+
+            if only_indexed:
+                q = await self.select_database("1grams", lang)
+
+                if self.ngrams_languages.get(lang) is not None:
+                    ngrams = list(nparser(ngram, parser=self.parser, n=1).keys())
+
+                    df = await q.query_ngrams_array(
+                        ngrams,
+                        start_time=start_time,
+                        end_time=end_time,
+                        columns=columns,
+                    )
+                    df['time'] = pd.to_datetime(df['time'])
+                    df.set_index(['time', 'ngram'], inplace=True)
+                    return df
+                else:
+                    logger.warning(f"Unsupported language: {lang}")
+
+        else:
+            q = await self.select_database(f"{n}grams", lang)
+
+            if self.ngrams_languages.get(lang) is not None:
+                logger.info(f"Retrieving {self.ngrams_languages.get(lang)}: {n}gram -- '{ngram}'")
+
+                df = await q.query_ngram(
+                    ngram,
+                    start_time=start_time,
+                    end_time=end_time,
+                    columns=columns,
+                )
+
+                df.index.name = 'time'
+                df.index = pd.to_datetime(df.index)
+                return df
+
+            else:
+                logger.warning(f"Unsupported language: {lang}")
+
+    @compacting
+    async def get_ngrams_array(self,
+                               ngrams_list: list,
+                               lang: str = 'en',
+                               start_time: Optional[datetime] = None,
+                               end_time: Optional[datetime] = None,
+                               columns: Optional[list] = None) -> pd.DataFrame:
+        """Query database for an array ngram timeseries (see Storywrangler.get_ngrams_array)
+
+        Ngrams are partitioned by ngram order, and all collections are queried concurrently.
+        """
+        if self.ngrams_languages.get(lang) is not None:
+            groups = self.group_array(ngrams_list, lang)
+            if not groups:
+                return None
+
+            async def query_group(ngrams: str, words: list) -> pd.DataFrame:
+                logger.info(f"Retrieving: {len(words)} {ngrams} ...")
+                q = await self.select_database(ngrams, lang)
+                df = await q.query_ngrams_array(
+                    words,
+                    start_time=start_time,
+                    end_time=end_time,
+                    columns=columns,
+                )
+                df['time'] = pd.to_datetime(df['time'])
+                df.set_index(['time', 'ngram'], inplace=True)
+                return df
+
+            frames = await asyncio.gather(*[query_group(ngrams, words) for ngrams, words in groups.items()])
+            return frames[0] if len(frames) == 1 else pd.concat(frames)
+
+        else:
+            logger.warning(f"Unsupported language: {lang}")
+
+    @compacting
+    async def get_ngrams_tuples(self,
+                                ngrams_list: [(str, str)],
+                                start_time: Optional[datetime] = None,
+                                end_time: Optional[datetime] = None,
+                                columns: Optional[list] = None) -> pd.DataFrame:
+        """Query database for an array ngram timeseries (see Storywrangler.get_ngrams_tuples)
+
+        Each collection is queried once for all of its ngrams,
+        and all collections are queried concurrently (up to `max_concurrency` at once).
+        """
+        groups, keys = self.group_tuples(ngrams_list)
+
+        async def query_group(ngrams: str, lang: str, words: list) -> dict:
+            q = await self.select_database(ngrams, lang)
+            return await q.query_ngrams_timeseries(
+                words,
+                start_time=start_time,
+                end_time=end_time,
+                columns=columns,
+            )
+
+        logger.info(f"Retrieving: {len(ngrams_list)} ngrams from {len(groups)} collections ...")
+        frames = await asyncio.gather(*[
+            query_group(ngrams, lang, words) for (ngrams, lang), words in groups.items()
+        ])
+        return self.stitch_tuples(ngrams_list, keys, dict(zip(groups.keys(), frames)))
+
+    @compacting
+    async def get_lang(self,
+                       lang: Optional[str] = None,
+                       start_time: Optional[datetime] = None,
+                       end_time: Optional[datetime] = None) -> pd.DataFrame:
+        """Query database for language usage timeseries (see Storywrangler.get_lang)"""
+        logger.info(f"Retrieving: {lang} -- {self.supported_languages.get(lang)}")
+
+        if self.supported_languages.get(lang) is not None:
+            q = await self.query("languages", "languages")
+            df = await q.query_languages(
+                lang,
+                start_time,
+                end_time,
+            )
+            df.index = pd.to_datetime(df.index)
+            df.index.name = 'time'
+            return df
+        else:
+            logger.warning(f"Unsupported language: {lang}")
+
+    @compacting
+    async def get_zipf_dist(self,
+                            date: datetime,
+                            lang: str = 'en',
+                            ngrams: str = '1grams',
+                            max_rank: Optional[int] = None,
+                            min_count: Optional[int] = None,
+                            top_n: Optional[int] = None,
+                            rt: bool = True,
+                            ngram_filter: str = None,
+                            columns: Optional[list] = None) -> pd.DataFrame:
+        """Query database for ngram Zipf distribution for a given day (see Storywrangler.get_zipf_dist)"""
+        ngram_order = get_ngram_int(ngrams)
+
+        if self.ngrams_languages.get(lang) is not None:
+            logger.info(f"Retrieving {self.ngrams_languages.get(lang)} {ngrams} for {date.date()} ...")
+
+            q = await self.select_database(ngrams, lang)
+            df = await q.query_day(
+                date,
+                max_rank=max_rank,
+                min_count=min_count,
+                top_n=top_n,
+                rt=rt,
+                ngram_order=ngram_order,
+                ngram_filter=ngram_filter,
+                columns=columns,
+            )
+            df.index.name = 'ngram'
+            return df
+
+        else:
+            logger.warning(f"Unsupported language: {lang}")
+
+    @compacting
+    async def get_zipf_dists(self,
+                             start_time: datetime,
+                             end_time: datetime,
+                             lang: str = 'en',
+                             ngrams: str = '1grams',
+                             max_rank: Optional[int] = None,
+                             min_count: Optional[int] = None,
+                             top_n: Optional[int] = None,
+                             rt: bool = True,
+                             ngram_filter: str = None,
+                             columns: Optional[list] = None,
+                             by_day: bool = False) -> Union[pd.DataFrame, dict]:
+        """Query database for ngram Zipf distributions of every day in a date range (see Storywrangler.get_zipf_dists)
+
+        Days are queried concurrently (up to `max_concurrency` at once).
+        """
+        if self.ngrams_languages.get(lang) is not None:
+            days = list(pd.date_range(start_time, end_time, freq='D').to_pydatetime())
+            if not days:
+                logger.warning(f"Empty date range: {start_time.date()} to {end_time.date()}")
+                return None
+
+            frames = await asyncio.gather(*[
+                self.get_zipf_dist(
+                    d,
+                    lang=lang,
+                    ngrams=ngrams,
+                    max_rank=max_rank,
+                    min_count=min_count,
+                    top_n=top_n,
+                    rt=rt,
+                    ngram_filter=ngram_filter,
+                    columns=columns,
+                )
+                for d in days
+            ])
+
+            if by_day:
+                return dict(zip(days, frames))
+
+            return pd.concat(frames, keys=pd.DatetimeIndex(days), names=['time', 'ngram'])
+
+        else:
+            logger.warning(f"Unsupported language: {lang}")
+
+    async def iter_zipf_dist(self,
+                             date: datetime,
+                             lang: str = 'en',
+                             ngrams: str = '1grams',
+                             max_rank: Optional[int] = None,
+                             min_count: Optional[int] = None,
+                             rt: bool = True,
+                             ngram_filter: str = None,
+                             columns: Optional[list] = None,
+                             chunk_size: int = 100000) -> AsyncIterator[pd.DataFrame]:
+        """Stream ngram Zipf distribution for a given day in chunks (see Storywrangler.iter_zipf_dist)"""
+        if self.ngrams_languages.get(lang) is not None:
+            logger.info(f"Streaming {self.ngrams_languages.get(lang)} {ngrams} for {date.date()} ...")
+
+            q = await self.select_database(ngrams, lang)
+            async for df in q.iter_day(
+                date,
+                max_rank=max_rank,
+                min_count=min_count,
+                rt=rt,
+                ngram_order=get_ngram_int(ngrams),
+                ngram_filter=ngram_filter,
+                columns=columns,
+                chunk_size=chunk_size,
+            ):
+                df.index.name = 'ngram'
+                yield df
+
+        else:
+            logger.warning(f"Unsupported language: {lang}")
+
+    @compacting
+    async def get_divergence(self,
+                             date: datetime,
+                             lang: str = 'en',
+                             ngrams: str = '1grams',
+                             max_rank: Optional[int] = None,
+                             top_n: Optional[int] = None,
+                             rt: bool = True,
+                             ngram_filter: str = None,
+                             columns: Optional[list] = None) -> pd.DataFrame:
+        """Get a list of narratively trending ngrams for a given day (see Storywrangler.get_divergence)"""
+        if self.supported_languages.get(lang) is not None:
+            logger.info(
+                f"Retrieving {self.supported_languages.get('en')} RTD {ngrams} for {date.date()} ..."
+            )
+
+            q = await self.query(f"rd_{ngrams}", lang)
+            df = await q.query_divergence(
+                date,
+                max_rank=max_rank,
+                rt=rt,
+                top_n=top_n,
+                ngram_filter=ngram_filter,
+                columns=columns,
+            )
+            df.index.name = 'ngram'
+            return df
+        else:
+            logger.warning(f"Unsupported language: {lang}")
+
+    @compacting
+    async def get_divergences(self,
+                              start_time: datetime,
+                              end_time: datetime,
+                              lang: str = 'en',
+                              ngrams: str = '1grams',
+                              max_rank: Optional[int] = None,
+                              top_n: Optional[int] = None,
+                              rt: bool = True,
+                              ngram_filter: str = None,
+                              columns: Optional[list] = None) -> pd.DataFrame:
+        """Get the narratively trending ngrams of every day in a date range (see Storywrangler.get_divergences)"""
+        if self.supported_languages.get(lang) is not None:
+            logger.info(
+                f"Retrieving {self.supported_languages.get('en')} RTD {ngrams} "
+                f"from {start_time.date()} to {end_time.date()} ..."
+            )
+
+            q = await self.query(f"rd_{ngrams}", lang)
+            return await q.query_divergences(
+                start_time,
+                end_time,
+                max_rank=max_rank,
+                top_n=top_n,
+                rt=rt,
+                ngram_order=get_ngram_int(ngrams),
+                ngram_filter=ngram_filter,
+                columns=columns,
+            )
+        else:
+            logger.warning(f"Unsupported language: {lang}")
+
+    @compacting
+    async def get_rd_timeseries(self,
+                                dates: tuple,
+                                lang: str = 'en',
+                                ngrams: str = '1grams',
+                                rt: bool = True,
+                                columns: Optional[list] = None) -> pd.DataFrame:
+        """Get the top narratively trending ngrams over a date range (see Storywrangler.get_rd_timeseries)"""
+        if self.supported_languages.get(lang) is not None:
+            logger.info(
+                f"Retrieving {self.supported_languages.get('en')} RTD {ngrams} "
+                f"from {dates[0].date()} to {dates[1].date()} ..."
+            )
+
+            q = await self.query(f"rd_{ngrams}", lang)
+            df = await q.query_rd_timeseries(
+                dates,
+                rt=rt,
+                columns=columns,
+            )
+            df.index.name = 'ngram'
+            return df
+        else:
+            logger.warning(f"Unsupported language: {lang}")
+
+    async def period_distribution(self,
+                                  period,
+                                  lang: str = 'en',
+                                  ngrams: str = '1grams') -> (Optional[pd.DataFrame], datetime):
+        """Counts of a Zipf distribution of a day, or of every day in a (start, end) period
+        (see Storywrangler.period_distribution)"""
+        days, end = self.period_days(period)
+        frames = await asyncio.gather(*[
+            self.get_zipf_dist(d, lang=lang, ngrams=ngrams, columns=['count', 'count_no_rt'])
+            for d in days
+        ])
+        return self.merge_days(frames), end
+
+    @compacting
+    async def compute_divergence(self,
+                                 first,
+                                 second,
+                                 lang: str = 'en',
+                                 ngrams: str = '1grams',
+                                 lang_2: Optional[str] = None,
+                                 alpha: float = 1 / 4,
+                                 max_rank: Optional[int] = None,
+                                 top_n: Optional[int] = None,
+                                 rt: bool = True,
+                                 ngram_filter: str = None,
+                                 columns: Optional[list] = None) -> pd.DataFrame:
+        """Compute rank-turbulence divergence between any two days (or periods) (see Storywrangler.compute_divergence)
+
+        Days of both sides are queried concurrently (up to `max_concurrency` at once).
+        """
+        lang_2 = lang_2 if lang_2 is not None else lang
+
+        if self.ngrams_languages.get(lang) is not None and self.ngrams_languages.get(lang_2) is not None:
+            logger.info(f"Computing RTD {ngrams} between {lang} {first} and {lang_2} {second} ...")
+
+            (zipf_1, time_1), (zipf_2, time_2) = await asyncio.gather(
+                self.period_distribution(first, lang, ngrams),
+                self.period_distribution(second, lang_2, ngrams),
+            )
+
+            if zipf_1 is not None and zipf_2 is not None:
+                return self.rank_divergence(
+                    await self.select_database(ngrams, lang_2),
+                    zipf_1,
+                    zipf_2,
+                    time_1,
+                    time_2,
+                    alpha=alpha,
+                    max_rank=max_rank,
+                    top_n=top_n,
+                    rt=rt,
+                    ngram_order=get_ngram_int(ngrams),
+                    ngram_filter=ngram_filter,
+                    columns=columns,
+                )
+
+            else:
+                logger.warning(f"No Zipf distribution found for {first if zipf_1 is None else second}")
+        else:
+            logger.warning(f"Unsupported language: {lang if self.ngrams_languages.get(lang) is None else lang_2}")
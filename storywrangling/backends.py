@@ -0,0 +1,458 @@
+"""Database backends
+
+`Query` only needs a client mapping database and collection names to collections
+(`client[database][lang]`), and collections answering the subset of the pymongo API it uses
+(`find`, `find_one`, `find_raw_batches`, `aggregate`, `aggregate_raw_batches`).
+The default backend is the pooled MongoClient of the Storywrangler server;
+`SQLiteBackend` serves the same queries from a local replica.
+
+Replicate languages and date ranges for offline use:
+
+    python -m storywrangling.backends ~/storywrangling/replica --lang en fr --ngrams 1grams 2grams \
+        --start 2020-01-01 --end 2020-12-31 [--languages] [--divergence]
+"""
+import re
+import sqlite3
+import sys
+import logging
+import argparse
+import threading
+from pathlib import Path
+from itertools import islice
+from typing import Iterable, Iterator, Optional, Union
+from datetime import datetime
+
+import bson
+from pymongo import ASCENDING
+
+logger = logging.getLogger(__name__)
+
+# fixed-width timestamps, so they compare in the same order as strings
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# documents fields to index (in this order) when present
+INDEXES = [
+    ('word', 'time'),
+    ('time', 'rank'),
+    ('ngram', 'time_2'),
+    ('time_2', 'rd_contribution'),
+    ('language', 'time'),
+]
+
+
+def quote(name: str) -> str:
+    """Quote a table, index, or column name"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def sql_type(value) -> str:
+    """Column type of a document field"""
+    if isinstance(value, datetime):
+        return 'DATETIME'
+    elif isinstance(value, (bool, int)):
+        return 'INTEGER'
+    elif isinstance(value, float):
+        return 'REAL'
+    return 'TEXT'
+
+
+def to_sql(value):
+    """Convert a document value (or a query operand) to a SQLite value"""
+    if isinstance(value, datetime):
+        return value.strftime(TIME_FORMAT)
+    return value
+
+
+def regexp(pattern: str, value) -> bool:
+    """REGEXP function of SQLite, with the search semantics of mongo's $regex"""
+    return isinstance(value, str) and re.search(pattern, value) is not None
+
+
+class SQLiteCollection:
+    """Collection of a local replica, stored as a table of a SQLite database"""
+
+    def __init__(self, database: 'SQLiteDatabase', name: str) -> None:
+        self.database = database
+        self.name = name
+        self.full_name = f"{database.name}.{name}"
+        self.table = quote(name)
+
+    def columns(self) -> dict:
+        """Column types of the table, keyed by column name (empty if the collection was not replicated)"""
+        rows = self.database.connection().execute(f"PRAGMA table_info({self.table})").fetchall()
+        return {r[1]: r[2] for r in rows}
+
+    def where(self, query: Optional[dict], columns: dict) -> (str, list):
+        """Translate a mongo filter to a SQL condition
+
+        Supports equality, `$in`, `$gt`, `$gte`, `$lt`, `$lte`, `$regex`, and `$not` of a `$regex`,
+        which covers every filter built by `Query`.
+        """
+        conditions, params = [], []
+
+        for field, cond in (query or {}).items():
+            col = quote(field)
+
+            if not isinstance(cond, dict):
+                cond = {'$eq': cond}
+
+            for op, operand in cond.items():
+                if op == '$not' and list(operand) != ['$regex']:
+                    raise ValueError(f"Unsupported operator in a local query: $not {operand}")
+
+                if field not in columns:
+                    # like documents without the field: nothing matches, except negations
+                    conditions.append("1" if op == '$not' else "0")
+                elif op == '$not':
+                    conditions.append(f"NOT ({col} REGEXP ?)")
+                    params.append(operand['$regex'])
+                elif op == '$eq':
+                    conditions.append(f"{col} = ?")
+                    params.append(to_sql(operand))
+                elif op == '$in':
+                    conditions.append(f"{col} IN ({', '.join('?' * len(operand))})" if operand else "0")
+                    params.extend(to_sql(v) for v in operand)
+                elif op in ('$gt', '$gte', '$lt', '$lte'):
+                    sign = {'$gt': '>', '$gte': '>=', '$lt': '<', '$lte': '<='}[op]
+                    conditions.append(f"{col} {sign} ?")
+                    params.append(to_sql(operand))
+                elif op == '$regex':
+                    conditions.append(f"{col} REGEXP ?")
+                    params.append(operand)
+                else:
+                    raise ValueError(f"Unsupported operator in a local query: {op}")
+
+        return " AND ".join(conditions) if conditions else "1", params
+
+    def select(self,
+               query: Optional[dict] = None,
+               projection: Optional[dict] = None,
+               sort: Optional[Union[dict, list]] = None,
+               limit: int = 0,
+               per: Optional[str] = None) -> Iterator[dict]:
+        """Matching documents (with only the projected fields, and without missing values)
+
+        With `per`, `sort` and `limit` apply to each value of that field instead (e.g. the top documents of each day).
+        """
+        columns = self.columns()
+        if not columns:
+            logger.warning(f"{self.full_name} is missing from the local replica")
+            return iter(())
+
+        if projection is not None and not any(projection.values()):
+            # exclusion projection (e.g. {'_id': 0}): every other field
+            fields = [c for c in columns if c not in projection]
+        else:
+            fields = [c for c in columns if projection is None or projection.get(c)]
+
+        if not fields:
+            return iter(())
+
+        condition, params = self.where(query, columns)
+        sql = f"SELECT {', '.join(map(quote, fields))} FROM {self.table} WHERE {condition}"
+
+        order = [(f, d) for f, d in (sort.items() if isinstance(sort, dict) else sort or []) if f in columns]
+        order = ", ".join(f"{quote(f)} {'ASC' if d == ASCENDING else 'DESC'}" for f, d in order)
+
+        if per is not None and per in columns:
+            window = f"PARTITION BY {quote(per)}" + (f" ORDER BY {order}" if order else "")
+            sql = f"SELECT {', '.join(map(quote, fields))} FROM (" \
+                  f"SELECT *, ROW_NUMBER() OVER ({window}) AS _row FROM {self.table} WHERE {condition})"
+            if limit:
+                sql += f" WHERE _row <= {int(limit)}"
+            sql += f" ORDER BY {quote(per)}, _row"
+        else:
+            if order:
+                sql += f" ORDER BY {order}"
+            if limit:
+                sql += f" LIMIT {int(limit)}"
+
+        times = [i for i, f in enumerate(fields) if columns[f] == 'DATETIME']
+        cursor = self.database.connection().execute(sql, params)
+
+        def documents():
+            for row in cursor:
+                if times:
+                    row = list(row)
+                    for i in times:
+                        if row[i] is not None:
+                            row[i] = datetime.fromisoformat(row[i])
+
+                yield {f: v for f, v in zip(fields, row) if v is not None}
+
+        return documents()
+
+    def find(self, filter: Optional[dict] = None, projection: Optional[dict] = None, **kwargs) -> Iterator[dict]:
+        """Same as `Collection.find` (supports `sort` and `limit`)"""
+        return self.select(filter, projection, kwargs.get('sort'), kwargs.get('limit', 0))
+
+    def find_one(self, filter: Optional[dict] = None, *args, **kwargs) -> Optional[dict]:
+        """Same as `Collection.find_one`"""
+        return next(self.find(filter, *args, limit=1, **kwargs), None)
+
+    def find_raw_batches(self,
+                         filter: Optional[dict] = None,
+                         projection: Optional[dict] = None,
+                         batch_size: int = 10000,
+                         **kwargs) -> Iterator[bytes]:
+        """Same as `Collection.find_raw_batches`"""
+        return self.batches(self.find(filter, projection, **kwargs), batch_size)
+
+    def aggregate(self, pipeline: list, **kwargs) -> Iterator[dict]:
+        """Same as `Collection.aggregate` for pipelines of `$match`, `$sort`, `$limit`, and `$project` stages,
+        and for the top documents per group built by `Query.query_plan`
+        (`$group` of a single `$topN`, followed by `$unwind` and `$replaceRoot`)
+        """
+        query, sort, limit, projection, per = None, None, 0, None, None
+
+        for stage in pipeline:
+            (op, arg), = stage.items()
+            if op == '$match' and query is None and sort is None:
+                query = arg
+            elif op == '$sort' and sort is None and not limit:
+                sort = arg
+            elif op == '$limit' and per is None:
+                limit = min(limit, arg) if limit else arg
+            elif op == '$project' and projection is None and per is None:
+                projection = arg
+            elif op == '$group' and per is None and sort is None and not limit and projection is None:
+                acc, = [v for k, v in arg.items() if k != '_id']
+                if not (isinstance(arg['_id'], str) and arg['_id'].startswith('$') and list(acc) == ['$topN']):
+                    raise ValueError(f"Unsupported aggregation stage in a local query: {op} {arg}")
+
+                top = acc['$topN']
+                per, sort, limit = arg['_id'][1:], top['sortBy'], top['n']
+                projection = None if top['output'] == '$$ROOT' else {f: 1 for f in top['output']}
+            elif op in ('$unwind', '$replaceRoot') and per is not None:
+                continue
+            else:
+                raise ValueError(f"Unsupported aggregation stage in a local query: {op}")
+
+        return self.select(query, projection, sort, limit, per)
+
+    def aggregate_raw_batches(self, pipeline: list, batch_size: int = 10000, **kwargs) -> Iterator[bytes]:
+        """Same as `Collection.aggregate_raw_batches`"""
+        return self.batches(self.aggregate(pipeline), batch_size)
+
+    @staticmethod
+    def batches(docs: Iterable[dict], batch_size: int) -> Iterator[bytes]:
+        """Encode documents into raw BSON batches"""
+        docs = iter(docs)
+        while True:
+            batch = list(islice(docs, batch_size))
+            if not batch:
+                return
+            yield b"".join(map(bson.encode, batch))
+
+    def insert_many(self, documents: Iterable[dict]) -> int:
+        """Insert documents, adding columns (and indexes) for new fields
+
+        Returns:
+            number of documents inserted
+        """
+        documents = [{k: v for k, v in d.items() if k != '_id'} for d in documents]
+        if not documents:
+            return 0
+
+        connection = self.database.connection()
+        columns = self.columns()
+        new = {}
+        for d in documents:
+            for k, v in d.items():
+                if k not in columns and k not in new and v is not None:
+                    new[k] = sql_type(v)
+
+        with connection:
+            if not columns:
+                definition = ', '.join(f"{quote(k)} {t}" for k, t in new.items())
+                connection.execute(f"CREATE TABLE IF NOT EXISTS {self.table} ({definition})")
+            else:
+                for k, t in new.items():
+                    connection.execute(f"ALTER TABLE {self.table} ADD COLUMN {quote(k)} {t}")
+
+            columns = {**columns, **new}
+            fields = list(columns)
+            connection.executemany(
+                f"INSERT INTO {self.table} ({', '.join(map(quote, fields))}) "
+                f"VALUES ({', '.join('?' * len(fields))})",
+                ([to_sql(d.get(f)) for f in fields] for d in documents),
+            )
+
+            if new:
+                self.create_indexes(columns)
+
+        return len(documents)
+
+    def delete_many(self, filter: Optional[dict] = None) -> int:
+        """Delete matching documents, returning the number of documents deleted"""
+        columns = self.columns()
+        if not columns:
+            return 0
+
+        condition, params = self.where(filter, columns)
+        with self.database.connection() as connection:
+            return connection.execute(f"DELETE FROM {self.table} WHERE {condition}", params).rowcount
+
+    def create_indexes(self, columns: Optional[dict] = None) -> None:
+        """Index the fields queried by `Query` (see `INDEXES`)"""
+        columns = columns if columns is not None else self.columns()
+
+        for fields in INDEXES:
+            if all(f in columns for f in fields):
+                name = quote(f"{self.name}_{'_'.join(fields)}")
+                self.database.connection().execute(
+                    f"CREATE INDEX IF NOT EXISTS {name} ON {self.table} ({', '.join(map(quote, fields))})"
+                )
+
+
+class SQLiteDatabase:
+    """Database of a local replica, stored as a SQLite file (one table per collection)"""
+
+    def __init__(self, client: 'SQLiteBackend', name: str) -> None:
+        self.client = client
+        self.name = name
+        self.file = client.path / f"{name}.sqlite"
+        self._local = threading.local()
+
+    def __getitem__(self, name: str) -> SQLiteCollection:
+        return SQLiteCollection(self, name)
+
+    def connection(self) -> sqlite3.Connection:
+        """SQLite connection of the calling thread"""
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is None:
+            connection = sqlite3.connect(str(self.file))
+            connection.create_function('REGEXP', 2, regexp)
+            self._local.connection = connection
+
+        return connection
+
+    def list_collection_names(self) -> list:
+        """Names of the collections in the replica"""
+        rows = self.connection().execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+        return [r[0] for r in rows]
+
+
+class SQLiteBackend:
+    """Local replica of the Storywrangler database, used in place of a MongoClient
+
+    Each database is a SQLite file under `path` (e.g. `1grams.sqlite`),
+    holding one table per language collection,
+    indexed on (word, time) and (time, rank) so that `get_ngram` and `get_zipf_dist`
+    run at local disk speed.
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        """
+        Args:
+            path: directory of the replica (created if missing)
+        """
+        self.path = Path(path).expanduser()
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._databases = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> SQLiteDatabase:
+        with self._lock:
+            if name not in self._databases:
+                self._databases[name] = SQLiteDatabase(self, name)
+
+            return self._databases[name]
+
+    def list_database_names(self) -> list:
+        """Names of the databases in the replica"""
+        return sorted(f.stem for f in self.path.glob('*.sqlite'))
+
+    def replicate(self,
+                  source,
+                  database: str,
+                  lang: str,
+                  start_time: Optional[datetime] = None,
+                  end_time: Optional[datetime] = None,
+                  batch_size: int = 10000) -> int:
+        """Copy a date range of a collection into the replica, replacing any documents already copied
+
+        Args:
+            source: client of the source database (e.g. a MongoClient)
+            database: database of the collection (e.g. "1grams", "rd_1grams", "languages")
+            lang: language collection
+            start_time: starting date (default: first day of the collection)
+            end_time: ending date (default: last day of the collection)
+            batch_size: number of documents to copy at once
+
+        Returns:
+            number of documents copied
+        """
+        from storywrangling.metadata import metadata_cache
+
+        collection = source[database][lang]
+        metadata = metadata_cache.get(collection)
+
+        if metadata.time_field is None:
+            query = {}
+        else:
+            query = {
+                metadata.time_field: {
+                    "$gte": start_time if start_time else metadata.reference_date,
+                    "$lte": end_time if end_time else metadata.last_updated,
+                }
+            }
+
+        target = self[database][lang]
+        target.delete_many(query)
+
+        docs = collection.find(query, {'_id': 0}, batch_size=batch_size)
+        copied = 0
+        while True:
+            batch = list(islice(docs, batch_size))
+            if not batch:
+                break
+            copied += target.insert_many(batch)
+
+        logger.info(f"Copied {copied} documents to {target.full_name}")
+        return copied
+
+
+def day(value: str) -> datetime:
+    """Parse a YYYY-MM-DD date"""
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+def main():
+    from storywrangling.connection import registry
+
+    parser = argparse.ArgumentParser(description="Replicate languages and date ranges into a local SQLite backend")
+    parser.add_argument("path", help="replica directory")
+    parser.add_argument("--lang", nargs="+", default=["en"], help="target languages (iso codes)")
+    parser.add_argument("--ngrams", nargs="+", default=["1grams"], help="target ngram collections")
+    parser.add_argument("--start", type=day, help="first day (YYYY-MM-DD, default: first day available)")
+    parser.add_argument("--end", type=day, help="last day (YYYY-MM-DD, default: last day available)")
+    parser.add_argument("--database", default="ALL", help="desired database to replicate")
+    parser.add_argument("--divergence", action="store_true", help="also replicate rank divergences")
+    parser.add_argument("--languages", action="store_true", help="also replicate language usage")
+    parser.add_argument("--batch-size", type=int, default=10000, help="documents to copy at once")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        stream=sys.stdout,
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    backend = SQLiteBackend(args.path)
+    source = registry.get_client()
+    prefix = "" if args.database == "ALL" else f"{args.database}_"
+
+    collections = [(f"{prefix}{n}", lang) for n in args.ngrams for lang in args.lang]
+    if args.divergence:
+        collections += [(f"rd_{n}", lang) for n in args.ngrams for lang in args.lang]
+    if args.languages:
+        collections.append(("languages", "languages"))
+
+    for database, lang in collections:
+        backend.replicate(source, database, lang, args.start, args.end, batch_size=args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
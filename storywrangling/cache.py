@@ -0,0 +1,337 @@
+import os
+import sys
+import hashlib
+import logging
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, NamedTuple, Optional, Union
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class TimeseriesCache:
+    """On-disk cache of daily ngram timeseries
+
+    Each timeseries is stored as a Parquet file under a directory per database collection
+    (`<path>/<database>/<lang>/<hash of the ngram>.parquet`),
+    covering every day from the first day of the collection to the last one fetched,
+    so a stale timeseries only needs the days after its last row.
+    Once the cache grows past `max_bytes`, the least recently used files are evicted.
+    """
+
+    def __init__(self, path: Union[str, Path], max_bytes: int = 2 * 1024 ** 3) -> None:
+        """
+        Args:
+            path: directory to store the cache in (created if missing)
+            max_bytes: max size of the cache on disk
+        """
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError("The timeseries cache requires pyarrow")
+
+        self.path = Path(path).expanduser()
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+        self._files = None
+        self._lock = threading.Lock()
+
+    def file(self, database: str, lang: str, ngram: str) -> Path:
+        """Path of the cached timeseries of an ngram"""
+        digest = hashlib.sha1(ngram.encode('utf-8')).hexdigest()
+        return self.path / database / lang / f"{digest}.parquet"
+
+    def files(self) -> dict:
+        """Size and last access time of every cached file, keyed by path (scanned on first use)"""
+        if self._files is None:
+            self._files = {}
+            for f in self.path.rglob('*.parquet'):
+                stat = f.stat()
+                self._files[f] = (stat.st_size, stat.st_mtime)
+
+        return self._files
+
+    @property
+    def size(self) -> int:
+        """Size of the cache on disk (bytes)"""
+        with self._lock:
+            return sum(size for size, _ in self.files().values())
+
+    def load(self, database: str, lang: str, ngram: str) -> Optional[pd.DataFrame]:
+        """Read the cached timeseries of an ngram, if any
+
+        Args:
+            database: database of the collection
+            lang: language collection
+            ngram: target ngram
+
+        Returns:
+            dataframe with a DatetimeIndex, or None if missing
+        """
+        f = self.file(database, lang, ngram)
+
+        try:
+            df = pd.read_parquet(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable cache file {f}: {e}")
+            self.remove(f)
+            return None
+
+        # the modification time doubles as the last access time for eviction
+        os.utime(f)
+        with self._lock:
+            self.files()[f] = (f.stat().st_size, f.stat().st_mtime)
+
+        return df
+
+    def store(self, database: str, lang: str, ngram: str, df: pd.DataFrame) -> None:
+        """Write the timeseries of an ngram, evicting old files if the cache is full
+
+        Args:
+            database: database of the collection
+            lang: language collection
+            ngram: target ngram
+            df: dataframe with a DatetimeIndex
+        """
+        f = self.file(database, lang, ngram)
+        f.parent.mkdir(parents=True, exist_ok=True)
+
+        # write to a temporary file first, so readers never see a partial file
+        tmp = f.with_name(f"{f.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        df.to_parquet(tmp)
+        os.replace(tmp, f)
+
+        with self._lock:
+            self.files()[f] = (f.stat().st_size, f.stat().st_mtime)
+
+        self.evict()
+
+    def remove(self, f: Path) -> None:
+        """Delete a cached file"""
+        with self._lock:
+            self.files().pop(f, None)
+
+        try:
+            f.unlink()
+        except FileNotFoundError:
+            pass
+
+    def evict(self) -> None:
+        """Delete the least recently used files until the cache fits in `max_bytes`"""
+        with self._lock:
+            files = self.files()
+            total = sum(size for size, _ in files.values())
+
+            for f, (size, _) in sorted(files.items(), key=lambda item: item[1][1]):
+                if total <= self.max_bytes:
+                    break
+
+                try:
+                    f.unlink()
+                except FileNotFoundError:
+                    pass
+
+                del files[f]
+                total -= size
+
+    def invalidate(self,
+                   database: Optional[str] = None,
+                   lang: Optional[str] = None,
+                   ngram: Optional[str] = None) -> None:
+        """Drop cached timeseries matching a database, language and/or ngram (default: everything)
+
+        Args:
+            database: database of the collection (e.g. "1grams")
+            lang: language collection
+            ngram: target ngram (requires `database` and `lang`)
+        """
+        if ngram is not None:
+            if database is None or lang is None:
+                logger.warning("Invalidating an ngram requires its database and language")
+            else:
+                self.remove(self.file(database, lang, ngram))
+            return
+
+        if lang is not None and database is None:
+            paths = [p for p in self.path.glob(f"*/{lang}") if p.is_dir()]
+        elif lang is not None:
+            paths = [self.path / database / lang]
+        elif database is not None:
+            paths = [self.path / database]
+        else:
+            paths = [p for p in self.path.iterdir() if p.is_dir()]
+
+        for p in paths:
+            shutil.rmtree(p, ignore_errors=True)
+
+        with self._lock:
+            self._files = None
+
+
+class CacheStats(NamedTuple):
+    """Usage statistics of a result cache"""
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    size: int
+    max_bytes: int
+
+
+def copy_on_write() -> bool:
+    """Whether pandas copies shared data on write (always on from pandas 3.0)"""
+    if int(pd.__version__.split('.')[0]) >= 3:
+        return True
+
+    try:
+        return pd.get_option('mode.copy_on_write') is True
+    except (KeyError, pd.errors.OptionError):
+        return False
+
+
+def freeze(value: Any) -> Any:
+    """Hashable version of a query argument (e.g. lists of ngrams or columns)"""
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    elif isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    elif isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+def nbytes(value: Any) -> int:
+    """Memory used by a query result (dataframes, or dictionaries of dataframes)"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    elif isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    elif isinstance(value, dict):
+        return sum(nbytes(v) for v in value.values())
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """In-memory LRU cache of query results
+
+    Results are keyed by API method, arguments, and database collection,
+    and tagged with the `last_updated` date of that collection,
+    so they are served again until new data lands in the database.
+    Once the cache grows past `max_bytes`, the least recently used results are evicted.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 ** 2, copy: bool = True) -> None:
+        """
+        Args:
+            max_bytes: max memory used by cached results
+            copy: return a deep copy of cached dataframes,
+            otherwise views sharing memory with the cache,
+            which pandas copies on write so the cached result is never modified
+            (needs copy-on-write, i.e. pandas >= 3.0; always copy otherwise)
+        """
+        self.max_bytes = max_bytes
+        self.copy = copy or not copy_on_write()
+
+        self._entries = OrderedDict()
+        self._size = 0
+        self._hits = self._misses = self._evictions = 0
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self) -> CacheStats:
+        """Hits, misses, evictions, and size of the cache"""
+        with self._lock:
+            return CacheStats(
+                self._hits,
+                self._misses,
+                self._evictions,
+                len(self._entries),
+                self._size,
+                self.max_bytes,
+            )
+
+    def share(self, value: Any) -> Any:
+        """Copy (or view) of a cached result to hand out to the caller"""
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            return value.copy(deep=self.copy)
+        elif isinstance(value, dict):
+            return {k: self.share(v) for k, v in value.items()}
+        return value
+
+    def get(self, key: tuple, version: datetime) -> Optional[Any]:
+        """Cached result of a query, if any and still at the given version"""
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and entry[0] != version:
+                # the collection was updated since this result was cached
+                self._drop(key)
+                entry = None
+
+            if entry is None:
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+
+        return self.share(entry[1])
+
+    def put(self, key: tuple, version: datetime, value: Any) -> None:
+        """Cache the result of a query, evicting old results if the cache is full"""
+        size = nbytes(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+            self._entries[key] = (version, value, size)
+            self._size += size
+
+            while self._size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._evictions += 1
+
+    def _drop(self, key: tuple) -> None:
+        """Remove an entry (the lock must be held)"""
+        _, _, size = self._entries.pop(key)
+        self._size -= size
+
+    def memoize(self, q, method: str, args: tuple, fn: Callable[[], Any]) -> Any:
+        """Result of `fn`, cached until the collection of `q` is updated
+
+        Args:
+            q: query on the collection the result comes from
+            method: name of the API method
+            args: arguments of the API method
+            fn: function computing the result
+
+        Returns:
+            copy of the (cached) result
+        """
+        key = (method, q.database.full_name, freeze(args))
+        value = self.get(key, q.last_updated)
+
+        if value is None:
+            value = fn()
+            if value is not None:
+                self.put(key, q.last_updated, value)
+                value = self.share(value)
+
+        return value
+
+    def clear(self) -> None:
+        """Drop every cached result"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
@@ -0,0 +1,151 @@
+from operator import itemgetter
+from typing import Callable, Iterable, Optional
+
+import bson
+import numpy as np
+import pandas as pd
+
+
+def column(values: list) -> np.ndarray:
+    """Convert a list of field values to an array
+
+    Numbers go to a typed array (float64 with NaN if any value is missing),
+    anything else (e.g. ngrams, timestamps) to an object array.
+    """
+    if not isinstance(values[0], str):
+        arr = np.asarray(values)
+
+        if arr.ndim == 1 and arr.dtype.kind in 'biuf':
+            return arr
+
+        if arr.ndim == 1 and arr.dtype.kind == 'O' and any(v is None for v in values):
+            try:
+                return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+            except (TypeError, ValueError):
+                pass
+
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = values
+    return arr
+
+
+def field_values(docs: list, fields: list) -> list:
+    """Transpose documents into one list of values per field (None for missing values)"""
+    try:
+        if len(fields) == 1:
+            return [list(map(itemgetter(fields[0]), docs))]
+        return list(zip(*map(itemgetter(*fields), docs)))
+    except KeyError:
+        return [[d.get(f) for d in docs] for f in fields]
+
+
+class ColumnBuffer:
+    """Preallocated arrays (one per document field) filled one raw BSON batch at a time
+
+    Only one batch of documents is decoded into Python objects at any point;
+    arrays grow geometrically and are upcast (e.g. int64 to float64) if a later batch needs it.
+    """
+
+    def __init__(self, fields: list, capacity: int = 1024) -> None:
+        """
+        Args:
+            fields: document fields to keep
+            capacity: initial number of rows to allocate
+        """
+        self.fields = list(fields)
+        self.capacity = capacity
+        self.size = 0
+        self.columns = {}
+
+    def reserve(self, n: int) -> None:
+        """Make room for `n` more rows"""
+        if self.size + n > self.capacity:
+            self.capacity = max(2 * self.capacity, self.size + n)
+
+            for f, arr in self.columns.items():
+                grown = np.empty(self.capacity, dtype=arr.dtype)
+                grown[:self.size] = arr[:self.size]
+                self.columns[f] = grown
+
+    def allocate(self, dtype: np.dtype) -> np.ndarray:
+        """New array for a field missing from every row so far"""
+        if dtype.kind != 'O':
+            dtype = np.float64
+
+        arr = np.empty(self.capacity, dtype=dtype)
+        arr[:self.size] = np.nan if dtype.kind == 'f' else None
+        return arr
+
+    def extend(self, docs: list) -> None:
+        """Append decoded documents"""
+        n = len(docs)
+        if not n:
+            return
+
+        self.reserve(n)
+        for f, values in zip(self.fields, field_values(docs, self.fields)):
+            values = column(values)
+            arr = self.columns.get(f)
+
+            if arr is None:
+                arr = self.allocate(values.dtype) if self.size else np.empty(self.capacity, dtype=values.dtype)
+            elif np.result_type(arr.dtype, values.dtype) != arr.dtype:
+                arr = arr.astype(np.result_type(arr.dtype, values.dtype))
+
+            arr[self.size:self.size + n] = values
+            self.columns[f] = arr
+
+        self.size += n
+
+    def add_batch(self, batch: bytes) -> int:
+        """Decode a raw BSON batch, returning the number of documents in it"""
+        docs = bson.decode_all(batch)
+        self.extend(docs)
+        return len(docs)
+
+    def arrays(self) -> dict:
+        """Filled part of every array (fields never seen are all NaN)"""
+        return {
+            f: self.columns[f][:self.size] if f in self.columns else np.full(self.size, np.nan)
+            for f in self.fields
+        }
+
+
+def decode_batches(batches: Iterable[bytes],
+                   fields: list,
+                   progress: Optional[Callable[[int], object]] = None) -> dict:
+    """Decode raw BSON batches (e.g. from `find_raw_batches`) into one array per field
+
+    Args:
+        batches: raw BSON batches
+        fields: document fields to keep
+        progress: callback receiving the number of documents in each batch
+
+    Returns:
+        dictionary of arrays keyed by field
+    """
+    buffer = ColumnBuffer(fields)
+
+    for batch in batches:
+        n = buffer.add_batch(batch)
+        if progress is not None:
+            progress(n)
+
+    return buffer.arrays()
+
+
+def last_occurrences(keys: np.ndarray) -> Optional[np.ndarray]:
+    """Row positions keeping one row per key, like building a dict keyed by `keys`:
+    keys stay in order of first appearance, values are taken from their last row
+
+    Returns:
+        row positions, or None if every key is unique
+    """
+    codes, uniques = pd.factorize(keys)
+
+    if len(uniques) == len(keys):
+        return None
+
+    last = np.empty(len(uniques), dtype=np.intp)
+    last[codes] = np.arange(len(codes))
+    return last
@@ -0,0 +1,130 @@
+"""Compact dtypes for returned dataframes
+
+Counts and ranks come back as float64 (NaN for missing days), frequencies as float64,
+and ngrams/languages as strings repeated along MultiIndexes.
+With `compact=True`, `Storywrangler` and `Realtime` shrink every dataframe they return:
+
+- counts and ranks to nullable Int32 (when every value is a whole number that fits in 32 bits,
+  so tied ranks such as 2.5 and totals over 2^31 keep their float64 column)
+- frequencies and divergence contributions to float32
+- `ngram`/`lang` levels of MultiIndexes to categoricals
+"""
+import inspect
+import logging
+import contextvars
+from functools import wraps
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# column name prefixes of each compact dtype
+INTEGER_COLUMNS = ('count', 'rank', 'num_', 'unique_', 'tweets', 'speakers', 'retweets', 'comments')
+FLOAT_COLUMNS = ('freq', 'r_rel', 'rd_contribution', 'normed_rd')
+CATEGORICAL_LEVELS = ('ngram', 'lang')
+
+INT32_MIN, INT32_MAX = np.iinfo(np.int32).min, np.iinfo(np.int32).max
+
+# set while a compacting method runs, so the methods it calls return their frames as is
+compacting_call = contextvars.ContextVar('compacting_call', default=False)
+
+
+def compact_dtype(values: pd.Series):
+    """Smaller dtype of a column, or None if its name or values do not allow one"""
+    name = str(values.name)
+
+    if values.dtype.kind not in 'iuf':
+        return None
+
+    if name.startswith(FLOAT_COLUMNS) and values.dtype.kind == 'f':
+        return np.float32
+
+    if name.startswith(INTEGER_COLUMNS):
+        arr = values.to_numpy(dtype=np.float64, na_value=np.nan)
+        present = arr[~np.isnan(arr)]
+
+        if present.size == 0 or (
+                present.min() >= INT32_MIN and present.max() <= INT32_MAX and np.all(present == np.floor(present))
+        ):
+            return 'Int32'
+
+    return None
+
+
+def compact_index(index: pd.Index) -> pd.Index:
+    """Same index with categorical `ngram`/`lang` levels (MultiIndexes only)"""
+    if not isinstance(index, pd.MultiIndex):
+        return index
+
+    for name in CATEGORICAL_LEVELS:
+        if name in index.names and not isinstance(index.levels[index.names.index(name)], pd.CategoricalIndex):
+            level = index.names.index(name)
+            index = index.set_levels(pd.CategoricalIndex(index.levels[level]), level=level)
+
+    return index
+
+
+def compact_frame(df: pd.DataFrame) -> (pd.DataFrame, int):
+    """Dataframe with compact dtypes (see module docstring), and the number of bytes saved"""
+    before = df.memory_usage(deep=True).sum()
+
+    dtypes = {c: compact_dtype(df[c]) for c in df.columns}
+    out = df.astype({c: t for c, t in dtypes.items() if t is not None})
+    out.index = compact_index(df.index)
+
+    saved = int(before - out.memory_usage(deep=True).sum())
+    out.attrs['bytes_saved'] = saved
+    return out, saved
+
+
+def compact_result(result, name: str):
+    """Compact a dataframe (or a dict of dataframes) returned by `name`, logging the bytes saved"""
+    if isinstance(result, pd.DataFrame):
+        result, saved = compact_frame(result)
+    elif isinstance(result, dict) and result and all(isinstance(v, pd.DataFrame) for v in result.values()):
+        compacted = {k: compact_frame(v) for k, v in result.items()}
+        result, saved = {k: df for k, (df, _) in compacted.items()}, sum(s for _, s in compacted.values())
+    else:
+        return result
+
+    logger.info(f"{name}: compact dtypes saved {saved} bytes")
+    return result
+
+
+def compacting(method: Callable) -> Callable:
+    """Compact the dataframes returned by an API method when its object has `compact` set
+
+    Works for regular methods and coroutines;
+    frames returned by API methods called from within the method are compacted once, by the outermost call.
+    """
+    if inspect.iscoroutinefunction(method):
+        @wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            if not getattr(self, 'compact', False) or compacting_call.get():
+                return await method(self, *args, **kwargs)
+
+            token = compacting_call.set(True)
+            try:
+                result = await method(self, *args, **kwargs)
+            finally:
+                compacting_call.reset(token)
+
+            return compact_result(result, method.__name__)
+
+    else:
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not getattr(self, 'compact', False) or compacting_call.get():
+                return method(self, *args, **kwargs)
+
+            token = compacting_call.set(True)
+            try:
+                result = method(self, *args, **kwargs)
+            finally:
+                compacting_call.reset(token)
+
+            return compact_result(result, method.__name__)
+
+    return wrapper
@@ -0,0 +1,391 @@
+import asyncio
+import logging
+import weakref
+import threading
+from functools import lru_cache
+from typing import Optional
+
+try:
+    import importlib.resources as pkg_resources
+except ImportError:
+    import importlib_resources as pkg_resources
+
+import ujson
+from pymongo import MongoClient
+from pymongo.errors import ServerSelectionTimeoutError
+from pymongo.monitoring import ServerHeartbeatListener
+
+try:
+    from pymongo import AsyncMongoClient
+except ImportError:
+    AsyncMongoClient = None
+
+import resources
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def load_credentials() -> dict:
+    """Load the default database credentials shipped with the package"""
+    with pkg_resources.open_binary(resources, 'client.json') as f:
+        return ujson.load(f)
+
+
+def connection_uri(credentials: dict, domain: Optional[str] = None) -> str:
+    """Build a MongoDB connection string
+
+    Args:
+        credentials: dictionary of database credentials (see client.json)
+        domain: host to connect to (default: credentials['domain'])
+
+    Returns:
+        connection string
+    """
+    return (
+        f"{credentials['database']}://"
+        f"{credentials['username']}:"
+        f"{credentials['pwd']}"
+        f"@{domain if domain else credentials['domain']}:"
+        f"{credentials['port']}"
+    )
+
+
+class EndpointMonitor(ServerHeartbeatListener):
+    """Report server heartbeats of the primary endpoint to an EndpointSelector"""
+
+    def __init__(self, selector: 'EndpointSelector', domain: str) -> None:
+        self.selector = selector
+        self.domain = domain
+
+    def started(self, event) -> None:
+        pass
+
+    def succeeded(self, event) -> None:
+        self.selector.record(self.domain, healthy=True)
+
+    def failed(self, event) -> None:
+        self.selector.record(self.domain, healthy=False)
+
+
+class EndpointSelector:
+    """Circuit breaker choosing between the primary domain and a fallback host
+
+    The primary endpoint is probed once per process.
+    If it is unreachable, the breaker opens and every caller goes straight to the fallback
+    while the primary is re-probed in the background (every `probe_interval` seconds);
+    the breaker closes again as soon as a probe succeeds.
+    Pooled clients on the primary report their heartbeats here as well,
+    so a primary that goes down later trips the breaker
+    after `failure_threshold` consecutive failed heartbeats,
+    and is then re-probed in the background the same way.
+    """
+
+    def __init__(self,
+                 fallback: str = 'localhost',
+                 timeout_ms: int = 5000,
+                 probe_interval: float = 30.0,
+                 failure_threshold: int = 2) -> None:
+        """
+        Args:
+            fallback: host to use while the primary is unreachable
+            timeout_ms: how long to wait for the primary on the first probe
+            probe_interval: seconds between background probes of an unreachable primary
+            failure_threshold: consecutive failed heartbeats that trip the breaker
+        """
+        self.fallback = fallback
+        self.timeout_ms = timeout_ms
+        self.probe_interval = probe_interval
+        self.failure_threshold = failure_threshold
+
+        self._healthy = {}
+        self._failures = {}
+        self._probes = {}
+        self._credentials = {}
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+
+    def monitor(self, domain: str) -> EndpointMonitor:
+        """Heartbeat listener reporting the health of `domain` to this selector"""
+        return EndpointMonitor(self, domain)
+
+    def select(self, credentials: dict) -> str:
+        """Return the host to connect to, probing the primary domain on first use
+
+        Args:
+            credentials: dictionary of database credentials (see client.json)
+
+        Returns:
+            the primary domain if it is healthy, else the fallback host
+        """
+        domain = credentials['domain']
+
+        # heartbeats are reported under `_lock`, so the (slow) probe only holds `_probe_lock`
+        with self._probe_lock:
+            if domain not in self._healthy:
+                with self._lock:
+                    self._credentials[domain] = credentials
+
+                healthy = self.probe(credentials)
+
+                with self._lock:
+                    self._healthy[domain] = healthy
+
+        return domain if self._healthy[domain] else self.fallback
+
+    def probe(self, credentials: dict) -> bool:
+        """Check if the primary domain is reachable,
+        leaving a background monitor running on it if it is not
+        """
+        domain = credentials['domain']
+        client = self.probe_client(credentials)
+
+        try:
+            client.server_info()
+            client.close()
+            return True
+
+        except ServerSelectionTimeoutError:
+            logger.warning(f"Could not reach {domain}, falling back to {self.fallback}")
+            # keep the client around: its monitor thread re-probes the primary in the background
+            with self._lock:
+                self._probes[domain] = client
+            return False
+
+    def probe_client(self, credentials: dict) -> MongoClient:
+        """Client on the primary domain whose monitor reports a heartbeat every `probe_interval` seconds"""
+        return MongoClient(
+            connection_uri(credentials),
+            serverSelectionTimeoutMS=self.timeout_ms,
+            heartbeatFrequencyMS=int(self.probe_interval * 1000),
+            event_listeners=[self.monitor(credentials['domain'])],
+            connect=True,
+        )
+
+    def watch(self, domain: str) -> None:
+        """Re-probe an unreachable primary domain in the background, unless a probe is already running"""
+        with self._lock:
+            credentials = self._credentials.get(domain)
+            if credentials is None or domain in self._probes:
+                return
+
+        client = self.probe_client(credentials)
+
+        with self._lock:
+            if domain in self._probes or self._healthy.get(domain):
+                # another probe won the race, or the primary came back meanwhile
+                threading.Thread(target=client.close, daemon=True).start()
+            else:
+                self._probes[domain] = client
+
+    def record(self, domain: str, healthy: bool) -> None:
+        """Record the outcome of a heartbeat on the primary domain"""
+        tripped = False
+
+        with self._lock:
+            if healthy:
+                self._failures[domain] = 0
+
+                if self._healthy.get(domain) is False:
+                    logger.info(f"{domain} is reachable again")
+                    self._healthy[domain] = True
+                    probe = self._probes.pop(domain, None)
+                    if probe is not None:
+                        threading.Thread(target=probe.close, daemon=True).start()
+            else:
+                self._failures[domain] = self._failures.get(domain, 0) + 1
+
+                if self._healthy.get(domain) and self._failures[domain] >= self.failure_threshold:
+                    logger.warning(f"Lost connection to {domain}, falling back to {self.fallback}")
+                    self._healthy[domain] = False
+                    tripped = True
+
+        if tripped:
+            # pooled clients on the primary may all be released: keep a probe of our own running
+            self.watch(domain)
+
+    def reset(self) -> None:
+        """Forget every recorded outcome and stop background probes"""
+        with self._lock:
+            for probe in self._probes.values():
+                probe.close()
+
+            self._healthy.clear()
+            self._failures.clear()
+            self._probes.clear()
+            self._credentials.clear()
+
+
+class ClientRegistry:
+    """Process-wide registry of pooled MongoClients
+
+    Clients are keyed by endpoint, credentials, and pool options,
+    so every Query and RealtimeQuery pointing at the same server
+    borrows the same thread-safe connection pool
+    instead of opening (and handshaking) a new one.
+
+    Owners are tracked by weak reference:
+    an owner collected without calling `release` returns its clients automatically.
+    """
+
+    def __init__(self, selector: Optional[EndpointSelector] = None) -> None:
+        """
+        Args:
+            selector: circuit breaker choosing which endpoint to connect to
+        """
+        self.selector = selector if selector else EndpointSelector()
+        self._clients = {}
+        self._owners = {}
+        self._pinned = set()
+        # reentrant, since owners may be collected (and release their clients) while it is held
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def client_key(credentials: dict,
+                   domain: str,
+                   max_pool_size: int,
+                   max_idle_time_ms: Optional[int],
+                   server_selection_timeout_ms: int) -> tuple:
+        return (
+            credentials['database'],
+            domain,
+            credentials['port'],
+            credentials['username'],
+            credentials['pwd'],
+            max_pool_size,
+            max_idle_time_ms,
+            server_selection_timeout_ms,
+        )
+
+    def get_client(self,
+                   owner: Optional[object] = None,
+                   credentials: Optional[dict] = None,
+                   max_pool_size: int = 100,
+                   max_idle_time_ms: Optional[int] = 60000,
+                   server_selection_timeout_ms: int = 5000) -> MongoClient:
+        """Borrow a pooled client, creating it on first use
+
+        Args:
+            owner: object borrowing the client (released with `release(owner)`);
+            clients borrowed without an owner stay open until `close()`
+            credentials: dictionary of database credentials (default: client.json)
+            max_pool_size: max number of concurrent connections in the pool
+            max_idle_time_ms: close pooled connections idle for longer than this
+            server_selection_timeout_ms: how long to wait for a server before giving up
+
+        Returns:
+            a shared MongoClient
+        """
+        credentials = credentials if credentials else load_credentials()
+        domain = self.selector.select(credentials)
+        key = self.client_key(credentials, domain, max_pool_size, max_idle_time_ms, server_selection_timeout_ms)
+
+        with self._lock:
+            client = self._clients.get(key)
+
+            if client is None:
+                client = self.connect(
+                    credentials,
+                    domain,
+                    maxPoolSize=max_pool_size,
+                    maxIdleTimeMS=max_idle_time_ms,
+                    serverSelectionTimeoutMS=server_selection_timeout_ms,
+                )
+                self._clients[key] = client
+                self._owners[key] = {}
+
+            if owner is None:
+                self._pinned.add(key)
+            elif id(owner) not in self._owners[key]:
+                finalizer = weakref.finalize(owner, self.discard, key, id(owner))
+                finalizer.atexit = False
+                self._owners[key][id(owner)] = finalizer
+
+        return client
+
+    def connect(self, credentials: dict, domain: str, **options) -> MongoClient:
+        """Create a pooled client, reporting heartbeats of the primary domain to the selector"""
+        if domain == credentials['domain']:
+            options['event_listeners'] = [self.selector.monitor(domain)]
+
+        return MongoClient(connection_uri(credentials, domain=domain), **options)
+
+    def release(self, owner: object) -> None:
+        """Return every client borrowed by `owner`,
+        closing pools that are no longer borrowed by anyone
+        """
+        with self._lock:
+            for key in list(self._owners):
+                finalizer = self._owners.get(key, {}).get(id(owner))
+
+                if finalizer is not None:
+                    finalizer.detach()
+                    self.discard(key, id(owner))
+
+    def discard(self, key: tuple, owner_id: int) -> None:
+        """Return the client of `key` borrowed by the owner with id `owner_id` (called when the owner is collected)"""
+        with self._lock:
+            owners = self._owners.get(key)
+            if owners is None or owners.pop(owner_id, None) is None:
+                return
+
+            if not owners and key not in self._pinned:
+                self._clients.pop(key).close()
+                del self._owners[key]
+
+    def close(self) -> None:
+        """Close every pooled client"""
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+
+            for owners in self._owners.values():
+                for finalizer in owners.values():
+                    finalizer.detach()
+
+            self._clients.clear()
+            self._owners.clear()
+            self._pinned.clear()
+
+
+registry = ClientRegistry()
+
+
+async def connect_async(credentials: Optional[dict] = None,
+                        max_pool_size: int = 100,
+                        max_idle_time_ms: Optional[int] = 60000,
+                        server_selection_timeout_ms: int = 5000):
+    """Create an AsyncMongoClient on the endpoint chosen by the shared selector
+
+    Async clients are bound to the running event loop,
+    so they are owned by the API object that creates them rather than the registry.
+
+    Args:
+        credentials: dictionary of database credentials (default: client.json)
+        max_pool_size: max number of concurrent connections in the pool
+        max_idle_time_ms: close pooled connections idle for longer than this
+        server_selection_timeout_ms: how long to wait for a server before giving up
+
+    Returns:
+        an AsyncMongoClient
+    """
+    if AsyncMongoClient is None:
+        raise ImportError("The asyncio API requires pymongo>=4.10")
+
+    credentials = credentials if credentials else load_credentials()
+
+    # probing the primary blocks, but it only happens once per process
+    loop = asyncio.get_running_loop()
+    domain = await loop.run_in_executor(None, registry.selector.select, credentials)
+
+    options = {}
+    if domain == credentials['domain']:
+        options['event_listeners'] = [registry.selector.monitor(domain)]
+
+    return AsyncMongoClient(
+        connection_uri(credentials, domain=domain),
+        maxPoolSize=max_pool_size,
+        maxIdleTimeMS=max_idle_time_ms,
+        serverSelectionTimeoutMS=server_selection_timeout_ms,
+        **options
+    )
@@ -0,0 +1,38 @@
+"""Package resources, loaded once per process on first use
+
+The ngram parser and the language tables are shared by every `Storywrangler`/`Realtime` object,
+instead of being unpickled and parsed again by each constructor.
+They are shared process-wide: treat them as read-only.
+"""
+import pickle
+from functools import lru_cache
+
+try:
+    import importlib.resources as pkg_resources
+except ImportError:
+    import importlib_resources as pkg_resources
+
+import ujson
+
+import resources
+
+
+@lru_cache(maxsize=None)
+def load_parser():
+    """Compiled ngram tokenizer shipped with the package (see `regexr.nparser`)"""
+    with pkg_resources.open_binary(resources, 'ngrams.bin') as f:
+        return pickle.load(f)
+
+
+@lru_cache(maxsize=None)
+def load_languages(table: str) -> dict:
+    """Language table shipped with the package
+
+    Args:
+        table: name of the table, i.e. one of 'ngrams', 'indexed', 'supported', 'realtime', 'divergence'
+
+    Returns:
+        dictionary of the `{table}_languages.json` resource
+    """
+    with pkg_resources.open_binary(resources, f'{table}_languages.json') as f:
+        return ujson.load(f)
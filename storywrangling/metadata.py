@@ -0,0 +1,169 @@
+import threading
+from typing import NamedTuple, Optional
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+from pymongo import ASCENDING, DESCENDING
+from pymongo.collection import Collection
+
+
+def utcnow() -> datetime:
+    """Naive UTC timestamp, matching the timestamps stored in the database"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class CollectionMetadata(NamedTuple):
+    """Date bounds and schema of a database collection"""
+    reference_date: datetime
+    last_updated: datetime
+    time_field: Optional[str]
+    columns: tuple
+
+    @classmethod
+    def from_documents(cls,
+                       first: Optional[dict],
+                       last: Optional[dict],
+                       time_field: Optional[str]) -> 'CollectionMetadata':
+        """Build metadata from the first and last documents of a collection sorted by `time_field`"""
+        columns = tuple(c for c in first.keys() if c != '_id') if first is not None else ()
+
+        if time_field is None:
+            return cls(datetime(2010, 1, 1), datetime.today() - timedelta(days=2), None, columns)
+        else:
+            return cls(first[time_field], last[time_field], time_field, columns)
+
+
+class MetadataCache:
+    """Process-wide TTL cache of collection metadata keyed by (database, collection, client)
+
+    Once a collection holds the last complete period (e.g. yesterday for daily collections,
+    or the previous quarter hour for realtime ones), its entry expires at the next update boundary,
+    so repeated queries against the same language skip the date-bound lookups
+    until new data can possibly have landed.
+    Until then, the latest data is late: the entry expires after `retry` to look for it again.
+    """
+
+    def __init__(self, retry: timedelta = timedelta(minutes=5)) -> None:
+        """
+        Args:
+            retry: time to live of entries missing the last complete period
+        """
+        self.retry = retry
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def expiration(cadence: str) -> datetime:
+        """Return the next update boundary for a given cadence (e.g. 'D', '15min')"""
+        now = pd.Timestamp(utcnow())
+        return (now.floor(cadence) + to_offset(cadence)).to_pydatetime()
+
+    @staticmethod
+    def expected(cadence: str) -> datetime:
+        """Return the start of the last complete period for a given cadence (the latest data expected)"""
+        now = pd.Timestamp(utcnow())
+        return (now.floor(cadence) - to_offset(cadence)).to_pydatetime()
+
+    def expires(self, metadata: CollectionMetadata, cadence: str = 'D') -> datetime:
+        """Return the expiration of metadata: the next update boundary, or sooner if the latest data is late"""
+        boundary = self.expiration(cadence)
+
+        if metadata.time_field is not None and metadata.last_updated < self.expected(cadence):
+            return min(utcnow() + self.retry, boundary)
+
+        return boundary
+
+    @staticmethod
+    def key(collection) -> tuple:
+        """Cache key of a collection (the same names on another client, e.g. a local replica, are kept apart)"""
+        return collection.database.name, collection.name, id(collection.database.client)
+
+    def cached(self, collection) -> Optional[CollectionMetadata]:
+        """Return unexpired metadata for a collection, if any"""
+        with self._lock:
+            entry = self._entries.get(self.key(collection))
+
+        if entry is not None and utcnow() < entry[1]:
+            return entry[0]
+
+    def store(self,
+              collection,
+              metadata: CollectionMetadata,
+              cadence: str = 'D',
+              ttl: Optional[timedelta] = None) -> CollectionMetadata:
+        """Cache metadata for a collection until its next update (or for `ttl`), see `expires`"""
+        expires = utcnow() + ttl if ttl is not None else self.expires(metadata, cadence)
+
+        with self._lock:
+            self._entries[self.key(collection)] = (metadata, expires)
+
+        return metadata
+
+    def get(self,
+            collection: Collection,
+            cadence: str = 'D',
+            ttl: Optional[timedelta] = None) -> CollectionMetadata:
+        """Get metadata for a collection, looking it up if missing or expired
+
+        Args:
+            collection: target collection
+            cadence: update frequency of the collection (pandas offset alias)
+            ttl: fixed time to live (default: see `expires`)
+
+        Returns:
+            collection metadata
+        """
+        metadata = self.cached(collection)
+
+        if metadata is None:
+            metadata = self.store(collection, self.lookup(collection), cadence, ttl)
+
+        return metadata
+
+    async def get_async(self,
+                        collection,
+                        cadence: str = 'D',
+                        ttl: Optional[timedelta] = None) -> CollectionMetadata:
+        """Same as `get` for an AsyncCollection"""
+        metadata = self.cached(collection)
+
+        if metadata is None:
+            metadata = self.store(collection, await self.lookup_async(collection), cadence, ttl)
+
+        return metadata
+
+    @staticmethod
+    def lookup(collection: Collection) -> CollectionMetadata:
+        """Query date bounds and field names of a collection"""
+        for field in ('time', 'time_2'):
+            first = collection.find_one(sort=[(field, ASCENDING)])
+
+            if first is not None and field in first:
+                last = collection.find_one(sort=[(field, DESCENDING)])
+                return CollectionMetadata.from_documents(first, last, field)
+
+        return CollectionMetadata.from_documents(first, None, None)
+
+    @staticmethod
+    async def lookup_async(collection) -> CollectionMetadata:
+        """Same as `lookup` for an AsyncCollection"""
+        for field in ('time', 'time_2'):
+            first = await collection.find_one(sort=[(field, ASCENDING)])
+
+            if first is not None and field in first:
+                last = await collection.find_one(sort=[(field, DESCENDING)])
+                return CollectionMetadata.from_documents(first, last, field)
+
+        return CollectionMetadata.from_documents(first, None, None)
+
+    def invalidate(self, database: Optional[str] = None, collection: Optional[str] = None) -> None:
+        """Drop cached entries matching a database and/or collection (default: everything)"""
+        with self._lock:
+            for key in list(self._entries):
+                if (database is None or key[0] == database) and \
+                        (collection is None or key[1] == collection):
+                    del self._entries[key]
+
+
+metadata_cache = MetadataCache()
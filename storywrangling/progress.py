@@ -0,0 +1,128 @@
+"""Progress reporting of the API's loops (cursor batches, days of a date range, groups of ngrams)
+
+`Storywrangler`, `Realtime`, and the query classes take a `progress` argument:
+
+- `True` (default): tqdm progress bars
+- `None` or `False`: no reporting at all (loops skip their progress calls)
+- a callback: receives `(desc, done, total)` after every update
+- a `ProgressHook`: tqdm bars or a callback, reported every N updates
+"""
+from contextlib import nullcontext
+from typing import Callable, Optional, Union
+
+
+class Progress:
+    """Progress of one loop, reported to a callback every `every` updates and when the loop ends
+
+    Implements the part of the tqdm interface the API uses (`update`, `set_description`, `close`, `with`).
+    """
+
+    def __init__(self,
+                 desc: str,
+                 total: Optional[int] = None,
+                 callback: Optional[Callable[[str, int, Optional[int]], object]] = None,
+                 every: int = 1) -> None:
+        """
+        Args:
+            desc: description of the loop
+            total: expected number of items (default: unknown)
+            callback: receives the description, the number of items done, and the total
+            every: number of updates between two reports
+        """
+        self.desc = desc
+        self.total = total
+        self.callback = callback
+        self.every = max(1, every)
+        self.done = 0
+        self.reported = 0
+        self.pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def update(self, n: int = 1) -> None:
+        """Count `n` more items done (e.g. the documents of a cursor batch)"""
+        self.done += n
+        self.pending += 1
+
+        if self.pending >= self.every:
+            self.report()
+
+    def set_description(self, desc: str) -> None:
+        """Describe the current item, shown by the next report"""
+        self.desc = desc
+
+    def report(self) -> None:
+        """Report the items done since the last report"""
+        self.callback(self.desc, self.done, self.total)
+        self.reported, self.pending = self.done, 0
+
+    def close(self) -> None:
+        """Report the updates left since the last report"""
+        if self.pending:
+            self.report()
+
+
+class TqdmProgress(Progress):
+    """Progress of one loop, shown as a tqdm progress bar refreshed every `every` updates"""
+
+    def __init__(self, desc: str, total: Optional[int] = None, unit: str = '', every: int = 1) -> None:
+        super().__init__(desc, total, every=every)
+
+        from tqdm import tqdm
+        self.bar = tqdm(desc=desc, total=total, unit=unit, leave=True)
+
+    def report(self) -> None:
+        self.bar.set_description(self.desc, refresh=False)
+        self.bar.update(self.done - self.reported)
+        self.reported, self.pending = self.done, 0
+
+    def close(self) -> None:
+        super().close()
+        self.bar.close()
+
+
+class ProgressHook:
+    """Creates the `Progress` of each loop of the API
+
+    Args:
+        callback: receives `(desc, done, total)` of each loop (default: tqdm progress bars)
+        every: number of updates (e.g. cursor batches) between two reports (default: every update)
+    """
+
+    def __init__(self,
+                 callback: Optional[Callable[[str, int, Optional[int]], object]] = None,
+                 every: int = 1) -> None:
+        self.callback = callback
+        self.every = every
+
+    def __call__(self, desc: str, total: Optional[int] = None, unit: str = '') -> Progress:
+        if self.callback is None:
+            return TqdmProgress(desc, total, unit, every=self.every)
+
+        return Progress(desc, total, callback=self.callback, every=self.every)
+
+
+def progress_hook(progress: Union[bool, Callable, ProgressHook, None]) -> Optional[ProgressHook]:
+    """Hook for a `progress` argument of the API (see module docstring), or None if progress is disabled"""
+    if progress is None or progress is False:
+        return None
+
+    if progress is True:
+        return ProgressHook()
+
+    if isinstance(progress, ProgressHook):
+        return progress
+
+    if callable(progress):
+        return ProgressHook(progress)
+
+    raise ValueError(f"Unsupported progress hook: {progress!r}")
+
+
+def track(hook: Optional[ProgressHook], desc: str, total: Optional[int] = None, unit: str = ''):
+    """Context manager yielding the `Progress` of a loop, or None if progress is disabled"""
+    return hook(desc, total, unit) if hook is not None else nullcontext()
@@ -1,87 +1,65 @@
+import re
 import logging
-import warnings
-
-warnings.filterwarnings("ignore")
-
-import sys
-from pathlib import Path
-
-file = Path(__file__).resolve()
-parent, root = file.parent, file.parents[1]
-sys.path.append(str(root))
-
-try:
-    sys.path.remove(str(parent))
-except ValueError:
-    pass
-
-try:
-    import importlib.resources as pkg_resources
-except ImportError:
-    import importlib_resources as pkg_resources
+import weakref
 
 import numpy as np
 import pandas as pd
-from tqdm import tqdm
-from typing import Optional, Union
+from functools import partial
+from typing import Callable, Iterator, Optional, Union
 from datetime import datetime, timedelta
-from pymongo.errors import ServerSelectionTimeoutError
-from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure
+
+from storywrangling.columnar import decode_batches, last_occurrences
+from storywrangling.connection import registry
+from storywrangling.metadata import metadata_cache, CollectionMetadata
+from storywrangling.progress import ProgressHook, progress_hook, track
+
+logger = logging.getLogger(__name__)
 
-import ujson
-import resources
+# error code of servers missing a $group accumulator (e.g. $topN before MongoDB 5.2)
+UNKNOWN_GROUP_OPERATOR = 15952
+
+# clients of servers without $topN, found by the first query falling back without it
+legacy_clients = weakref.WeakSet()
 
 
 class Query:
     """Class to work with n-gram db"""
 
-    def __init__(self, db: str, lang: str) -> None:
+    def __init__(self,
+                 db: str,
+                 lang: str,
+                 client: Optional[MongoClient] = None,
+                 metadata: Optional[CollectionMetadata] = None,
+                 progress: Union[bool, Callable, ProgressHook, None] = True) -> None:
         """Python wrapper to access database on hydra.uvm.edu
 
         Args:
             db: database to use
             lang: language collection to use
+            client: pooled MongoClient to use (default: shared client from the registry)
+            metadata: collection metadata, if already known (default: looked up in the metadata cache)
+            progress: progress of decoding query results, see `storywrangling.progress` (default: tqdm bars)
         """
-        with pkg_resources.open_binary(resources, 'client.json') as f:
-            self.credentials = ujson.load(f)
-
-        try:
-            client = MongoClient(
-                f"{self.credentials['database']}://"
-                f"{self.credentials['username']}:"
-                f"{self.credentials['pwd']}"
-                f"@{self.credentials['domain']}:"
-                f"{self.credentials['port']}",
-                serverSelectionTimeoutMS=5000,
-                connect=True
-            )
-            client.server_info()
-
-        except ServerSelectionTimeoutError:
-            client = MongoClient(
-                f"{self.credentials['database']}://"
-                f"{self.credentials['username']}:"
-                f"{self.credentials['pwd']}"
-                f"@localhost:"
-                f"{self.credentials['port']}",
-                serverSelectionTimeoutMS=5000
-            )
+        if client is None:
+            client = registry.get_client()
 
         db = client[db]
         self.database = db[lang]
         self.lang = lang
+        self.progress = progress_hook(progress)
 
-        try:
-            self.reference_date = list(self.database.find().sort([('time', ASCENDING)]).limit(1))[0]['time']
-            self.last_updated = list(self.database.find().sort([('time', DESCENDING)]).limit(1))[0]['time']
-        except KeyError:
-            try:
-                self.reference_date = list(self.database.find().sort([('time_2', ASCENDING)]).limit(1))[0]['time_2']
-                self.last_updated = list(self.database.find().sort([('time_2', DESCENDING)]).limit(1))[0]['time_2']
-            except KeyError:
-                self.lag = timedelta(days=2)
-                self.reference_date = datetime(2010, 1, 1)
-                self.last_updated = datetime.today() - self.lag
+        self.time_resolution = 'D'
+        self.metadata = metadata if metadata else metadata_cache.get(self.database, cadence=self.time_resolution)
+        self.reference_date = self.metadata.reference_date
+        self.last_updated = self.metadata.last_updated
+
+        if self.metadata.time_field is None:
+            self.lag = timedelta(days=2)
+
+        # whether the server supports $topN (MongoDB 5.2+), see `lacks_topn`
+        self.group_topn = client not in legacy_clients
 
         self.db_cols = [
             "counts",
@@ -170,22 +148,20 @@ class Query:
 
         self.exclude_regex = ["no_punc"]  # regexes operating with $not operator
 
-    def prepare_data(self, query: dict, cols: list) -> dict:
-        return {
-            d: {c: np.nan for c in cols}
-            for d in pd.date_range(
-                start=query["time"]["$gte"].date(),
-                end=query["time"]["$lte"].date(),
-                freq="D",
-            ).date
-        }
+    def date_index(self, query: dict) -> pd.DatetimeIndex:
+        """Every day between the time bounds of a query"""
+        return pd.date_range(
+            start=query["time"]["$gte"].date(),
+            end=query["time"]["$lte"].date(),
+            freq="D",
+        )
 
     def prepare_rank_query(
             self,
             rank: int,
             start: Optional[datetime] = None,
             end: Optional[datetime] = None
-    ) -> (dict, dict):
+    ) -> (dict, pd.DatetimeIndex):
 
         query = {
             "rank": rank,
@@ -194,12 +170,12 @@ class Query:
                 "$lte": end if end else self.last_updated,
             }
         }
-        return query, self.prepare_data(query, self.cols)
+        return query, self.date_index(query)
 
     def prepare_ngram_query(self,
                             word: Union[str, list],
                             start: Optional[datetime] = None,
-                            end: Optional[datetime] = None) -> (dict, dict):
+                            end: Optional[datetime] = None) -> (dict, pd.DatetimeIndex):
         query = {
             "word": {"$in": word} if type(word) is list else word,
             "time": {
@@ -207,12 +183,12 @@ class Query:
                 "$lte": end if end else self.last_updated,
             }
         }
-        return query, self.prepare_data(query, self.cols)
+        return query, self.date_index(query)
 
     def prepare_lang_query(self,
                            lang: str,
                            start: Optional[datetime] = None,
-                           end: Optional[datetime] = None) -> (dict, dict):
+                           end: Optional[datetime] = None) -> (dict, pd.DatetimeIndex):
         query = {
             "language": lang if lang else "_all",
             "time": {
@@ -220,7 +196,7 @@ class Query:
                 "$lte": end if end else self.last_updated,
             }
         }
-        return query, self.prepare_data(query, self.lang_cols)
+        return query, self.date_index(query)
 
     def prepare_day_query(self,
                           date: datetime,
@@ -254,6 +230,20 @@ class Query:
         else:
             return {"time": date if date else self.last_updated}
 
+    def prepare_zipf_query(self,
+                           date: datetime,
+                           max_rank: Optional[int] = None,
+                           min_count: Optional[int] = None,
+                           rt: bool = True,
+                           ngram_order: int = 1,
+                           ngram_filter: Optional[str] = None) -> dict:
+        query = self.prepare_day_query(date, max_rank, min_count, rt)
+
+        if ngram_filter:
+            query = self.prepare_query_filter(ngram_order, query, ngram_filter, db_type='ngrams')
+
+        return query
+
     def prepare_divergence_query(self,
                                  date: datetime,
                                  max_rank: Optional[int] = None,
@@ -285,26 +275,368 @@ class Query:
                     "rank_change_noRT": {"$lte": 1, "$gt": 0}
                     }
 
+    def filter_pattern(self, ngram_order: int, filter_name: str) -> (str, bool):
+        """Regex of an ngram filter, and whether it excludes (rather than selects) matching ngrams"""
+        if filter_name in self.exclude_regex:
+            return self.ngram_filters[filter_name], True
+        else:
+            return r"^" + " ".join([self.ngram_filters[filter_name]] * ngram_order) + "$", False
+
     def prepare_query_filter(self,
                              ngram_order: int,
                              query: dict,
                              filter_name: str,
                              db_type: str):
 
-        if filter_name in self.exclude_regex:
-            regex_pattern = self.ngram_filters[filter_name]
+        regex_pattern, exclude = self.filter_pattern(ngram_order, filter_name)
+
+        if exclude:
             regex_filter = {self.ngram_field_name[db_type]: {"$not": {"$regex": regex_pattern}}}
         else:
-            regex_pattern = r"^" + " ".join([self.ngram_filters[filter_name]] * ngram_order) + "$"
             regex_filter = {self.ngram_field_name[db_type]: {"$regex": regex_pattern}}
 
         return {**query, **regex_filter}
 
+    def filter_mask(self, ngrams: pd.Index, ngram_order: int, filter_name: str) -> np.ndarray:
+        """Same as `prepare_query_filter` for ngrams already retrieved"""
+        regex_pattern, exclude = self.filter_pattern(ngram_order, filter_name)
+        regex = re.compile(regex_pattern)
+        mask = np.fromiter(
+            (isinstance(w, str) and regex.search(w) is not None for w in ngrams),
+            dtype=bool,
+            count=len(ngrams),
+        )
+        return ~mask if exclude else mask
+
+    def query_plan(self,
+                   query: dict,
+                   top_n: Optional[int] = None,
+                   projection: Optional[dict] = None,
+                   sort: Optional[dict] = None,
+                   raw: bool = False,
+                   per: Optional[str] = None,
+                   group_topn: bool = True) -> (str, dict):
+        """Pick the collection method (and its arguments) to run a query
+
+        Args:
+            query: mongo filter
+            top_n: maximum number of documents to return
+            projection: fields to return (default: all fields)
+            sort: sort specification picking which `top_n` documents to return
+            (default: any `top_n` matching documents)
+            raw: return raw BSON batches instead of documents (see `decode_batches`)
+            per: return the `top_n` documents of each value of this field instead (e.g. of each day)
+            group_topn: pick the documents of each `per` group with $topN (MongoDB 5.2+),
+            otherwise by sorting, pushing, and slicing whole groups (any server version)
+
+        Returns:
+            name of the collection method, and its keyword arguments
+        """
+        suffix = '_raw_batches' if raw else ''
+
+        if top_n and per:
+            output = {f: f'${f}' for f, keep in projection.items() if keep and f != '_id'} if projection else '$$ROOT'
+
+            if group_topn:
+                # $topN keeps only top_n documents per group in memory
+                pipeline = [
+                    {'$match': query},
+                    {'$group': {'_id': f'${per}', 'top': {'$topN': {'n': top_n, 'sortBy': sort, 'output': output}}}},
+                ]
+                kwargs = {}
+            else:
+                # $push keeps the order of the $sort before it, but holds whole groups (spilling to disk if needed)
+                pipeline = [
+                    {'$match': query},
+                    {'$sort': {per: 1, **(sort or {})}},
+                    {'$group': {'_id': f'${per}', 'top': {'$push': output}}},
+                    {'$project': {'top': {'$slice': ['$top', top_n]}}},
+                ]
+                kwargs = {'allowDiskUse': True}
+
+            pipeline += [
+                {'$unwind': '$top'},
+                {'$replaceRoot': {'newRoot': '$top'}},
+            ]
+            return f'aggregate{suffix}', {'pipeline': pipeline, **kwargs}
+
+        elif top_n:
+            # $sort followed by $limit runs as a top-k sort, served by an index if one matches
+            pipeline = [{'$match': query}]
+            if sort:
+                pipeline.append({'$sort': sort})
+            pipeline.append({'$limit': top_n})
+            if projection:
+                pipeline.append({'$project': projection})
+            return f'aggregate{suffix}', {'pipeline': pipeline}
+        else:
+            return f'find{suffix}', {'filter': query, 'projection': projection}
+
+    def run_query(self,
+                  query: dict,
+                  top_n: Optional[int] = None,
+                  projection: Optional[dict] = None,
+                  sort: Optional[dict] = None,
+                  raw: bool = False,
+                  per: Optional[str] = None):
+        """Run a query against the collection
+
+        Args:
+            query: mongo filter
+            top_n: maximum number of documents to return
+            projection: fields to return (default: all fields)
+            sort: sort specification picking which `top_n` documents to return
+            raw: return raw BSON batches instead of documents
+            per: return the `top_n` documents of each value of this field instead
+
+        Returns:
+            a cursor over matching documents (or raw batches)
+        """
+        method, kwargs = self.query_plan(query, top_n, projection, sort, raw, per, self.group_topn)
+
+        try:
+            return getattr(self.database, method)(**kwargs)
+
+        except OperationFailure as e:
+            if not self.lacks_topn(e, top_n, per):
+                raise
+
+            method, kwargs = self.query_plan(query, top_n, projection, sort, raw, per, self.group_topn)
+            return getattr(self.database, method)(**kwargs)
+
+    def lacks_topn(self, error: OperationFailure, top_n: Optional[int] = None, per: Optional[str] = None) -> bool:
+        """Check if a query failed because the server does not support $topN,
+        remembering it for every later query on the same client
+
+        Args:
+            error: error raised by the query
+            top_n: number of documents of each group the query returns
+            per: field grouping the documents of the query
+
+        Returns:
+            whether to retry the query without $topN
+        """
+        if error.code != UNKNOWN_GROUP_OPERATOR or not (top_n and per and self.group_topn):
+            return False
+
+        logger.info("$topN is not supported by the server: picking the top documents of each group by sorting")
+        legacy_clients.add(self.database.database.client)
+        self.group_topn = False
+        return True
+
+    def execute(self,
+                query: dict,
+                build: Callable,
+                top_n: Optional[int] = None,
+                projection: Optional[dict] = None,
+                sort: Optional[dict] = None,
+                raw: bool = False,
+                per: Optional[str] = None):
+        """Run a query and build a dataframe from the matching documents
+
+        Args:
+            query: mongo filter
+            build: function building the dataframe from an iterable of documents (or raw batches)
+            top_n: maximum number of documents to return
+            projection: fields to return (default: all fields)
+            sort: sort specification picking which `top_n` documents to return
+            raw: pass raw BSON batches to `build` instead of documents
+            per: return the `top_n` documents of each value of this field instead
+
+        Returns:
+            the output of `build`
+        """
+        return build(self.run_query(query, top_n, projection, sort, raw, per))
+
+    def ngram_fields(self, columns: Optional[list] = None, sort_by: Optional[str] = None) -> (list, list):
+        """Output columns and database fields of ngram documents (see `select_fields`)"""
+        return select_fields(self.cols, self.db_cols, columns, sort_by)
+
+    def divergence_fields(self, columns: Optional[list] = None, sort_by: Optional[str] = None) -> (list, list):
+        """Output columns and database fields of divergence documents (see `select_fields`)"""
+        return select_fields(self.div_cols, self.db_div_cols, columns, sort_by)
+
+    def rank_frame(self, batches, index: pd.DatetimeIndex, columns: Optional[list] = None) -> pd.DataFrame:
+        """Build a rank timeseries from raw database batches"""
+        selected, db_cols = self.ngram_fields(columns)
+
+        table = decode_ngrams(batches, ["word", "time", *db_cols], self.progress, total=len(index))
+
+        cols = {"word": "ngram"}
+        cols.update(dict(zip(db_cols, selected)))
+        df = pd.DataFrame({c: table[db] for db, c in cols.items()}, index=pd.Index(table["time"], name="time"))
+        df = df.sort_index().drop_duplicates()
+        return df.asfreq('D')
+
+    def ngram_frame(self, batches, index: pd.DatetimeIndex, columns: Optional[list] = None) -> pd.DataFrame:
+        """Build an n-gram timeseries from raw database batches"""
+        cols, db_cols = self.ngram_fields(columns)
+        table = decode_batches(batches, ["time", *db_cols])
+        return daily_frame(table, index, cols, db_cols)
+
+    def ngram_frames(self,
+                     batches,
+                     index: pd.DatetimeIndex,
+                     word_list: list,
+                     columns: Optional[list] = None,
+                     nullable: bool = False) -> dict:
+        """Build one n-gram timeseries per word from raw database batches (see `daily_frame`)"""
+        cols, db_cols = self.ngram_fields(columns)
+        table = decode_batches(batches, ["word", "time", *db_cols])
+        rows = pd.DataFrame({"word": table["word"]}).groupby("word", sort=False).indices
+        missing = np.empty(0, dtype=np.intp)
+
+        return {
+            w: daily_frame(
+                {f: arr[rows.get(w, missing)] for f, arr in table.items()}, index, cols, db_cols, nullable=nullable
+            )
+            for w in word_list
+        }
+
+    def ngrams_array_frame(self, batches, word_list: list, columns: Optional[list] = None) -> pd.DataFrame:
+        """Build an array of n-gram timeseries from raw database batches"""
+        fields = ["word", "time", *self.ngram_fields(columns)[1]]
+        df = pd.DataFrame(decode_batches(batches, fields), columns=fields)
+        df.set_index("word", inplace=True, drop=False)
+
+        tl_df = pd.DataFrame(word_list)
+        tl_df.set_index(0, inplace=True)
+
+        df = tl_df.join(df)
+        df["word"] = df.index
+        cols = {d: k for d, k in zip(self.db_cols, self.cols)}
+        cols.update({"word": "ngram"})
+        df.rename(columns=cols, inplace=True)
+        df.reset_index(drop=True, inplace=True)
+        return df
+
+    def languages_frame(self, batches, index: pd.DatetimeIndex) -> pd.DataFrame:
+        """Build a language timeseries from raw database batches (summing documents of the same day)"""
+        table = decode_batches(batches, ["time", *self.lang_cols])
+        df = daily_frame(table, index, self.lang_cols, self.lang_cols, duplicates='sum')
+        df.columns = df.columns.str.replace(r"ft_", "")
+
+        df["count_no_rt"] = df["count"] - df["retweets"]
+        df["rank_no_rt"] = df["count_no_rt"].rank(method="average", ascending=False)
+        df["freq_no_rt"] = df["count_no_rt"] / df["count_no_rt"].sum()
+        return df
+
+    def zipf_frame(self, batches, rt: bool = True, columns: Optional[list] = None) -> pd.DataFrame:
+        """Build a Zipf distribution from raw database batches"""
+        sort_by = 'count' if rt else 'count_no_rt'
+        cols, db_cols = self.ngram_fields(columns, sort_by)
+
+        df = keyed_frame(decode_ngrams(batches, ["word", *db_cols], self.progress), "word", cols, db_cols)
+        df.sort_values(by=sort_by, ascending=False, inplace=True)
+        return df if columns is None else df[self.ngram_fields(columns)[0]]
+
+    def zipf_chunk(self, batch: bytes, columns: Optional[list] = None) -> pd.DataFrame:
+        """Build a chunk of a Zipf distribution from a single raw database batch (in database order)"""
+        cols, db_cols = self.ngram_fields(columns)
+        return keyed_frame(decode_batches([batch], ["word", *db_cols]), "word", cols, db_cols)
+
+    def divergence_frame(self, batches, rt: Optional[bool] = True, columns: Optional[list] = None) -> pd.DataFrame:
+        """Build a list of ngrams and their rank divergence contributions from raw database batches
+
+        Args:
+            batches: raw database batches
+            rt: sort by contributions in ATs (True) or OTs (False), or keep the database order (None)
+            columns: columns to return (default: all columns)
+
+        Returns:
+            dataframe of ngrams
+        """
+        if rt is None:
+            sort_by = None
+        else:
+            sort_by = 'rd_contribution' if rt else 'rd_contribution_no_rt'
+
+        cols, db_cols = self.divergence_fields(columns, sort_by)
+
+        df = keyed_frame(decode_ngrams(batches, ["ngram", *db_cols], self.progress), "ngram", cols, db_cols)
+        if sort_by:
+            df.sort_values(by=sort_by, ascending=False, inplace=True)
+
+        return df if columns is None else df[self.divergence_fields(columns)[0]]
+
+    def divergences_frame(self, batches, rt: bool = True, columns: Optional[list] = None) -> pd.DataFrame:
+        """Build lists of ngrams and their rank divergence contributions over several days from raw database batches
+
+        Args:
+            batches: raw database batches
+            rt: sort each day by contributions in ATs (True) or OTs (False)
+            columns: columns to return (default: all columns)
+
+        Returns:
+            dataframe indexed by (time_2, ngram), sorted by day then contribution
+        """
+        sort_by = 'rd_contribution' if rt else 'rd_contribution_no_rt'
+        cols, db_cols = self.divergence_fields(columns, sort_by)
+
+        table = decode_ngrams(batches, ["ngram", *dict.fromkeys(["time_2", *db_cols])], self.progress)
+        index = pd.MultiIndex.from_arrays(
+            [pd.DatetimeIndex(table["time_2"]), pd.Index(table["ngram"])],
+            names=["time_2", "ngram"],
+        )
+        df = pd.DataFrame(dict(zip(cols, (table[db] for db in db_cols))), index=index)
+
+        # by day, then by decreasing contribution (`time_2` is both an index level and a column)
+        contribution = df[sort_by].to_numpy(dtype=np.float64, na_value=np.nan)
+        df = df.iloc[np.lexsort((-contribution, index.codes[0]))] if len(df) else df
+
+        return df if columns is None else df[self.divergence_fields(columns)[0]]
+
+    def filter_day(self,
+                   df: pd.DataFrame,
+                   max_rank: Optional[int] = None,
+                   min_count: Optional[int] = None,
+                   top_n: Optional[int] = None,
+                   rt: bool = True,
+                   ngram_order: int = 1,
+                   ngram_filter: Optional[str] = None,
+                   columns: Optional[list] = None) -> pd.DataFrame:
+        """Apply the filters of `query_day` to a complete Zipf distribution (e.g. a day snapshot)"""
+        if max_rank:
+            df = df[df['rank' if rt else 'rank_no_rt'] <= max_rank]
+        elif min_count:
+            df = df[df['count' if rt else 'count_no_rt'] >= min_count]
+
+        if ngram_filter:
+            df = df[self.filter_mask(df.index, ngram_order, ngram_filter)]
+
+        if top_n:
+            df = df.sort_values(by='rank' if rt else 'rank_no_rt', kind='stable').head(top_n)
+
+        df = df.sort_values(by='count' if rt else 'count_no_rt', ascending=False)
+        return df if columns is None else df[self.ngram_fields(columns)[0]]
+
+    def filter_divergence(self,
+                          df: pd.DataFrame,
+                          max_rank: Optional[int] = None,
+                          top_n: Optional[int] = None,
+                          rt: bool = True,
+                          ngram_order: int = 1,
+                          ngram_filter: Optional[str] = None,
+                          columns: Optional[list] = None) -> pd.DataFrame:
+        """Apply the filters of `query_divergence` to a complete list of contributions (e.g. a day snapshot)"""
+        if max_rank:
+            df = df[df['rank_change' if rt else 'rank_change_no_rt'].between(-max_rank, max_rank)]
+
+        if ngram_filter:
+            df = df[self.filter_mask(df.index, ngram_order, ngram_filter)]
+
+        df = df.sort_values(by='rd_contribution' if rt else 'rd_contribution_no_rt', ascending=False)
+        if top_n:
+            df = df.head(top_n)
+
+        return df if columns is None else df[self.divergence_fields(columns)[0]]
+
     def query_rank(
             self,
             rank: int,
             start_time: Optional[datetime] = None,
-            end_time: Optional[datetime] = None
+            end_time: Optional[datetime] = None,
+            columns: Optional[list] = None
     ) -> pd.DataFrame:
 
         """Query database for rank timeseries
@@ -313,83 +645,80 @@ class Query:
             rank: target rank
             start_time: starting date for the query
             end_time: ending date for the query
+            columns: columns to return (default: all columns)
 
         Returns:
             dataframe of ngrams usage over time
         """
-        query, data = self.prepare_rank_query(rank, start_time, end_time)
-
-        df = pd.DataFrame(tqdm(
-            self.database.find(query),
-            desc="Retrieving ngrams",
-            unit="",
-            total=len(data.keys())
-        ))
-
-        cols = {"word": "ngram"}
-        cols.update(dict(zip(self.db_cols, self.cols)))
-        df = df.rename(columns=cols).set_index('time')
-        df = df[cols.values()].sort_index().drop_duplicates()
-        return df.asfreq('D')
+        query, index = self.prepare_rank_query(rank, start_time, end_time)
+        fields = projection("word", "time", *self.ngram_fields(columns)[1])
+        build = partial(self.rank_frame, index=index, columns=columns)
+        return self.execute(query, build, projection=fields, raw=True)
 
     def query_ngram(self,
                     word,
                     start_time: Optional[datetime] = None,
-                    end_time: Optional[datetime] = None) -> pd.DataFrame:
+                    end_time: Optional[datetime] = None,
+                    columns: Optional[list] = None) -> pd.DataFrame:
         """Query database for n-gram timeseries
 
         Args:
             word: target ngram
             start_time: starting date for the query
             end_time: ending date for the query
+            columns: columns to return (default: all columns)
 
         Returns:
             dataframe of ngrams usage over time
         """
-        query, data = self.prepare_ngram_query(word, start_time, end_time)
+        query, index = self.prepare_ngram_query(word, start_time, end_time)
+        fields = projection("time", *self.ngram_fields(columns)[1])
+        build = partial(self.ngram_frame, index=index, columns=columns)
+        return self.execute(query, build, projection=fields, raw=True)
+
+    def query_ngrams_timeseries(self,
+                                word_list: list,
+                                start_time: Optional[datetime] = None,
+                                end_time: Optional[datetime] = None,
+                                columns: Optional[list] = None,
+                                nullable: bool = False) -> dict:
+        """Query database for several n-gram timeseries at once
 
-        for i in self.database.find(query):
-            d = i["time"].date()
-            for c, db in zip(self.cols, self.db_cols):
-                try:
-                    data[d][c] = i[db]
-                except KeyError:
-                    logging.error(f'Database field names have changed for {d}')
+        Args:
+            word_list: list of strings to query mongo
+            start_time: starting date for the query
+            end_time: ending date for the query
+            columns: columns to return (default: all columns)
+            nullable: keep integer fields as nullable Int64 columns (default: float64 with NaN on missing days)
 
-        df = pd.DataFrame.from_dict(data=data, orient="index")
-        return df
+        Returns:
+            dictionary of dataframes (one per word, same as `query_ngram`)
+        """
+        query, index = self.prepare_ngram_query(list(word_list), start_time, end_time)
+        fields = projection("word", "time", *self.ngram_fields(columns)[1])
+        build = partial(self.ngram_frames, index=index, word_list=word_list, columns=columns, nullable=nullable)
+        return self.execute(query, build, projection=fields, raw=True)
 
     def query_ngrams_array(self,
                            word_list: list,
                            start_time: Optional[datetime] = None,
-                           end_time: Optional[datetime] = None) -> pd.DataFrame:
+                           end_time: Optional[datetime] = None,
+                           columns: Optional[list] = None) -> pd.DataFrame:
         """Query database for an array n-gram timeseries
 
         Args:
             word_list: list of strings to query mongo
             start_time: starting date for the query
             end_time: ending date for the query
+            columns: columns to return (default: all columns)
 
         Returns:
             dataframe of ngrams usage over time
         """
-
-        query, data = self.prepare_ngram_query(word_list, start_time, end_time)
-
-        df = pd.DataFrame(list(self.database.find(query)))
-        df.set_index("word", inplace=True, drop=False)
-
-        tl_df = pd.DataFrame(word_list)
-        tl_df.set_index(0, inplace=True)
-
-        df = tl_df.join(df)
-        df["word"] = df.index
-        df.drop("_id", axis=1, inplace=True)
-        cols = {d: k for d, k in zip(self.db_cols, self.cols)}
-        cols.update({"word": "ngram"})
-        df.rename(columns=cols, inplace=True)
-        df.reset_index(drop=True, inplace=True)
-        return df
+        query, _ = self.prepare_ngram_query(word_list, start_time, end_time)
+        fields = projection("word", "time", *self.ngram_fields(columns)[1])
+        build = partial(self.ngrams_array_frame, word_list=word_list, columns=columns)
+        return self.execute(query, build, projection=fields, raw=True)
 
     def query_languages(self,
                         lang: str,
@@ -405,26 +734,9 @@ class Query:
         Returns:
             dataframe of language over time
         """
-        query, data = self.prepare_lang_query(lang, start_time, end_time)
-
-        for i in self.database.find(query):
-            d = i["time"].date()
-            for c in self.lang_cols:
-                try:
-                    if np.isnan(data[d][c]):
-                        data[d][c] = i[c]
-                    else:
-                        data[d][c] += i[c]
-                except KeyError:
-                    pass
-
-        df = pd.DataFrame.from_dict(data=data, orient="index")
-        df.columns = df.columns.str.replace(r"ft_", "")
-
-        df["count_no_rt"] = df["count"] - df["retweets"]
-        df["rank_no_rt"] = df["count_no_rt"].rank(method="average", ascending=False)
-        df["freq_no_rt"] = df["count_no_rt"] / df["count_no_rt"].sum()
-        return df
+        query, index = self.prepare_lang_query(lang, start_time, end_time)
+        fields = projection("time", *self.lang_cols)
+        return self.execute(query, partial(self.languages_frame, index=index), projection=fields, raw=True)
 
     def query_day(self,
                   date: datetime,
@@ -433,7 +745,8 @@ class Query:
                   top_n: Optional[int] = None,
                   rt: bool = True,
                   ngram_order: int = 1,
-                  ngram_filter: Optional[str] = None):
+                  ngram_filter: Optional[str] = None,
+                  columns: Optional[list] = None):
 
         """Query database for all ngrams in a single day
 
@@ -442,45 +755,53 @@ class Query:
             max_rank: Max rank cutoff
             min_count: min count cutof
             rt: a toggle to apply the filters above on ATs or OTs (w/out RTs)
-            top_n: maximum number of ngrams to return
+            top_n: maximum number of ngrams to return (the top ranked ngrams)
             ngram_order: n_gram order
             ngram_filter: name of regex filter for ngrams
             (handles, hashtags, handles_hashtags, no_handles_hashtags, or latin)
+            columns: columns to return (default: all columns)
 
         Returns:
             dataframe of ngrams
         """
 
-        query = self.prepare_day_query(date, max_rank, min_count, rt)
+        query = self.prepare_zipf_query(date, max_rank, min_count, rt, ngram_order, ngram_filter)
+        fields = projection("word", *self.ngram_fields(columns, 'count' if rt else 'count_no_rt')[1])
+        sort = {'rank': 1} if rt else {'rank_noRT': 1}
+        return self.execute(query, partial(self.zipf_frame, rt=rt, columns=columns), top_n, fields, sort, raw=True)
+
+    def iter_day(self,
+                 date: datetime,
+                 max_rank: Optional[int] = None,
+                 min_count: Optional[int] = None,
+                 rt: bool = True,
+                 ngram_order: int = 1,
+                 ngram_filter: Optional[str] = None,
+                 columns: Optional[list] = None,
+                 chunk_size: int = 100000) -> Iterator[pd.DataFrame]:
+        """Stream all ngrams in a single day, one cursor batch at a time
 
-        if ngram_filter:
-            query = self.prepare_query_filter(ngram_order, query, ngram_filter, db_type='ngrams')
+        Args:
+            date: target date
+            max_rank: Max rank cutoff
+            min_count: min count cutof
+            rt: a toggle to apply the filters above on ATs or OTs (w/out RTs)
+            ngram_order: n_gram order
+            ngram_filter: name of regex filter for ngrams
+            (handles, hashtags, handles_hashtags, no_handles_hashtags, or latin)
+            columns: columns to return (default: all columns)
+            chunk_size: maximum number of ngrams per chunk
 
-        if top_n:
-            cur = self.database.aggregate([{'$match': query}, {'$limit': top_n}])
-        else:
-            cur = self.database.find(query)
-
-        zipf = {}
-        for t in tqdm(
-                cur,
-                desc="Retrieving ngrams",
-                unit=""
-        ):
-            zipf[t["word"]] = {}
-            for c, db in zip(self.cols, self.db_cols):
-                try:
-                    zipf[t["word"]][c] = t[db]
-                except KeyError:
-                    logging.error('Database field names have changed!!')
-
-        df = pd.DataFrame.from_dict(data=zipf, orient="index")
-        if rt:
-            df.sort_values(by='count', ascending=False, inplace=True)
-        else:
-            df.sort_values(by='count_no_rt', ascending=False, inplace=True)
+        Returns:
+            iterator over dataframes of ngrams, in database order
+        """
+        query = self.prepare_zipf_query(date, max_rank, min_count, rt, ngram_order, ngram_filter)
+        fields = projection("word", *self.ngram_fields(columns)[1])
 
-        return df
+        for batch in self.database.find_raw_batches(query, fields, batch_size=chunk_size):
+            chunk = self.zipf_chunk(batch, columns)
+            if not chunk.empty:
+                yield chunk
 
     def query_divergence(self,
                          date: datetime,
@@ -488,7 +809,8 @@ class Query:
                          top_n: Optional[int] = None,
                          rt: bool = True,
                          ngram_order: int = 1,
-                         ngram_filter: Optional[str] = None
+                         ngram_filter: Optional[str] = None,
+                         columns: Optional[list] = None
                          ) -> pd.DataFrame:
         """Query database for a list of narratively dominant ngrams for a given day
 
@@ -496,10 +818,11 @@ class Query:
             date: target date
             max_rank: Max rank cutoff
             rt: a toggle to apply the filters above on ATs or OTs (w/out RTs)
-            top_n: maximum number of ngrams to return
+            top_n: maximum number of ngrams to return (the top contributing ngrams)
             ngram_order: n_gram order
             ngram_filter: name of regex filter for ngrams
             (handles, hashtags, handles_hashtags, no_handles_hashtags, or latin)
+            columns: columns to return (default: all columns)
 
         Returns:
             dataframe of ngrams sorted by their rank div contributions
@@ -509,60 +832,186 @@ class Query:
         if ngram_filter:
             query = self.prepare_query_filter(ngram_order, query, ngram_filter, db_type='rtd')
 
-        if top_n:
-            cur = self.database.aggregate([{'$match': query}, {'$limit': top_n}])
-        else:
-            cur = self.database.find(query)
-
-        div = {}
-        for t in tqdm(
-                cur,
-                desc="Retrieving ngrams",
-                unit=""
-        ):
-            div[t["ngram"]] = {}
-            for c, db in zip(self.div_cols, self.db_div_cols):
-                try:
-                    div[t["ngram"]][c] = t[db]
-                except KeyError:
-                    logging.error('Database field names have changed!!')
-
-        df = pd.DataFrame.from_dict(data=div, orient="index")
-        if rt:
-            df.sort_values(by='rd_contribution', ascending=False, inplace=True)
-        else:
-            df.sort_values(by='rd_contribution_no_rt', ascending=False, inplace=True)
+        sort_by = 'rd_contribution' if rt else 'rd_contribution_no_rt'
+        fields = projection("ngram", *self.divergence_fields(columns, sort_by)[1])
+        sort = {'rd_contribution': -1} if rt else {'rd_contribution_noRT': -1}
+        build = partial(self.divergence_frame, rt=rt, columns=columns)
+        return self.execute(query, build, top_n, fields, sort, raw=True)
 
-        return df
+    def query_divergences(self,
+                          start_time: datetime,
+                          end_time: datetime,
+                          max_rank: Optional[int] = None,
+                          top_n: Optional[int] = None,
+                          rt: bool = True,
+                          ngram_order: int = 1,
+                          ngram_filter: Optional[str] = None,
+                          columns: Optional[list] = None
+                          ) -> pd.DataFrame:
+        """Query database for the narratively dominant ngrams of every day in a date range, in a single query
+
+        Args:
+            start_time: first day
+            end_time: last day
+            max_rank: Max rank cutoff
+            top_n: maximum number of ngrams to return per day (picked on the server)
+            rt: a toggle to apply the filters above on ATs or OTs (w/out RTs)
+            ngram_order: n_gram order
+            ngram_filter: name of regex filter for ngrams
+            (handles, hashtags, handles_hashtags, no_handles_hashtags, or latin)
+            columns: columns to return (default: all columns)
+
+        Returns:
+            dataframe of ngrams indexed by (time_2, ngram), sorted by day then contribution
+        """
+        query = self.prepare_divergence_query(start_time, max_rank, rt)
+        query["time_2"] = {"$gte": start_time, "$lte": end_time}
+
+        if ngram_filter:
+            query = self.prepare_query_filter(ngram_order, query, ngram_filter, db_type='rtd')
+
+        sort_by = 'rd_contribution' if rt else 'rd_contribution_no_rt'
+        fields = projection("ngram", *dict.fromkeys(["time_2", *self.divergence_fields(columns, sort_by)[1]]))
+        sort = {'rd_contribution': -1} if rt else {'rd_contribution_noRT': -1}
+        build = partial(self.divergences_frame, rt=rt, columns=columns)
+        return self.execute(query, build, top_n, fields, sort, raw=True, per='time_2')
 
     def query_rd_timeseries(self,
                             dates: tuple,
                             rt: bool = True,
+                            columns: Optional[list] = None
                             ) -> pd.DataFrame:
         """ Query database for a list of top ngrams over a daterange
 
         Args:
             dates: a tuple of datetimes for start and end dates
             rt: a toggle to search ATs or OTs
+            columns: columns to return (default: all columns)
 
         Returns:
             dataframe of ngrams with a DatetimeIndex
         """
         query = self.prepare_rd_timeseries_query(dates, rt)
-        cur = self.database.find(query)
-
-        div = {}
-        for t in tqdm(
-                cur,
-                desc="Retrieving ngrams",
-                unit=""
-        ):
-            div[t["ngram"]] = {}
-            for c, db in zip(self.div_cols, self.db_div_cols):
-                try:
-                    div[t["ngram"]][c] = t[db]
-                except KeyError:
-                    logging.error('Database field names have changed!!')
-
-        df = pd.DataFrame.from_dict(data=div, orient="index")
-        return df
+        fields = projection("ngram", *self.divergence_fields(columns)[1])
+        build = partial(self.divergence_frame, rt=None, columns=columns)
+        return self.execute(query, build, projection=fields, raw=True)
+
+
+def select_fields(cols: list,
+                  db_cols: list,
+                  columns: Optional[list] = None,
+                  sort_by: Optional[str] = None) -> (list, list):
+    """Map requested output columns to their database fields
+
+    Args:
+        cols: output column names
+        db_cols: database field names (in the same order as `cols`)
+        columns: requested output columns (default: all columns)
+        sort_by: extra output column needed to sort the results
+
+    Returns:
+        selected output columns, and their database fields
+    """
+    if columns is None:
+        return list(cols), list(db_cols)
+
+    unknown = [c for c in columns if c not in cols]
+    if unknown:
+        logger.warning(f"Ignoring unknown columns: {unknown}")
+
+    selected = [
+        (c, db) for c, db in zip(cols, db_cols)
+        if c in columns or c == sort_by
+    ]
+    return [c for c, db in selected], [db for c, db in selected]
+
+
+def projection(*fields) -> dict:
+    """Mongo projection returning only the given fields (without `_id`)"""
+    return {'_id': 0, **{f: 1 for f in fields}}
+
+
+def decode_ngrams(batches,
+                  fields: list,
+                  progress: Optional[ProgressHook] = None,
+                  total: Optional[int] = None) -> dict:
+    """Decode raw database batches (see `decode_batches`), reporting progress to a hook if any
+
+    Args:
+        batches: raw database batches
+        fields: document fields to keep
+        progress: progress hook (default: no progress)
+        total: expected number of documents (default: unknown)
+
+    Returns:
+        dictionary of arrays keyed by field
+    """
+    with track(progress, "Retrieving ngrams", total) as bar:
+        return decode_batches(batches, fields, progress=bar.update if bar is not None else None)
+
+
+def keyed_frame(table: dict, key: str, cols: list, db_cols: list) -> pd.DataFrame:
+    """Build a dataframe indexed by `key` from decoded database fields
+    (one row per key, holding the values of its last document)
+
+    Args:
+        table: arrays of database fields (see `decode_batches`)
+        key: database field to use as index
+        cols: output column names
+        db_cols: database fields of the output columns
+
+    Returns:
+        dataframe with one column per field
+    """
+    rows = last_occurrences(table[key])
+    if rows is not None:
+        table = {f: arr[rows] for f, arr in table.items()}
+
+    return pd.DataFrame(dict(zip(cols, (table[db] for db in db_cols))), index=pd.Index(table[key]))
+
+
+def daily_frame(table: dict,
+                index: pd.DatetimeIndex,
+                cols: list,
+                db_cols: list,
+                duplicates: str = 'last',
+                nullable: bool = False) -> pd.DataFrame:
+    """Build a daily timeseries from decoded database fields
+
+    Args:
+        table: arrays of database fields, including "time" (see `decode_batches`)
+        index: every day of the timeseries
+        cols: output column names
+        db_cols: database fields of the output columns
+        duplicates: how to merge documents of the same day (keep the "last" values, or "sum" them)
+        nullable: keep integer fields as nullable Int64 columns (see `numpy_dtypes`)
+
+    Returns:
+        dataframe indexed by date, with one column per field (NaN, or <NA> if nullable, on days without documents)
+    """
+    df = pd.DataFrame(
+        {c: table[db] for c, db in zip(cols, db_cols)},
+        index=pd.DatetimeIndex(table["time"]).normalize(),
+    )
+
+    if not df.index.is_unique:
+        days = df.groupby(level=0, sort=False)
+        df = days.sum(min_count=1) if duplicates == 'sum' else days.last()
+
+    if nullable:
+        df = df.astype({c: 'Int64' for c in df.columns if pd.api.types.is_integer_dtype(df[c].dtype)})
+
+    df = df.reindex(index)
+    df.index = pd.Index(index.date)
+    return df
+
+
+def numpy_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert nullable Int64 columns to the dtype they would have had as numpy columns:
+    int64, or float64 (NaN) if any value is missing
+    """
+    dtypes = {
+        c: 'float64' if df[c].hasnans else 'int64'
+        for c in df.columns if isinstance(df[c].dtype, pd.Int64Dtype)
+    }
+    return df.astype(dtypes) if dtypes else df
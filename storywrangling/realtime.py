@@ -1,143 +1,248 @@
-import warnings
-warnings.filterwarnings("ignore")
+import time
+import logging
+import pandas as pd
+from typing import Any, Callable, Iterator, Optional, Union
+from datetime import datetime
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import MongoClient
+
+from storywrangling.realtime_query import RealtimeQuery
+from storywrangling.cache import ResultCache
+from storywrangling.compact import compacting
+from storywrangling.connection import registry
+from storywrangling.loaders import load_parser, load_languages
+from storywrangling.progress import ProgressHook, progress_hook, track
+from storywrangling.regexr import ngram_order, ngram_orders, group_orders
 
-import sys
-from pathlib import Path
-file = Path(__file__).resolve()
-parent, root = file.parent, file.parents[1]
-sys.path.append(str(root))
+logger = logging.getLogger(__name__)
 
-try:
-    sys.path.remove(str(parent))
-except ValueError:
-    pass
 
-try:
-    import importlib.resources as pkg_resources
-except ImportError:
-    import importlib_resources as pkg_resources
+class RealtimeBase:
+    """Helpers shared by the Realtime and AsyncRealtime APIs, which do not touch the database"""
 
-import logging
-import ujson
-import pickle
-import pandas as pd
-from tqdm import tqdm
-from typing import Optional
-from datetime import datetime
+    def __init__(self,
+                 max_pool_size: int = 100,
+                 max_idle_time_ms: Optional[int] = 60000,
+                 compact: bool = False,
+                 progress: Union[bool, Callable, ProgressHook, None] = True) -> None:
+        self.max_pool_size = max_pool_size
+        self.max_idle_time_ms = max_idle_time_ms
+        self.compact = compact
+        self.progress = progress_hook(progress)
 
-import resources
-from storywrangling import RealtimeQuery
-from storywrangling.regexr import nparser
+    @property
+    def parser(self):
+        """Ngram tokenizer, loaded once per process on first use"""
+        return load_parser()
 
+    @property
+    def supported_languages(self) -> dict:
+        """Languages of the realtime database, loaded once per process on first use"""
+        return load_languages('realtime')
 
-logging.basicConfig(
-    stream=sys.stdout,
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+    def group_array(self, ngrams_list: list) -> dict:
+        """Partition an array of ngrams (lowercased) by ngram order, leaving out strings without any ngram
+
+        Args:
+            ngrams_list: list of ngrams
+
+        Returns:
+            a dictionary of unique ngrams for each ngram order
+        """
+        groups = group_orders([w.lower() for w in ngrams_list], self.parser)
+
+        if 0 in groups:
+            logger.warning(f"No ngram found in {groups.pop(0)}: skipping")
+
+        return groups
 
+    def batch_range(self, q: RealtimeQuery, start_time: datetime, end_time: Optional[datetime]) -> Optional[tuple]:
+        """Round a time range to 15-minute batches within the last 30 days (None if it does not overlap them)"""
+        start_time = pd.Timestamp(start_time).round(q.time_resolution).to_pydatetime()
+        end_time = pd.Timestamp(end_time).round(q.time_resolution).to_pydatetime() \
+            if end_time is not None else q.last_updated
 
-class Realtime:
+        start_time, end_time = max(start_time, q.reference_date), min(end_time, q.last_updated)
 
-    def __init__(self) -> None:
-        """Python API to access the realtime database"""
+        if start_time <= end_time:
+            return start_time, end_time
 
-        with pkg_resources.open_binary(resources, 'ngrams.bin') as f:
-            self.parser = pickle.load(f)
 
-        with pkg_resources.open_binary(resources, 'realtime_languages.json') as f:
-            self.supported_languages = ujson.load(f)
+class Realtime(RealtimeBase):
 
-    def get_ngram(self, ngram: str, lang: str = 'en') -> pd.DataFrame:
+    def __init__(self,
+                 max_pool_size: int = 100,
+                 max_idle_time_ms: Optional[int] = 60000,
+                 result_cache_size: Optional[int] = None,
+                 result_cache_copy: bool = True,
+                 compact: bool = False,
+                 progress: Union[bool, Callable, ProgressHook, None] = True) -> None:
+        """Python API to access the realtime database
+
+        Args:
+            max_pool_size: max number of concurrent connections to the database (default: 100)
+            max_idle_time_ms: close pooled connections idle for longer than this (default: 60000)
+            result_cache_size: max memory of the in-memory cache of results in bytes (default: no cache)
+            result_cache_copy: return deep copies of cached results,
+            otherwise copy-on-write views of them (default: True)
+            compact: return nullable int32 counts and ranks, float32 frequencies,
+            and categorical ngram/lang index levels, logging the bytes saved by each call (default: False)
+            progress: report the progress of queries and batched methods:
+            True for tqdm bars, None/False for none, a callback receiving (desc, done, total),
+            or a `ProgressHook` reporting every N updates (default: True)
+        """
+        super().__init__(max_pool_size, max_idle_time_ms, compact=compact, progress=progress)
+        self.result_cache = ResultCache(result_cache_size, copy=result_cache_copy) \
+            if result_cache_size else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @property
+    def client(self) -> MongoClient:
+        """Pooled client shared with every other API object using the same options"""
+        return registry.get_client(
+            owner=self,
+            max_pool_size=self.max_pool_size,
+            max_idle_time_ms=self.max_idle_time_ms,
+        )
+
+    def close(self) -> None:
+        """Release pooled connections borrowed by this object"""
+        registry.release(self)
+
+    def memoize(self, q: RealtimeQuery, method: str, args: tuple, fn: Callable[[], Any]) -> Any:
+        """Result of `fn`, from the in-memory result cache if enabled (see `ResultCache.memoize`)"""
+        if self.result_cache is None:
+            return fn()
+
+        return self.result_cache.memoize(q, method, args, fn)
+
+    @compacting
+    def get_ngram(self, ngram: str, lang: str = 'en', columns: Optional[list] = None) -> pd.DataFrame:
         """Query database for an ngram timeseries
 
         Args:
             ngram: target ngram
             lang: target language (iso code)
+            columns: columns to return (default: all columns)
 
         Returns:
             dataframe of ngrams usage over time
         """
         if self.supported_languages.get(lang) is not None:
             ngram = ngram.lower()
-            logging.info(f"Retrieving {self.supported_languages.get(lang)}: '{ngram}'")
+            logger.info(f"Retrieving {self.supported_languages.get(lang)}: '{ngram}'")
+
+            n = ngram_order(ngram, self.parser)
+            q = RealtimeQuery(f'realtime_{n}grams', lang, client=self.client, progress=self.progress)
 
-            n = len(nparser(ngram, parser=self.parser, n=1))
-            q = RealtimeQuery(f'realtime_{n}grams', lang)
-            df = q.query_ngram(ngram)
-            df.index.name = 'time'
-            df.index = pd.to_datetime(df.index)
-            return df
+            def query() -> pd.DataFrame:
+                df = q.query_ngram(ngram, columns=columns)
+                df.index.name = 'time'
+                df.index = pd.to_datetime(df.index)
+                return df
+
+            return self.memoize(q, 'get_ngram', (ngram, columns), query)
 
         else:
             logger.warning(f"Unsupported language: {lang}")
 
-    def get_ngrams_array(self, ngrams_list: list, lang: str = 'en') -> pd.DataFrame:
+    @compacting
+    def get_ngrams_array(self,
+                         ngrams_list: list,
+                         lang: str = 'en',
+                         columns: Optional[list] = None) -> pd.DataFrame:
         """Query database for an array ngram timeseries
 
+        Ngrams may mix orders: they are partitioned by ngram order,
+        and the collection of each order is queried concurrently.
+
         Args:
             ngrams_list: list of strings to query mongo
             lang: target language (iso code)
+            columns: columns to return (default: all columns)
 
         Returns:
             dataframe of ngrams usage over time
         """
         if self.supported_languages.get(lang) is not None:
-            ngrams_list = [w.lower() for w in ngrams_list]
-            n = len(nparser(ngrams_list[0], parser=self.parser, n=1))
-            logger.info(f"Retrieving timestamps for [{len(ngrams_list)}] {n}grams ...")
+            groups = self.group_array(ngrams_list)
+            if not groups:
+                return None
 
-            q = RealtimeQuery(f'realtime_{n}grams', lang)
-            df = q.query_ngrams_array(ngrams_list)
-            df['time'] = pd.to_datetime(df['time'])
-            df.set_index(['time', 'ngram'], inplace=True)
-            return df
+            def query_group(n: int, words: list) -> pd.DataFrame:
+                logger.info(f"Retrieving timestamps for [{len(words)}] {n}grams ...")
+                q = RealtimeQuery(f'realtime_{n}grams', lang, client=self.client, progress=self.progress)
+
+                def query() -> pd.DataFrame:
+                    df = q.query_ngrams_array(words, columns=columns)
+                    df['time'] = pd.to_datetime(df['time'])
+                    df.set_index(['time', 'ngram'], inplace=True)
+                    return df
+
+                return self.memoize(q, 'get_ngrams_array', (words, columns), query)
+
+            with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+                frames = list(pool.map(query_group, groups.keys(), groups.values()))
+
+            return frames[0] if len(frames) == 1 else pd.concat(frames)
 
         else:
             logger.warning(f"Unsupported language: {lang}")
 
-    def get_ngrams_tuples(self, ngrams_list: [(str, str)]) -> pd.DataFrame:
+    @compacting
+    def get_ngrams_tuples(self,
+                          ngrams_list: [(str, str)],
+                          columns: Optional[list] = None) -> pd.DataFrame:
         """Query database for an array ngram timeseries
 
         Args:
             ngrams_list: list of tuples (ngram, lang)
+            columns: columns to return (default: all columns)
 
         Returns:
             dataframe of ngrams usage over time
         """
 
         ngrams = []
-        pbar = tqdm(ngrams_list, desc='Retrieving', leave=True, unit="")
+        words = [w.lower() for w, _ in ngrams_list]
+        with track(self.progress, 'Retrieving', len(ngrams_list)) as pbar:
+            for (_, lang), w, n in zip(ngrams_list, words, ngram_orders(words, self.parser)):
+                if pbar is not None:
+                    pbar.set_description(f"Retrieving: ({self.supported_languages.get(lang)}) {w.rstrip()}")
 
-        for w, lang in pbar:
-            w = w.lower()
-            pbar.set_description(f"Retrieving: ({self.supported_languages.get(lang)}) {w.rstrip()}")
+                q = RealtimeQuery(f'realtime_{n}grams', lang, client=self.client, progress=self.progress)
+                df = self.memoize(q, 'get_ngrams_tuples', (w, columns), partial(q.query_ngram, w, columns=columns))
 
-            n = len(nparser(w, parser=self.parser, n=1))
-            q = RealtimeQuery(f'realtime_{n}grams', lang)
-            df = q.query_ngram(w)
+                df["ngram"] = w
+                df["lang"] = self.supported_languages.get(lang) \
+                    if self.supported_languages.get(lang) is not None else "en"
 
-            df["ngram"] = w
-            df["lang"] = self.supported_languages.get(lang) \
-                if self.supported_languages.get(lang) is not None else "en"
+                df.index.name = 'time'
+                df.index = pd.to_datetime(df.index)
+                df.set_index([df.index, 'ngram', 'lang'], inplace=True)
+                ngrams.append(df)
 
-            df.index.name = 'time'
-            df.index = pd.to_datetime(df.index)
-            df.set_index([df.index, 'ngram', 'lang'], inplace=True)
-            ngrams.append(df)
-            pbar.refresh()
+                if pbar is not None:
+                    pbar.update()
 
         ngrams = pd.concat(ngrams)
         return ngrams
 
+    @compacting
     def get_zipf_dist(self,
                       dtime: Optional[datetime] = None,
                       lang: str = 'en',
                       ngrams: str = '1grams',
                       max_rank: Optional[int] = None,
                       min_count: Optional[int] = None,
-                      rt: bool = True) -> pd.DataFrame:
+                      rt: bool = True,
+                      columns: Optional[list] = None) -> pd.DataFrame:
         """Query database for ngram Zipf distribution for a given 15-minute batch
 
         Args:
@@ -147,13 +252,14 @@ class Realtime:
             max_rank: Max rank cutoff (default is None)
             min_count: min count cutoff (default is None)
             rt: a toggle to apply the filters above on ATs or OTs (w/out RTs)
+            columns: columns to return (default: all columns)
 
         Returns:
             dataframe of ngrams
         """
 
         if self.supported_languages.get(lang) is not None:
-            q = RealtimeQuery(f'realtime_{ngrams}', lang)
+            q = RealtimeQuery(f'realtime_{ngrams}', lang, client=self.client, progress=self.progress)
 
             if dtime is None or dtime > q.last_updated:
                 dtime = q.last_updated
@@ -163,16 +269,245 @@ class Realtime:
             if q.reference_date <= dtime <= q.last_updated:
                 logger.info(f"Retrieving {self.supported_languages.get(lang)} {ngrams} for {dtime} ...")
 
-                df = q.query_batch(
-                    dtime,
+                def query() -> pd.DataFrame:
+                    df = q.query_batch(
+                        dtime,
+                        max_rank=max_rank,
+                        min_count=min_count,
+                        rt=rt,
+                        columns=columns,
+                    )
+                    df.index.name = 'ngram'
+                    return df
+
+                return self.memoize(q, 'get_zipf_dist', (dtime, max_rank, min_count, rt, columns), query)
+
+            else:
+                logger.warning(f"Date should be within the last 30 days")
+        else:
+            logger.warning(f"Unsupported language: {lang}")
+
+    @compacting
+    def get_zipf_dists(self,
+                       start_time: datetime,
+                       end_time: Optional[datetime] = None,
+                       lang: str = 'en',
+                       ngrams: str = '1grams',
+                       max_rank: Optional[int] = None,
+                       min_count: Optional[int] = None,
+                       rt: bool = True,
+                       columns: Optional[list] = None,
+                       rollup: Optional[str] = None) -> pd.DataFrame:
+        """Query database for ngram Zipf distributions of every 15-minute batch in a time range
+
+        Args:
+            start_time: first batch
+            end_time: last batch (default: the latest one)
+            lang: target language (iso code)
+            ngrams: target ngram collection ("1grams", "2grams")
+            max_rank: Max rank cutoff (default is None)
+            min_count: min count cutoff (default is None)
+            rt: a toggle to apply the filters above on ATs or OTs (w/out RTs)
+            columns: columns to return (default: all columns)
+            rollup: merge batches into hourly ("h") or daily ("D") distributions (default: no rollup);
+            counts add up, freqs and relative ranks are averaged, and ranks follow merged counts
+
+        Returns:
+            dataframe of ngrams indexed by (time, ngram)
+        """
+
+        if self.supported_languages.get(lang) is not None:
+            q = RealtimeQuery(f'realtime_{ngrams}', lang, client=self.client, progress=self.progress)
+            bounds = self.batch_range(q, start_time, end_time)
+
+            if bounds is not None:
+                logger.info(f"Retrieving {self.supported_languages.get(lang)} {ngrams} from {bounds[0]} to {bounds[1]} ...")
+
+                def query() -> pd.DataFrame:
+                    return q.query_batches(
+                        *bounds,
+                        max_rank=max_rank,
+                        min_count=min_count,
+                        rt=rt,
+                        columns=columns,
+                        rollup=rollup,
+                    )
+
+                return self.memoize(
+                    q,
+                    'get_zipf_dists',
+                    (bounds, max_rank, min_count, rt, columns, rollup),
+                    query,
+                )
+
+            else:
+                logger.warning(f"Dates should be within the last 30 days")
+        else:
+            logger.warning(f"Unsupported language: {lang}")
+
+    def iter_zipf_dist(self,
+                       start_time: datetime,
+                       end_time: Optional[datetime] = None,
+                       lang: str = 'en',
+                       ngrams: str = '1grams',
+                       max_rank: Optional[int] = None,
+                       min_count: Optional[int] = None,
+                       rt: bool = True,
+                       columns: Optional[list] = None) -> Iterator[tuple]:
+        """Stream ngram Zipf distributions of every 15-minute batch in a time range, from a single query
+
+        Args:
+            start_time: first batch
+            end_time: last batch (default: the latest one)
+            lang: target language (iso code)
+            ngrams: target ngram collection ("1grams", "2grams")
+            max_rank: Max rank cutoff (default is None)
+            min_count: min count cutoff (default is None)
+            rt: a toggle to apply the filters above on ATs or OTs (w/out RTs)
+            columns: columns to return (default: all columns)
+
+        Returns:
+            iterator over (time, dataframe of ngrams) pairs, in time order
+        """
+
+        if self.supported_languages.get(lang) is not None:
+            q = RealtimeQuery(f'realtime_{ngrams}', lang, client=self.client, progress=self.progress)
+            bounds = self.batch_range(q, start_time, end_time)
+
+            if bounds is not None:
+                logger.info(f"Streaming {self.supported_languages.get(lang)} {ngrams} from {bounds[0]} to {bounds[1]} ...")
+
+                for t, df in q.iter_batches(
+                    *bounds,
                     max_rank=max_rank,
                     min_count=min_count,
-                    rt=rt
-                )
-                df.index.name = 'ngram'
-                return df
+                    rt=rt,
+                    columns=columns,
+                ):
+                    df.index.name = 'ngram'
+                    yield t, df
 
             else:
-                logger.warning(f"Date should be within the last 30 days")
+                logger.warning(f"Dates should be within the last 30 days")
         else:
             logger.warning(f"Unsupported language: {lang}")
+
+    def watch(self, ngrams_list: list, lang: str = 'en', columns: Optional[list] = None) -> 'RealtimeWatcher':
+        """Watch realtime ngram timeseries, fetching only the batches that landed since the last poll
+
+        Args:
+            ngrams_list: list of ngrams to watch (see `RealtimeWatcher.add` to watch other languages)
+            lang: target language (iso code)
+            columns: columns to return (default: all columns)
+
+        Returns:
+            watcher to poll (or stream) for new batches
+        """
+        watcher = RealtimeWatcher(self, columns=columns)
+        watcher.add(ngrams_list, lang=lang)
+        return watcher
+
+
+class RealtimeWatcher:
+    """Incremental view of realtime ngram timeseries
+
+    Keeps the last batch seen for each watched ngram, so every poll only asks for newer batches,
+    with a single query per language collection for all of its ngrams.
+    Case variants are merged like in `Realtime.get_ngrams_array`.
+    """
+
+    def __init__(self, realtime: Realtime, columns: Optional[list] = None) -> None:
+        """
+        Args:
+            realtime: API object to query the database with
+            columns: columns to return (default: all columns)
+        """
+        self.realtime = realtime
+        self.columns = columns
+
+        # last batch seen for each ngram (None before the first poll), keyed by (database, lang)
+        self.seen = {}
+
+        # timeseries of the last 30 days, keyed by (ngram, lang)
+        self.frames = {}
+
+    def add(self, ngrams_list: list, lang: str = 'en') -> None:
+        """Watch more ngrams (their whole timeseries is fetched on the next poll)
+
+        Args:
+            ngrams_list: list of ngrams to watch
+            lang: target language (iso code)
+        """
+        if self.realtime.supported_languages.get(lang) is None:
+            logger.warning(f"Unsupported language: {lang}")
+            return
+
+        for n, words in self.realtime.group_array(ngrams_list).items():
+            for w in words:
+                self.seen.setdefault((f'realtime_{n}grams', lang), {}).setdefault(w, None)
+
+    def remove(self, ngrams_list: list, lang: str = 'en') -> None:
+        """Stop watching ngrams
+
+        Args:
+            ngrams_list: list of ngrams to drop
+            lang: target language (iso code)
+        """
+        for w in ngrams_list:
+            w = w.lower()
+            for (_, target), seen in self.seen.items():
+                if target == lang:
+                    seen.pop(w, None)
+            self.frames.pop((w, lang), None)
+
+    def poll(self) -> dict:
+        """Fetch the batches that landed since the last poll
+
+        Returns:
+            dataframes of the new batches keyed by (ngram, lang), for ngrams with any new batch
+            (updated timeseries are in `frames`)
+        """
+        updates = {}
+
+        for (db, lang), seen in self.seen.items():
+            if not seen:
+                continue
+
+            q = RealtimeQuery(db, lang, client=self.realtime.client, progress=self.realtime.progress)
+            df = q.query_ngrams_since(seen, columns=self.columns)
+
+            if df.empty:
+                continue
+
+            df['time'] = pd.to_datetime(df['time'])
+            for w, rows in df.groupby('ngram', sort=False):
+                rows = rows.drop(columns='ngram').set_index('time')
+
+                frame = self.frames.get((w, lang))
+                if frame is not None:
+                    # older batches roll out of the realtime window
+                    self.frames[(w, lang)] = pd.concat([frame[frame.index >= q.reference_date], rows])
+                else:
+                    self.frames[(w, lang)] = rows
+
+                seen[w] = rows.index[-1].to_pydatetime()
+                updates[(w, lang)] = rows
+
+        return updates
+
+    def stream(self, interval: float = 60) -> Iterator[dict]:
+        """Poll forever, yielding new batches as they land
+
+        Args:
+            interval: seconds to wait between polls
+
+        Yields:
+            dataframes of the new batches keyed by (ngram, lang) (see `poll`)
+        """
+        while True:
+            updates = self.poll()
+
+            if updates:
+                yield updates
+
+            time.sleep(interval)
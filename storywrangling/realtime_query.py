@@ -1,77 +1,47 @@
-import warnings
-warnings.filterwarnings("ignore")
-
-import sys
-from pathlib import Path
-file = Path(__file__).resolve()
-parent, root = file.parent, file.parents[1]
-sys.path.append(str(root))
-
-try:
-    sys.path.remove(str(parent))
-except ValueError:
-    pass
-
-try:
-    import importlib.resources as pkg_resources
-except ImportError:
-    import importlib_resources as pkg_resources
-
-import numpy as np
 import pandas as pd
-from tqdm import tqdm
-from typing import Optional, Union
+from functools import partial
+from typing import Callable, Iterator, Optional, Union
 from datetime import datetime
-from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo import MongoClient, ASCENDING
 from pymongo.cursor import Cursor
-from pymongo.errors import ServerSelectionTimeoutError
 
-import ujson
-import resources
+from storywrangling.query import select_fields, projection, decode_ngrams
+from storywrangling.columnar import decode_batches
+from storywrangling.connection import registry
+from storywrangling.metadata import metadata_cache, CollectionMetadata
+from storywrangling.progress import ProgressHook, progress_hook
 
 
 class RealtimeQuery:
     """Class to work with n-gram db"""
 
-    def __init__(self, db: str, lang: str) -> None:
+    def __init__(self,
+                 db: str,
+                 lang: str,
+                 client: Optional[MongoClient] = None,
+                 metadata: Optional[CollectionMetadata] = None,
+                 progress: Union[bool, Callable, ProgressHook, None] = True) -> None:
         """Python wrapper to access database on hydra.uvm.edu
 
         Args:
             db: database to use
             lang: language collection to use
+            client: pooled MongoClient to use (default: shared client from the registry)
+            metadata: collection metadata, if already known (default: looked up in the metadata cache)
+            progress: progress of decoding query results, see `storywrangling.progress` (default: tqdm bars)
         """
-        with pkg_resources.open_binary(resources, 'client.json') as f:
-            self.credentials = ujson.load(f)
-
-        try:
-            client = MongoClient(
-                f"{self.credentials['database']}://"
-                f"{self.credentials['username']}:"
-                f"{self.credentials['pwd']}"
-                f"@{self.credentials['domain']}:"
-                f"{self.credentials['port']}",
-                serverSelectionTimeoutMS=5000,
-                connect=True
-            )
-            client.server_info()
-
-        except ServerSelectionTimeoutError:
-            client = MongoClient(
-                f"{self.credentials['database']}://"
-                f"{self.credentials['username']}:"
-                f"{self.credentials['pwd']}"
-                f"@localhost:"
-                f"{self.credentials['port']}",
-                serverSelectionTimeoutMS=5000
-            )
+        if client is None:
+            client = registry.get_client()
 
         db = client[db]
         self.database = db[lang]
         self.lang = lang
+        self.progress = progress_hook(progress)
 
         self.time_resolution = '15min'
-        self.reference_date = list(self.database.find().sort([('time', ASCENDING)]).limit(1))[0]['time']
-        self.last_updated = list(self.database.find().sort([('time', DESCENDING)]).limit(1))[0]['time']
+        self.metadata = metadata if metadata else metadata_cache.get(self.database, cadence=self.time_resolution)
+        self.reference_date = self.metadata.reference_date
+        self.last_updated = self.metadata.last_updated
 
         self.cols = [
             "count",
@@ -83,17 +53,26 @@ class RealtimeQuery:
             "r_rel"
         ]
 
-    def prepare_data(self, query: dict, cols: list) -> dict:
-        return {
-            t: {c: np.nan for c in cols}
-            for t in pd.date_range(
-                start=query["time"]["$gte"],
-                end=query["time"]["$lte"],
-                freq="15min",
-            ).round(self.time_resolution).to_pydatetime().tolist()
+        # accumulators merging case variants of an ngram (in the column order of merged arrays)
+        self.merge_ops = {
+            "count": "$sum",
+            "count_no_rt": "$sum",
+            "freq": "$sum",
+            "freq_no_rt": "$sum",
+            "rank": "$min",
+            "rank_no_rt": "$min",
+            "r_rel": "$avg",
         }
 
-    def prepare_ngram_query(self, word: Union[str, list]) -> (dict, dict):
+    def time_index(self, query: dict) -> pd.DatetimeIndex:
+        """Every 15-minute batch between the time bounds of a query"""
+        return pd.date_range(
+            start=query["time"]["$gte"],
+            end=query["time"]["$lte"],
+            freq="15min",
+        ).round(self.time_resolution)
+
+    def prepare_ngram_query(self, word: Union[str, list]) -> (dict, pd.DatetimeIndex):
         query = {
             "word": {"$in": word} if type(word) is list else word,
             "time": {
@@ -101,9 +80,9 @@ class RealtimeQuery:
                 "$lte": self.last_updated,
             }
         }
-        return query, self.prepare_data(query, self.cols)
+        return query, self.time_index(query)
 
-    def prepare_rank_query(self, rank: int) -> (dict, dict):
+    def prepare_rank_query(self, rank: int) -> (dict, pd.DatetimeIndex):
         query = {
             "rank": rank,
             "time": {
@@ -111,7 +90,56 @@ class RealtimeQuery:
                 "$lte": self.last_updated,
             }
         }
-        return query, self.prepare_data(query, self.cols)
+        return query, self.time_index(query)
+
+    def prepare_delta_query(self, since: dict) -> (dict, dict):
+        """Filter on the batches that landed after the last one seen for each ngram
+
+        Not bounded by `last_updated`, so batches landing after the metadata was cached are not missed.
+
+        Args:
+            since: last batch already seen keyed by ngram (None for new ngrams)
+
+        Returns:
+            mongo filter (None if there are no ngrams),
+            and the first batch missing for each ngram
+        """
+        step = pd.Timedelta(self.time_resolution)
+        starts = {
+            w: max(t + step, self.reference_date) if t is not None else self.reference_date
+            for w, t in since.items()
+        }
+
+        groups = {}
+        for w, t in starts.items():
+            groups.setdefault(t, []).append(w)
+
+        if not groups:
+            return None, starts
+
+        # one clause per group of ngrams sharing the same first missing batch
+        clauses = [{"word": {"$in": words}, "time": {"$gte": t}} for t, words in groups.items()]
+        query = clauses[0] if len(clauses) == 1 else {"$or": clauses}
+        return query, starts
+
+    def prepare_merge_pipeline(self, query: dict, cols: list, by: list, ops: Optional[dict] = None) -> list:
+        """Aggregation merging the case variants of ngrams on the server
+
+        Args:
+            query: mongo filter
+            cols: fields to merge (counts and freqs are summed, ranks keep the top one)
+            by: fields identifying a merged document (e.g. time and word)
+            ops: accumulators overriding `merge_ops` (e.g. {"r_rel": "$sum"})
+
+        Returns:
+            pipeline returning one document per distinct value of `by`
+        """
+        ops = {**self.merge_ops, **(ops or {})}
+        return [
+            {"$match": query},
+            {"$group": {"_id": {f: f"${f}" for f in by}, **{c: {ops[c]: f"${c}"} for c in cols}}},
+            {"$project": {"_id": 0, **{f: f"$_id.{f}" for f in by}, **{c: 1 for c in cols}}},
+        ]
 
     def prepare_day_query(self,
                           date: datetime,
@@ -145,74 +173,241 @@ class RealtimeQuery:
         else:
             return {"time": date if date else self.last_updated}
 
-    def run_query(self, q: dict) -> Cursor:
-        query = self.database.find(q)
+    def prepare_range_query(self,
+                            start_time: datetime,
+                            end_time: datetime,
+                            max_rank: Optional[int] = None,
+                            min_count: Optional[int] = None,
+                            rt: bool = True) -> dict:
+        """Same filter as `prepare_day_query` over every batch between two timestamps"""
+        query = self.prepare_day_query(start_time, max_rank, min_count, rt)
+        query["time"] = {"$gte": start_time, "$lte": end_time}
         return query
 
-    def query_ngram(self, word: str) -> pd.DataFrame:
+    def run_query(self, q: Union[dict, list], projection: Optional[dict] = None, raw: bool = False) -> Cursor:
+        suffix = '_raw_batches' if raw else ''
+
+        if isinstance(q, list):
+            return getattr(self.database, f'aggregate{suffix}')(q)
+
+        return getattr(self.database, f'find{suffix}')(q, projection)
+
+    def execute(self,
+                query: Union[dict, list],
+                build: Callable,
+                projection: Optional[dict] = None,
+                raw: bool = False):
+        """Run a query and build a dataframe from the matching documents
+
+        Args:
+            query: mongo filter, or aggregation pipeline
+            build: function building the dataframe from an iterable of documents (or raw batches)
+            projection: fields to return (default: all fields)
+            raw: pass raw BSON batches to `build` instead of documents (see `decode_batches`)
+
+        Returns:
+            the output of `build`
+        """
+        return build(self.run_query(query, projection, raw))
+
+    def fields(self, columns: Optional[list] = None, sort_by: Optional[str] = None) -> list:
+        """Database fields of the requested columns (see `select_fields`)"""
+        return select_fields(self.cols, self.cols, columns, sort_by)[0]
+
+    def ngram_frame(self, batches, index: pd.DatetimeIndex, columns: Optional[list] = None) -> pd.DataFrame:
+        """Build an n-gram timeseries from raw batches of merged documents (one per batch)"""
+        cols = self.fields(columns)
+        table = decode_batches(batches, ["time", *cols])
+        df = pd.DataFrame({c: table[c] for c in cols}, index=pd.DatetimeIndex(table["time"]))
+        return df.reindex(index)
+
+    def ngrams_array_frame(self,
+                           batches,
+                           index: Optional[pd.DatetimeIndex],
+                           word_list: list,
+                           columns: Optional[list] = None) -> pd.DataFrame:
+        """Build an array of n-gram timeseries from raw batches of merged documents (one per batch and word),
+        with a row for every batch of `index` and word of `word_list` (or only the documents if `index` is None)"""
+        cols = [c for c in self.merge_ops if c in self.fields(columns)]
+        table = decode_batches(batches, ["word", "time", *cols])
+
+        df = pd.DataFrame(
+            {c: table[c] for c in cols},
+            index=pd.MultiIndex.from_arrays(
+                [pd.DatetimeIndex(table["time"]), table["word"]],
+                names=['time', 'ngram'],
+            ),
+        )
+        if index is not None:
+            df = df.reindex(pd.MultiIndex.from_product([index, word_list], names=['time', 'ngram']))
+
+        return df.reset_index()
+
+    def batch_frame(self, batches, rt: bool = True, columns: Optional[list] = None) -> pd.DataFrame:
+        """Build a Zipf distribution from raw database batches"""
+        fields = ["word", *self.fields(columns, 'count' if rt else 'count_no_rt')]
+
+        df = pd.DataFrame(
+            decode_ngrams(batches, fields, self.progress),
+            columns=fields,
+        ).rename(columns={"word": "ngram"})
+
+        if not df.empty:
+            if rt:
+                df.sort_values(by='count', ascending=False, inplace=True)
+            else:
+                df.sort_values(by='count_no_rt', ascending=False, inplace=True)
+
+            if columns is not None:
+                df = df[['ngram'] + self.fields(columns)]
+
+        return df
+
+    def batch_fields(self, rt: bool = True, columns: Optional[list] = None, rollup: bool = False) -> list:
+        """Database fields needed to sort (and roll up) Zipf distributions of the requested columns"""
+        fields = self.fields(columns, 'count' if rt else 'count_no_rt')
+
+        if rollup:
+            # ranks of merged periods come from merged counts
+            ranks = [('rank', 'count'), ('rank_no_rt', 'count_no_rt')]
+            fields += [c for r, c in ranks if r in fields and c not in fields]
+
+        return fields
+
+    def batches_frame(self,
+                      batches,
+                      rt: bool = True,
+                      columns: Optional[list] = None,
+                      rollup: Optional[str] = None) -> pd.DataFrame:
+        """Build the Zipf distributions of several batches from raw database batches
+
+        Args:
+            batches: raw database batches
+            rt: sort each distribution by count (otherwise by count without RTs)
+            columns: columns to return (default: all columns)
+            rollup: merge batches into coarser periods (pandas offset alias, e.g. "h" or "D"; see `rollup`)
+
+        Returns:
+            dataframe indexed by (time, ngram), sorted by time then count
+        """
+        sort_by = 'count' if rt else 'count_no_rt'
+        fields = self.batch_fields(rt, columns, bool(rollup))
+        table = decode_batches(batches, ["time", "word", *fields])
+        df = pd.DataFrame({c: table[c] for c in fields})
+        df.index = pd.MultiIndex.from_arrays(
+            [pd.DatetimeIndex(table["time"]), pd.Index(table["word"], dtype=str)],
+            names=['time', 'ngram'],
+        )
+
+        if rollup:
+            df = self.rollup(df, rollup)
+
+        df = df.sort_values(by=['time', sort_by], ascending=[True, False], kind='stable')
+        return df[self.fields(columns)]
+
+    def rollup(self, df: pd.DataFrame, freq: str) -> pd.DataFrame:
+        """Merge the Zipf distributions of 15-minute batches into coarser periods
+
+        Case variants of an ngram are first merged within each batch (see `merge_ops`).
+        Counts then add up, frequencies and relative ranks are averaged over every batch of the period
+        (batches without the ngram count as 0), and ranks are recomputed from the merged counts
+        (ties share their average rank).
+
+        Args:
+            df: dataframe indexed by (time, ngram)
+            freq: length of a period (pandas offset alias, e.g. "h" or "D")
+
+        Returns:
+            dataframe indexed by (start of the period, ngram)
+        """
+        accumulators = {"$sum": "sum", "$min": "min", "$avg": "mean"}
+        merged = df.groupby(level=['time', 'ngram'], sort=False).agg(
+            {c: accumulators[self.merge_ops[c]] for c in df.columns}
+        )
+
+        times = merged.index.get_level_values('time')
+        batches = times.unique().floor(freq).value_counts()
+
+        cols = [c for c in df.columns if not c.startswith('rank')]
+        merged = merged[cols].groupby([times.floor(freq), merged.index.get_level_values('ngram')]).sum()
+
+        periods = merged.index.get_level_values('time').map(batches).to_numpy()
+        for c in cols:
+            if not c.startswith('count'):
+                merged[c] = merged[c] / periods
+
+        for rank, count in (('rank', 'count'), ('rank_no_rt', 'count_no_rt')):
+            if rank in df.columns:
+                merged[rank] = merged.groupby(level='time')[count].rank(ascending=False, method='average')
+
+        return merged[list(df.columns)]
+
+    def query_ngram(self, word: str, columns: Optional[list] = None) -> pd.DataFrame:
         """Query database for n-gram timeseries
 
         Args:
             word: target ngram
+            columns: columns to return (default: all columns)
 
         Returns:
             dataframe of ngrams usage over time
         """
-        query, data = self.prepare_ngram_query(word)
-
-        for i in self.run_query(query):
-            d = i["time"]
-            for c in self.cols:
-                if np.isnan(data[d][c]):
-                    data[d][c] = i[c]
-                else:
-                    # take top rank for case insensitive queries
-                    if 'rank' in c:
-                        data[d][c] = np.min([data[d][c], i[c]])
-                    # add up counts and freqs for case insensitive queries
-                    else:
-                        data[d][c] += i[c]
-
-        df = pd.DataFrame.from_dict(data=data, orient="index")
-        return df
+        query, index = self.prepare_ngram_query(word)
+        # case variants of the ngram are merged on the server (relative ranks add up, like counts)
+        pipeline = self.prepare_merge_pipeline(query, self.fields(columns), ["time"], {"r_rel": "$sum"})
+        return self.execute(pipeline, partial(self.ngram_frame, index=index, columns=columns), raw=True)
 
-    def query_ngrams_array(self, word_list: list) -> pd.DataFrame:
+    def query_ngrams_array(self, word_list: list, columns: Optional[list] = None) -> pd.DataFrame:
         """Query database for an array n-gram timeseries
 
         Args:
             word_list: list of strings to query mongo
+            columns: columns to return (default: all columns)
 
         Returns:
             dataframe of ngrams usage over time
         """
+        query, index = self.prepare_ngram_query(word_list)
+        pipeline = self.prepare_merge_pipeline(query, self.fields(columns), ["time", "word"])
+        build = partial(self.ngrams_array_frame, index=index, word_list=word_list, columns=columns)
+        return self.execute(pipeline, build, raw=True)
 
-        query, data = self.prepare_ngram_query(word_list)
+    def query_ngrams_since(self, since: dict, columns: Optional[list] = None) -> pd.DataFrame:
+        """Query database for the batches of an array of n-grams that landed after the last one seen
 
-        df = pd.DataFrame(
-            self.run_query(query),
-        ).rename(columns={"word": "ngram"})
+        Args:
+            since: last batch already seen keyed by ngram (None to get the whole timeseries)
+            columns: columns to return (default: all columns)
 
-        df = df.groupby(['time', 'ngram']).agg({
-            'count': 'sum',
-            'count_no_rt': 'sum',
-            'freq': 'sum',
-            'freq_no_rt': 'sum',
-            'rank': 'min',
-            'rank_no_rt': 'min',
-            'r_rel': 'mean',
-        })
+        Returns:
+            dataframe of ngrams usage over time (same layout as `query_ngrams_array`),
+            holding only the batches missing for each ngram
+        """
+        query, starts = self.prepare_delta_query(since)
 
-        index = pd.MultiIndex.from_product([data.keys(), word_list], names=['time', 'ngram'])
-        tl_df = pd.DataFrame(index=index)
-        df = tl_df.join(df).reset_index()
+        if query is None:
+            return self.ngrams_array_frame([], pd.DatetimeIndex([]), [], columns)
 
-        return df
+        pipeline = self.prepare_merge_pipeline(query, self.fields(columns), ["time", "word"])
+        build = partial(self.ngrams_array_frame, index=None, word_list=list(starts), columns=columns)
+        df = self.execute(pipeline, build, raw=True)
+
+        # every batch from the oldest one missing to the last one landed (possibly after `last_updated` was cached)
+        end = max(self.last_updated, df['time'].max()) if not df.empty else self.last_updated
+        index = self.time_index({"time": {"$gte": min(starts.values()), "$lte": end}})
+        df = df.set_index(['time', 'ngram'])
+        df = df.reindex(pd.MultiIndex.from_product([index, list(starts)], names=['time', 'ngram'])).reset_index()
+
+        # drop batches before the first missing one of each ngram
+        missing = df['time'] >= pd.to_datetime(df['ngram'].map(starts))
+        return df[missing].reset_index(drop=True)
 
     def query_batch(self,
                     dtime: datetime,
                     max_rank: Optional[int] = None,
                     min_count: Optional[int] = None,
-                    rt: bool = True) -> pd.DataFrame:
+                    rt: bool = True,
+                    columns: Optional[list] = None) -> pd.DataFrame:
         """Query database for all ngrams in a single day
 
         Args:
@@ -220,24 +415,108 @@ class RealtimeQuery:
             max_rank: Max rank cutoff
             min_count: min count cutoff
             rt: a toggle to apply the filters above on ATs or OTs (w/out RTs)
+            columns: columns to return (default: all columns)
 
         Returns:
             dataframe of ngrams
         """
         query = self.prepare_day_query(dtime, max_rank, min_count, rt)
+        fields = projection("word", *self.fields(columns, 'count' if rt else 'count_no_rt'))
+        return self.execute(query, partial(self.batch_frame, rt=rt, columns=columns), fields, raw=True)
+
+    def query_batches(self,
+                      start_time: datetime,
+                      end_time: datetime,
+                      max_rank: Optional[int] = None,
+                      min_count: Optional[int] = None,
+                      rt: bool = True,
+                      columns: Optional[list] = None,
+                      rollup: Optional[str] = None) -> pd.DataFrame:
+        """Query database for all ngrams of every batch in a time range, in a single query
 
-        df = pd.DataFrame(tqdm(
-            self.run_query(query),
-            desc="Retrieving ngrams",
-            unit=""
-        )).rename(columns={"word": "ngram"})
+        Args:
+            start_time: first batch
+            end_time: last batch
+            max_rank: Max rank cutoff
+            min_count: min count cutoff
+            rt: a toggle to apply the filters above on ATs or OTs (w/out RTs)
+            columns: columns to return (default: all columns)
+            rollup: merge batches into coarser periods (pandas offset alias, e.g. "h" or "D")
 
-        if not df.empty:
-            df.drop(columns=['_id', 'time'], inplace=True)
+        Returns:
+            dataframe of ngrams indexed by (time, ngram)
+        """
+        query = self.prepare_range_query(start_time, end_time, max_rank, min_count, rt)
+        fields = projection("word", "time", *self.batch_fields(rt, columns, bool(rollup)))
+        build = partial(self.batches_frame, rt=rt, columns=columns, rollup=rollup)
+        return self.execute(query, build, fields, raw=True)
+
+    def iter_batches(self,
+                     start_time: datetime,
+                     end_time: datetime,
+                     max_rank: Optional[int] = None,
+                     min_count: Optional[int] = None,
+                     rt: bool = True,
+                     columns: Optional[list] = None) -> Iterator[tuple]:
+        """Stream all ngrams of every batch in a time range, one batch at a time, from a single query
 
-            if rt:
-                df.sort_values(by='count', ascending=False, inplace=True)
-            else:
-                df.sort_values(by='count_no_rt', ascending=False, inplace=True)
+        Args:
+            start_time: first batch
+            end_time: last batch
+            max_rank: Max rank cutoff
+            min_count: min count cutoff
+            rt: a toggle to apply the filters above on ATs or OTs (w/out RTs)
+            columns: columns to return (default: all columns)
 
-        return df
+        Returns:
+            iterator over (time, dataframe of ngrams) pairs, in time order
+        """
+        query = self.prepare_range_query(start_time, end_time, max_rank, min_count, rt)
+        fields = self.batch_fields(rt, columns)
+        cursor = self.database.find_raw_batches(query, projection("word", "time", *fields), sort=[("time", ASCENDING)])
+
+        pending = None
+        for chunk in cursor:
+            batches, pending = self.complete_batches(chunk, pending, rt, columns)
+            yield from batches
+
+        yield from self.complete_batches(None, pending, rt, columns)[0]
+
+    def complete_batches(self,
+                         chunk: Optional[bytes],
+                         pending: Optional[pd.DataFrame],
+                         rt: bool = True,
+                         columns: Optional[list] = None) -> (list, Optional[pd.DataFrame]):
+        """Split a raw chunk of documents sorted by time into complete batches
+
+        Args:
+            chunk: raw database batch (None once the cursor is exhausted)
+            pending: rows of the last batch of the previous chunk, which may continue in this one
+            rt: sort each distribution by count (otherwise by count without RTs)
+            columns: columns to return (default: all columns)
+
+        Returns:
+            list of (time, dataframe of ngrams) pairs, and the rows still pending
+        """
+        sort_by = 'count' if rt else 'count_no_rt'
+
+        if chunk is not None:
+            df = self.batches_frame([chunk], rt=rt, columns=self.batch_fields(rt, columns))
+            if pending is not None:
+                df = pd.concat([pending, df])
+        else:
+            df = pending
+
+        if df is None or df.empty:
+            return [], None
+
+        times = df.index.get_level_values('time')
+        # every batch is complete once the cursor is exhausted
+        done = times < times[-1] if chunk is not None else times.notna()
+
+        batches = []
+        for t, batch in df[done].groupby(level='time', sort=False):
+            batch = batch.droplevel('time').sort_values(by=sort_by, ascending=False, kind='stable')
+            batches.append((t.to_pydatetime(), batch[self.fields(columns)]))
+
+        return batches, df[~done]
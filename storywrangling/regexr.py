@@ -1,9 +1,17 @@
-import warnings
-warnings.filterwarnings("ignore")
-
 import html
 import re
 from collections import Counter
+from functools import lru_cache
+from typing import Iterable, NamedTuple, Optional
+
+# patterns compiled once, instead of on every call
+WHITESPACES = re.compile(r"\s\s+")
+NEWLINES = re.compile(r"\n|\t")
+INVISIBLES = re.compile(u"\u20e3|\ufe0f|\u2800|\u200b|\u200c|\u200d|<200b>|<200c>|<200d>")
+EDGE_CASES = re.compile(r"(([\-\.]{2,})|(\'\'))")
+
+# max number of strings whose 1-grams are memoized (see `tokens`)
+TOKENS_CACHE_SIZE = 2 ** 17
 
 
 def html2unicode(code):
@@ -25,11 +33,9 @@ def remove_whitespaces(text):
 
     Returns: cleaned text
     """
-    text = re.sub(r"\s\s+", " ", text)
-    text = re.sub(r"\n|\t", " ", text)
-    text = re.sub(
-        u"\u20e3|\ufe0f|\u2800|\u200b|\u200c|\u200d|<200b>|<200c>|<200d>", "", text
-    )
+    text = WHITESPACES.sub(" ", text)
+    text = NEWLINES.sub(" ", text)
+    text = INVISIBLES.sub("", text)
     text = text.strip()
     return html2unicode(text)
 
@@ -43,7 +49,8 @@ def ngram_parser(text, ngram_parser):
     Returns: a list of 1-grams
     """
     # take care of a few edge cases
-    text = re.sub(r"(([\-\.]{2,})|(\'\'))", r" \1 ", text)
+    if "-" in text or "." in text or "''" in text:
+        text = EDGE_CASES.sub(r" \1 ", text)
     return [x[0] for x in ngram_parser.findall(text) if x[0] != ""]
 
 
@@ -56,10 +63,97 @@ def nparser(s, parser, n=1):
 
     Returns: a Counter object of n-grams
     """
-    tokens = ngram_parser(s, parser)
+    return ngram_counts(tokens(s, parser), n)
+
+
+def tokens(s, parser):
+    """ 1-grams of a string, memoized for the last `TOKENS_CACHE_SIZE` (string, parser) pairs
+    Args:
+        s: a string object
+        parser: a compiled regex expression to extract one-grams
+
+    Returns: a tuple of 1-grams
+    """
+    # keyed by the source of the parser: hashing a compiled pattern hashes its whole program
+    return pattern_tokens(s, parser.pattern, parser.flags)
+
+
+@lru_cache(maxsize=TOKENS_CACHE_SIZE)
+def pattern_tokens(s, pattern, flags):
+    """ Memoized 1-grams of a string (see `tokens`) """
+    return tuple(ngram_parser(s, re.compile(pattern, flags)))
 
+
+def ngram_counts(tokens, n=1):
+    """ Count the ngrams of a sequence of 1-grams
+    Args:
+        tokens: a sequence of 1-grams
+        n: the degree of the ngrams
+
+    Returns: a Counter object of n-grams (None if there are no 1-grams)
+    """
     if len(tokens) == 0:
         return None
     else:
         ngrams = zip(*[tokens[i:] for i in range(n)])
         return Counter([" ".join(ngram) for ngram in ngrams])
+
+
+class Tokens(NamedTuple):
+    """ Ngram counts of a string, and its ngram order """
+    counts: Optional[Counter]
+    order: int
+
+
+def ngram_order(s, parser):
+    """ Ngram order of a string (number of distinct 1-grams, 0 if there are none)
+    Args:
+        s: a string object
+        parser: a compiled regex expression to extract one-grams
+
+    Returns: the degree of the ngram
+    """
+    return len(set(tokens(s, parser)))
+
+
+def ngram_orders(strings: Iterable[str], parser) -> list:
+    """ Ngram order of each string (number of distinct 1-grams, 0 if there are none)
+    Args:
+        strings: string objects
+        parser: a compiled regex expression to extract one-grams
+
+    Returns: a list of ngram orders, in the order of `strings`
+    """
+    return [ngram_order(s, parser) for s in strings]
+
+
+def group_orders(strings: list, parser) -> dict:
+    """ Group strings by ngram order
+    Args:
+        strings: string objects
+        parser: a compiled regex expression to extract one-grams
+
+    Returns: a dict of distinct strings (in order of first appearance) keyed by ngram order
+    """
+    groups = {}
+    for s, n in zip(strings, ngram_orders(strings, parser)):
+        groups.setdefault(n, {})[s] = None
+
+    return {n: list(group) for n, group in groups.items()}
+
+
+def tokenize(strings: Iterable[str], parser, n=1) -> list:
+    """ Batch version of `nparser`, also returning the ngram order of each string
+    Args:
+        strings: string objects
+        parser: a compiled regex expression to extract one-grams
+        n: the degree of the ngrams to count
+
+    Returns: a list of Tokens (counts, order), in the order of `strings`
+    """
+    batch = []
+    for s in strings:
+        t = tokens(s, parser)
+        batch.append(Tokens(ngram_counts(t, n), len(set(t))))
+
+    return batch
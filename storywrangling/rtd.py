@@ -0,0 +1,192 @@
+"""Rank-turbulence divergence (RTD) between two Zipf distributions
+
+Local counterpart of the precomputed `rd_{n}grams` collections,
+for any pair of days, periods, or languages
+(see Dodds et al., "Allotaxonometry and rank-turbulence divergence", https://arxiv.org/abs/2002.09770).
+
+Given ranks r1 and r2 of an ngram in both distributions, its contribution to the divergence is
+
+    (alpha + 1) / alpha * |r1^-alpha - r2^-alpha| ^ (1 / (alpha + 1))
+
+Ngrams missing from a distribution share the tied rank after its last ngram,
+and normalized contributions add up to 1 when both distributions are disjoint.
+"""
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# output columns (same as `Query.div_cols`), and the counts they are computed from
+div_columns = [
+    "rd_contribution",
+    "rd_contribution_no_rt",
+    "normed_rd",
+    "normed_rd_no_rt",
+    "rank_change",
+    "rank_change_no_rt",
+    "rank_1",
+    "rank_1_no_rt",
+    "rank_2",
+    "rank_2_no_rt",
+    "time_1",
+    "time_2"
+]
+count_columns = {"": "count", "_no_rt": "count_no_rt"}
+
+
+def tied_ranks(values: np.ndarray) -> np.ndarray:
+    """Ranks of values in decreasing order, ties sharing their average rank"""
+    order = np.argsort(-values)
+    ordered = values[order]
+
+    starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+    ends = np.r_[starts[1:], len(values)]
+
+    ranks = np.empty(len(values), dtype=np.float64)
+    ranks[order] = np.repeat((starts + ends + 1) / 2, ends - starts)
+    return ranks
+
+
+def contributions(r1: np.ndarray, r2: np.ndarray, alpha: float) -> np.ndarray:
+    """Unnormalized divergence contribution of each pair of ranks
+
+    Args:
+        r1: ranks in the first distribution
+        r2: ranks in the second distribution
+        alpha: rank-turbulence parameter (0 for log ratios of ranks, np.inf for the top rank only)
+
+    Returns:
+        contributions (same shape as the ranks)
+    """
+    if alpha == 0:
+        return np.abs(np.log(r1) - np.log(r2))
+
+    if np.isinf(alpha):
+        return np.where(r1 == r2, 0., np.maximum(1 / r1, 1 / r2))
+
+    return (alpha + 1) / alpha * np.abs(r1 ** -alpha - r2 ** -alpha) ** (1 / (alpha + 1))
+
+
+def ngram_counts(zipf: pd.DataFrame) -> (pd.Index, dict):
+    """Ngrams of a Zipf distribution, and their counts keyed by column (missing counts are zeros)"""
+    ngrams = pd.Index(zipf['ngram']) if 'ngram' in zipf.columns else zipf.index
+    values = {
+        c: np.nan_to_num(zipf[c].to_numpy(dtype=np.float64, na_value=np.nan))
+        for c in count_columns.values() if c in zipf.columns
+    }
+    return ngrams, values
+
+
+def merge_distributions(frames: list) -> pd.DataFrame:
+    """Add up the counts of several Zipf distributions (e.g. the days of a week)
+
+    Args:
+        frames: Zipf distributions (see `Storywrangler.get_zipf_dist`)
+
+    Returns:
+        dataframe of counts indexed by ngram
+    """
+    frames = [f.set_index('ngram') if 'ngram' in f.columns else f for f in frames]
+    cols = [c for c in count_columns.values() if all(c in f.columns for f in frames)]
+    return pd.concat([f[cols] for f in frames]).groupby(level=0, sort=False).sum()
+
+
+def divergence(c1: np.ndarray, c2: np.ndarray, alpha: float, suffix: str, index: pd.Index) -> pd.DataFrame:
+    """Divergence columns of a pair of aligned count arrays (0 for ngrams missing from a distribution)
+
+    Args:
+        c1: counts in the first distribution
+        c2: counts in the second distribution
+        alpha: rank-turbulence parameter
+        suffix: suffix of the output columns (e.g. "_no_rt")
+        index: ngrams of both arrays
+
+    Returns:
+        dataframe of contributions, normalized contributions, rank changes, and ranks
+    """
+    present_1, present_2 = c1 > 0, c2 > 0
+    used = present_1 | present_2
+    n1, n2 = present_1.sum(), present_2.sum()
+
+    # ngrams missing from a distribution share the average of the ranks after its last ngram
+    r1 = np.full(len(c1), np.nan)
+    r2 = np.full(len(c2), np.nan)
+    r1[present_1] = tied_ranks(c1[present_1])
+    r2[present_2] = tied_ranks(c2[present_2])
+    r1[used & ~present_1] = n1 + ((used & ~present_1).sum() + 1) / 2
+    r2[used & ~present_2] = n2 + ((used & ~present_2).sum() + 1) / 2
+
+    delta = contributions(r1, r2, alpha)
+
+    # divergence of two disjoint distributions of the same sizes
+    norm = contributions(r1[present_1], n2 + (n1 + 1) / 2, alpha).sum() + \
+        contributions(n1 + (n2 + 1) / 2, r2[present_2], alpha).sum()
+
+    # position of each ngram by contribution, signed by the direction of its rank change
+    ranked = np.flatnonzero(used)
+    order = np.full(len(delta), np.nan)
+    order[ranked[np.argsort(-delta[ranked])]] = np.arange(1, len(ranked) + 1)
+    direction = np.where(r2 <= r1, 1., -1.)
+
+    return pd.DataFrame({
+        f"rd_contribution{suffix}": delta,
+        f"normed_rd{suffix}": delta / norm if norm > 0 else np.full(len(delta), np.nan),
+        f"rank_change{suffix}": direction * order,
+        f"rank_1{suffix}": r1,
+        f"rank_2{suffix}": r2,
+    }, index=index)
+
+
+def rank_turbulence_divergence(zipf_1: pd.DataFrame,
+                               zipf_2: pd.DataFrame,
+                               alpha: float = 1 / 4,
+                               time_1: Optional[datetime] = None,
+                               time_2: Optional[datetime] = None) -> pd.DataFrame:
+    """Rank-turbulence divergence contributions of every ngram between two Zipf distributions
+
+    Ranks are recomputed from counts (in all tweets, and without RTs if `count_no_rt` is given),
+    so distributions may be truncated, filtered, or merged beforehand.
+
+    Args:
+        zipf_1: reference distribution, with ngrams as index (or an `ngram` column) and `count`/`count_no_rt` columns
+        zipf_2: current distribution
+        alpha: rank-turbulence parameter (default: 1/4, like the `rd_{n}grams` collections)
+        time_1: reference date, reported in `time_1`
+        time_2: current date, reported in `time_2`
+
+    Returns:
+        dataframe of ngrams (same columns as `Storywrangler.get_divergence`), sorted by their contributions
+    """
+    if alpha < 0:
+        raise ValueError(f"alpha should be non-negative, got {alpha}")
+
+    ngrams_1, counts_1 = ngram_counts(zipf_1)
+    ngrams_2, counts_2 = ngram_counts(zipf_2)
+
+    # a single pass over both vocabularies, also adding up duplicates (e.g. case variants of realtime batches)
+    codes, ngrams = ngrams_1.append(ngrams_2).factorize()
+    codes_1, codes_2 = codes[:len(ngrams_1)], codes[len(ngrams_1):]
+    index = pd.Index(ngrams, name='ngram')
+    frames = []
+
+    for suffix, count in count_columns.items():
+        if count in counts_1 and count in counts_2:
+            c1 = np.bincount(codes_1, weights=counts_1[count], minlength=len(index))
+            c2 = np.bincount(codes_2, weights=counts_2[count], minlength=len(index))
+        else:
+            c1 = c2 = np.zeros(len(index))
+
+        frames.append(divergence(c1, c2, alpha, suffix, index))
+
+    df = pd.concat(frames, axis=1)
+    df["time_1"] = pd.Timestamp(time_1) if time_1 is not None else pd.NaT
+    df["time_2"] = pd.Timestamp(time_2) if time_2 is not None else pd.NaT
+
+    # sort by contribution, reusing the positions behind `rank_change` (ngrams missing from both come last)
+    order = np.abs(df['rank_change'].to_numpy())
+    used = ~np.isnan(order)
+    rows = np.empty(len(df), dtype=np.int64)
+    rows[order[used].astype(np.int64) - 1] = np.flatnonzero(used)
+    rows[used.sum():] = np.flatnonzero(~used)
+    return df.iloc[rows][div_columns]
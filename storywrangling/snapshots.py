@@ -0,0 +1,142 @@
+"""Immutable on-disk snapshots of daily Zipf distributions and rank divergences
+
+Prefetch a date range for offline use:
+
+    python -m storywrangling.snapshots ~/storywrangling/snapshots --lang en --ngrams 1grams \
+        --start 2020-01-01 --end 2020-01-31 [--divergence]
+"""
+import os
+import sys
+import logging
+import argparse
+import threading
+from pathlib import Path
+from typing import Optional, Union
+from datetime import datetime
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotStore:
+    """On-disk store of complete daily distributions (one file per collection and day)
+
+    Once a day is closed (i.e. a later day landed in the database), its distribution never changes,
+    so each one is fetched once and stored as an uncompressed Arrow IPC (Feather) file
+    under `<path>/<database>/<lang>/<date>.arrow`.
+    Files are memory-mapped on read, so numeric columns are handed to pandas without a copy.
+    """
+
+    suffix = '.arrow'
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        """
+        Args:
+            path: directory to store snapshots in (created if missing)
+        """
+        try:
+            from pyarrow import feather
+        except ImportError:
+            raise ImportError("The snapshot store requires pyarrow")
+
+        self.feather = feather
+        self.path = Path(path).expanduser()
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def file(self, database: str, lang: str, date: datetime) -> Path:
+        """Path of the snapshot of a day"""
+        return self.path / database / lang / f"{date.date().isoformat()}{self.suffix}"
+
+    def days(self, database: str, lang: str) -> set:
+        """Days stored for a collection"""
+        return {
+            datetime.strptime(f.stem, '%Y-%m-%d')
+            for f in (self.path / database / lang).glob(f"*{self.suffix}")
+        }
+
+    def load(self, database: str, lang: str, date: datetime) -> Optional[pd.DataFrame]:
+        """Read the snapshot of a day, if any
+
+        Args:
+            database: database of the collection (e.g. "1grams", "rd_1grams")
+            lang: language collection
+            date: target date
+
+        Returns:
+            dataframe indexed by ngram, or None if missing
+        """
+        f = self.file(database, lang, date)
+
+        try:
+            table = self.feather.read_table(f, memory_map=True)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable snapshot {f}: {e}")
+            try:
+                f.unlink()
+            except FileNotFoundError:
+                pass
+            return None
+
+        # one block per column, so columns without missing values map onto the file directly
+        return table.to_pandas(split_blocks=True)
+
+    def store(self, database: str, lang: str, date: datetime, df: pd.DataFrame) -> None:
+        """Write the snapshot of a day
+
+        Args:
+            database: database of the collection
+            lang: language collection
+            date: target date
+            df: dataframe indexed by ngram
+        """
+        f = self.file(database, lang, date)
+        f.parent.mkdir(parents=True, exist_ok=True)
+
+        # write to a temporary file first, so readers never see a partial file
+        tmp = f.with_name(f"{f.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        self.feather.write_feather(df, tmp, compression='uncompressed')
+        os.replace(tmp, f)
+
+
+def day(value: str) -> datetime:
+    """Parse a YYYY-MM-DD date"""
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+def main():
+    from storywrangling import Storywrangler
+
+    parser = argparse.ArgumentParser(description="Prefetch daily Zipf distributions (or divergences) to disk")
+    parser.add_argument("path", help="snapshot directory")
+    parser.add_argument("--lang", default="en", help="target language (iso code)")
+    parser.add_argument("--ngrams", default="1grams", help="target ngram collection")
+    parser.add_argument("--start", type=day, required=True, help="first day (YYYY-MM-DD)")
+    parser.add_argument("--end", type=day, required=True, help="last day (YYYY-MM-DD)")
+    parser.add_argument("--divergence", action="store_true", help="prefetch rank divergences instead")
+    parser.add_argument("--database", default="ALL", help="desired database to query")
+    parser.add_argument("--workers", type=int, default=4, help="number of days to fetch concurrently")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        stream=sys.stdout,
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    with Storywrangler(args.database, max_workers=args.workers, snapshot_dir=args.path) as storywrangler:
+        days = storywrangler.prefetch_snapshots(
+            args.start,
+            args.end,
+            lang=args.lang,
+            ngrams=args.ngrams,
+            divergence=args.divergence,
+        )
+
+    logger.info(f"Stored {len(days)} new snapshots in {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,66 +1,254 @@
-import warnings
+import re
+import logging
+import contextvars
+import pandas as pd
+from typing import Any, Callable, Iterator, Optional, Union
+from datetime import datetime, timedelta
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pymongo import MongoClient
+
+from storywrangling.query import Query, numpy_dtypes
+from storywrangling.cache import TimeseriesCache, ResultCache
+from storywrangling.compact import compacting
+from storywrangling.snapshots import SnapshotStore
+from storywrangling.connection import registry
+from storywrangling.loaders import load_parser, load_languages
+from storywrangling.progress import ProgressHook, progress_hook, track
+from storywrangling.regexr import nparser, ngram_order, ngram_orders, group_orders
+from storywrangling.rtd import rank_turbulence_divergence, merge_distributions
 
-warnings.filterwarnings("ignore")
+logger = logging.getLogger(__name__)
 
-import sys
-from pathlib import Path
-import re
 
-file = Path(__file__).resolve()
-parent, root = file.parent, file.parents[1]
-sys.path.append(str(root))
+class StorywranglerBase:
+    """Helpers shared by the Storywrangler and AsyncStorywrangler APIs, which do not touch the database"""
 
-try:
-    sys.path.remove(str(parent))
-except ValueError:
-    pass
+    def __init__(self,
+                 database: str = 'ALL',
+                 max_pool_size: int = 100,
+                 max_idle_time_ms: Optional[int] = 60000,
+                 compact: bool = False,
+                 progress: Union[bool, Callable, ProgressHook, None] = True) -> None:
+        self.database = database
+        self.max_pool_size = max_pool_size
+        self.max_idle_time_ms = max_idle_time_ms
+        self.compact = compact
+        self.progress = progress_hook(progress)
+
+    @property
+    def parser(self):
+        """Ngram tokenizer, loaded once per process on first use"""
+        return load_parser()
+
+    @property
+    def ngrams_languages(self) -> dict:
+        """Languages with ngram collections, loaded once per process on first use"""
+        return load_languages('ngrams')
+
+    @property
+    def indexed_languages(self) -> dict:
+        """Languages whose collections are indexed by ngram, for each order, loaded once per process on first use"""
+        return load_languages('indexed')
+
+    @property
+    def supported_languages(self) -> dict:
+        """Languages with usage timeseries, loaded once per process on first use"""
+        return load_languages('supported')
 
-try:
-    import importlib.resources as pkg_resources
-except ImportError:
-    import importlib_resources as pkg_resources
+    def check_if_indexed(self, language: str, n: int) -> int:
+        """Returns the requested number, if supported, or 1, if requested is not supported
+        Args:
+            language: target language (iso code)
+            n: number of ngrams requested
 
-import logging
-import ujson
-import pickle
-import pandas as pd
-from tqdm import tqdm
-from typing import Optional
-from datetime import datetime
-
-import resources
-from storywrangling.query import Query
-from storywrangling.regexr import nparser
-
-logging.basicConfig(
-    stream=sys.stdout,
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+        Returns:
+            number of ngrams to search, based on what is indexed
+        """
+        if language in self.indexed_languages[str(n) + 'grams']:
+            logger.info(f"{language} {n}grams are indexed")
+            return n
+        else:
+            logger.info(f"{language} {n}grams are not indexed yet")
+            return 1
 
+    def group_array(self, ngrams_list: list, lang: str) -> dict:
+        """Partition an array of ngrams by target database collection,
+        leaving out strings without any ngram
 
-class Storywrangler:
+        Ngrams whose order is not indexed for the language still query their own collection
+        (without the word index, so the query is slower).
 
-    def __init__(self, database: str = 'ALL') -> None:
-        """Python API to access the Storywrangler database
         Args:
-            database: desired database to query,
-            please refer to README.rst to see all available options (default: ALL)
+            ngrams_list: list of ngrams
+            lang: target language (iso code)
+
+        Returns:
+            a dictionary of unique ngrams for each ngrams collection (e.g. "2grams")
         """
-        self.database = database
+        groups = {}
+        for n, words in group_orders(ngrams_list, self.parser).items():
+            if n == 0:
+                logger.warning(f"No ngram found in {words}: skipping")
+                continue
 
-        with pkg_resources.open_binary(resources, 'ngrams.bin') as f:
-            self.parser = pickle.load(f)
+            if f"{n}grams" not in self.indexed_languages or self.check_if_indexed(lang, n) != n:
+                logger.warning(f"{n}grams not indexed for {lang}: searching {len(words)} ngrams without an index")
+
+            groups[f"{n}grams"] = words
+
+        return groups
+
+    def group_tuples(self, ngrams_list: [(str, str)]) -> (dict, list):
+        """Group (ngram, lang) tuples by target database collection
+
+        Args:
+            ngrams_list: list of tuples (ngram, lang)
+
+        Returns:
+            a dictionary of unique ngrams for each (ngrams collection, lang) pair,
+            and the collection of each tuple
+        """
+        groups, keys = {}, []
+        orders = ngram_orders([w for w, _ in ngrams_list], self.parser)
 
-        with pkg_resources.open_binary(resources, 'ngrams_languages.json') as f:
-            self.ngrams_languages = ujson.load(f)
+        for (w, lang), n in zip(ngrams_list, orders):
+            key = (f"{n}grams", lang)
+            groups.setdefault(key, {})[w] = None
+            keys.append(key)
 
-        with pkg_resources.open_binary(resources, 'indexed_languages.json') as f:
-            self.indexed_languages = ujson.load(f)
+        return {k: list(words) for k, words in groups.items()}, keys
 
-        with pkg_resources.open_binary(resources, 'supported_languages.json') as f:
-            self.supported_languages = ujson.load(f)
+    def stitch_tuples(self, ngrams_list: [(str, str)], keys: list, frames: dict) -> pd.DataFrame:
+        """Concatenate the timeseries of each (ngram, lang) tuple into a single dataframe
+
+        Args:
+            ngrams_list: list of tuples (ngram, lang)
+            keys: collection of each tuple (see `group_tuples`)
+            frames: dictionary of timeseries (one per ngram) for each collection
+
+        Returns:
+            dataframe of ngrams usage over time
+        """
+        ngrams = []
+        for (w, lang), key in zip(ngrams_list, keys):
+            df = frames[key][w].copy()
+            df["ngram"] = w
+            df["lang"] = self.ngrams_languages.get(lang) \
+                if self.ngrams_languages.get(lang) is not None else "All"
+
+            df.index.name = 'time'
+            df.index = pd.to_datetime(df.index)
+            df.set_index([df.index, 'ngram', 'lang'], inplace=True)
+            ngrams.append(df)
+
+        return pd.concat(ngrams)
+
+    @staticmethod
+    def period_days(period) -> (list, datetime):
+        """Days of a date, or of a (start, end) period, and its last day"""
+        start, end = period if isinstance(period, tuple) else (period, period)
+        return list(pd.date_range(start, end, freq='D').to_pydatetime()), end
+
+    @staticmethod
+    def merge_days(frames: list) -> Optional[pd.DataFrame]:
+        """Counts of the Zipf distributions of several days (None if none of them has any ngram)"""
+        frames = [df for df in frames if df is not None and not df.empty]
+        return merge_distributions(frames) if frames else None
+
+    @staticmethod
+    def rank_divergence(q: Query,
+                        zipf_1: pd.DataFrame,
+                        zipf_2: pd.DataFrame,
+                        time_1: datetime,
+                        time_2: datetime,
+                        alpha: float = 1 / 4,
+                        max_rank: Optional[int] = None,
+                        top_n: Optional[int] = None,
+                        rt: bool = True,
+                        ngram_order: int = 1,
+                        ngram_filter: str = None,
+                        columns: Optional[list] = None) -> pd.DataFrame:
+        """Rank-turbulence divergence of two Zipf distributions, with the filters of `get_divergence`"""
+        df = rank_turbulence_divergence(zipf_1, zipf_2, alpha=alpha, time_1=time_1, time_2=time_2)
+        df = df[df['rd_contribution' if rt else 'rd_contribution_no_rt'].notna()]
+
+        return q.filter_divergence(
+            df,
+            max_rank=max_rank,
+            top_n=top_n,
+            rt=rt,
+            ngram_order=ngram_order,
+            ngram_filter=ngram_filter,
+            columns=columns,
+        )
+
+
+class Storywrangler(StorywranglerBase):
+
+    def __init__(self,
+                 database: str = 'ALL',
+                 max_pool_size: int = 100,
+                 max_idle_time_ms: Optional[int] = 60000,
+                 max_workers: int = 8,
+                 cache_dir: Optional[str] = None,
+                 cache_size: int = 2 * 1024 ** 3,
+                 result_cache_size: Optional[int] = None,
+                 result_cache_copy: bool = True,
+                 snapshot_dir: Optional[str] = None,
+                 backend: Optional[Any] = None,
+                 compact: bool = False,
+                 progress: Union[bool, Callable, ProgressHook, None] = True) -> None:
+        """Python API to access the Storywrangler database
+        Args:
+            database: desired database to query,
+            please refer to README.rst to see all available options (default: ALL)
+            max_pool_size: max number of concurrent connections to the database (default: 100)
+            max_idle_time_ms: close pooled connections idle for longer than this (default: 60000)
+            max_workers: max number of queries to run concurrently in batched methods (default: 8)
+            cache_dir: directory to cache ngram timeseries in (default: no cache)
+            cache_size: max size of the cache on disk in bytes (default: 2GB)
+            result_cache_size: max memory of the in-memory cache of results in bytes (default: no cache)
+            result_cache_copy: return deep copies of cached results,
+            otherwise copy-on-write views of them (default: True)
+            snapshot_dir: directory to store daily Zipf distributions and divergences in (default: no snapshots)
+            backend: client to query instead of the Storywrangler server,
+            e.g. a local replica (see `SQLiteBackend`; default: pooled MongoClient)
+            compact: return nullable int32 counts and ranks, float32 frequencies,
+            and categorical ngram/lang index levels, logging the bytes saved by each call (default: False)
+            progress: report the progress of queries and batched methods:
+            True for tqdm bars, None/False for none, a callback receiving (desc, done, total),
+            or a `ProgressHook` reporting every N updates (default: True)
+        """
+        super().__init__(database, max_pool_size, max_idle_time_ms, compact=compact, progress=progress)
+        self.max_workers = max_workers
+        self.cache = TimeseriesCache(cache_dir, max_bytes=cache_size) if cache_dir else None
+        self.result_cache = ResultCache(result_cache_size, copy=result_cache_copy) \
+            if result_cache_size else None
+        self.snapshots = SnapshotStore(snapshot_dir) if snapshot_dir else None
+        self.backend = backend
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @property
+    def client(self) -> MongoClient:
+        """Backend of this object, or the pooled client shared with every other API object using the same options"""
+        if self.backend is not None:
+            return self.backend
+
+        return registry.get_client(
+            owner=self,
+            max_pool_size=self.max_pool_size,
+            max_idle_time_ms=self.max_idle_time_ms,
+        )
+
+    def close(self) -> None:
+        """Release pooled connections borrowed by this object"""
+        registry.release(self)
 
     def select_database(self, ngrams: str = '1grams', lang: str = 'en'):
         """Create a custom Query based on the desired database and language collection
@@ -72,33 +260,197 @@ class Storywrangler:
             number of ngrams to search, based on what is indexed
         """
         if self.database == 'ALL':
-            return Query(ngrams, lang)
+            return Query(ngrams, lang, client=self.client, progress=self.progress)
         else:
-            return Query(f"{self.database}_{ngrams}", lang)
+            return Query(f"{self.database}_{ngrams}", lang, client=self.client, progress=self.progress)
+
+    def memoize(self, q: Query, method: str, args: tuple, fn: Callable[[], Any]) -> Any:
+        """Result of `fn`, from the in-memory result cache if enabled (see `ResultCache.memoize`)"""
+        if self.result_cache is None:
+            return fn()
+
+        return self.result_cache.memoize(q, method, args, fn)
+
+    def cached_timeseries(self, q: Query, words: list) -> dict:
+        """Full timeseries of ngrams from the on-disk cache,
+        fetching only the days after the last cached one (or everything for new ngrams)
 
-    def check_if_indexed(self, language: str, n: int) -> int:
-        """Returns the requested number, if supported, or 1, if requested is not supported
         Args:
-            language: target language (iso code)
-            n: number of ngrams requested
+            q: query on the collection of the ngrams
+            words: list of ngrams
 
         Returns:
-            number of ngrams to search, based on what is indexed
+            dictionary of dataframes with a DatetimeIndex (one per ngram, all columns, integer fields as Int64)
         """
-        if language in self.indexed_languages[str(n) + 'grams']:
-            logging.info(f"{language} {n}grams are indexed")
-            return n
+        database = q.database.database.name
+        frames, stale = {}, {}
+
+        for w in dict.fromkeys(words):
+            df = self.cache.load(database, q.lang, w)
+
+            if df is None or df.empty:
+                df = None
+                stale.setdefault(None, []).append(w)
+            elif df.index[-1] < q.last_updated:
+                start = (df.index[-1] + timedelta(days=1)).to_pydatetime()
+                stale.setdefault(start, []).append(w)
+
+            frames[w] = df
+
+        for start, stale_words in stale.items():
+            logger.info(f"Updating {len(stale_words)} cached timeseries from {start.date() if start else 'scratch'}")
+
+            # integer fields stay Int64 on missing days, so reads can restore their dtype (see `numpy_dtypes`)
+            for w, df in q.query_ngrams_timeseries(stale_words, start_time=start, nullable=True).items():
+                df.index = pd.to_datetime(df.index)
+                df.index.name = 'time'
+
+                if frames[w] is not None:
+                    df = pd.concat([frames[w], df])
+
+                self.cache.store(database, q.lang, w, df)
+                frames[w] = df
+
+        return frames
+
+    @staticmethod
+    def slice_timeseries(q: Query,
+                         df: pd.DataFrame,
+                         start_time: Optional[datetime] = None,
+                         end_time: Optional[datetime] = None,
+                         columns: Optional[list] = None) -> pd.DataFrame:
+        """Select a date range and columns of a cached timeseries (as returned by `Query.query_ngram`)"""
+        index = pd.to_datetime(pd.date_range(
+            start=(start_time if start_time else q.reference_date).date(),
+            end=(end_time if end_time else q.last_updated).date(),
+            freq="D",
+        ).date)
+        df = df.reindex(index)[q.ngram_fields(columns)[0]]
+        df.index.name = 'time'
+        return df
+
+    def query_timeseries(self,
+                         q: Query,
+                         words: list,
+                         start_time: Optional[datetime] = None,
+                         end_time: Optional[datetime] = None,
+                         columns: Optional[list] = None) -> dict:
+        """Timeseries of several ngrams, from the cache if enabled (see `Query.query_ngrams_timeseries`)"""
+        if self.cache is None:
+            return q.query_ngrams_timeseries(words, start_time=start_time, end_time=end_time, columns=columns)
+
+        frames = self.cached_timeseries(q, words)
+        return {w: numpy_dtypes(self.slice_timeseries(q, frames[w], start_time, end_time, columns)) for w in words}
+
+    def query_array(self,
+                    q: Query,
+                    words: list,
+                    start_time: Optional[datetime] = None,
+                    end_time: Optional[datetime] = None,
+                    columns: Optional[list] = None) -> pd.DataFrame:
+        """Array timeseries of several ngrams, from the cache if enabled (see `Query.query_ngrams_array`)"""
+        if self.cache is None:
+            df = q.query_ngrams_array(words, start_time=start_time, end_time=end_time, columns=columns)
+            df['time'] = pd.to_datetime(df['time'])
+            df.set_index(['time', 'ngram'], inplace=True)
+            return df
+
+        frames = self.cached_timeseries(q, words)
+        ngrams = []
+        for w in words:
+            df = self.slice_timeseries(q, frames[w], start_time, end_time)
+            # arrays only hold the days an ngram was used on (or a single empty row if it never was)
+            df = df[df.notna().any(axis=1)]
+            if df.empty:
+                df = df.reindex(pd.DatetimeIndex([pd.NaT], name='time'))
+
+            df = numpy_dtypes(df[q.ngram_fields(columns)[0]])
+            df.index = pd.to_datetime(df.index.to_pydatetime())
+            df.index.name = 'time'
+            df['ngram'] = w
+            ngrams.append(df.set_index('ngram', append=True))
+
+        return pd.concat(ngrams)
+
+    def day_snapshot(self, q: Query, date: datetime, fetch: Callable[[], pd.DataFrame]) -> Optional[pd.DataFrame]:
+        """Complete distribution of a closed day from the snapshot store, fetching and storing it if missing
+
+        Args:
+            q: query on the collection of the distribution
+            date: target date
+            fetch: function querying the complete distribution of the day
+
+        Returns:
+            dataframe indexed by ngram,
+            or None if snapshots are disabled or the day may still change
+        """
+        if self.snapshots is None or date is None or date >= q.last_updated:
+            return None
+
+        database = q.database.database.name
+        df = self.snapshots.load(database, q.lang, date)
+
+        if df is None:
+            df = fetch()
+            if not df.empty:
+                self.snapshots.store(database, q.lang, date, df)
+
+        return df
+
+    def prefetch_snapshots(self,
+                           start_time: datetime,
+                           end_time: datetime,
+                           lang: str = 'en',
+                           ngrams: str = '1grams',
+                           divergence: bool = False) -> list:
+        """Store the complete distribution of every closed day in a date range that is not stored yet,
+        running up to `max_workers` days concurrently
+
+        Args:
+            start_time: starting date
+            end_time: ending date
+            lang: target language (iso code)
+            ngrams: target ngram collection ("1grams", "2grams", "3grams")
+            divergence: store rank divergences instead of Zipf distributions
+
+        Returns:
+            list of days stored
+        """
+        if self.snapshots is None:
+            logger.warning("Prefetching requires a snapshot directory")
+            return []
+
+        if divergence:
+            q = Query(f"rd_{ngrams}", lang, client=self.client, progress=self.progress)
+            fetch = q.query_divergence
         else:
-            logging.info(f"{language} {n}grams are not indexed yet")
-            return 1
+            q = self.select_database(ngrams, lang)
+            fetch = q.query_day
+
+        stored = self.snapshots.days(q.database.database.name, lang)
+        days = [
+            d.to_pydatetime()
+            for d in pd.date_range(max(start_time, q.reference_date), min(end_time, q.last_updated), freq='D')
+            if d < q.last_updated and d.to_pydatetime() not in stored
+        ]
+
+        with track(self.progress, 'Prefetching', len(days), unit="day") as pbar, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for _ in pool.map(lambda d: self.day_snapshot(q, d, partial(fetch, d)), days):
+                if pbar is not None:
+                    pbar.update()
 
+        return days
+
+    @compacting
     def get_rank(
             self,
             rank: int,
             lang: str = 'en',
             ngram: str = '1grams',
             start_time: Optional[datetime] = None,
-            end_time: Optional[datetime] = None
+            end_time: Optional[datetime] = None,
+            columns: Optional[list] = None
     ) -> pd.DataFrame:
 
         """Query database for a rank timeseries
@@ -109,28 +461,35 @@ class Storywrangler:
             ngram: target database
             start_time: starting date for the query
             end_time: ending date for the query
+            columns: columns to return (default: all columns)
 
         Returns:
             dataframe of ngrams usage over time
         """
         if self.supported_languages.get(lang) is not None:
-            logging.info(f"Retrieving {self.supported_languages.get(lang)} {ngram}: Rank [{rank}]")
+            logger.info(f"Retrieving {self.supported_languages.get(lang)} {ngram}: Rank [{rank}]")
 
             q = self.select_database(ngram, lang)
-            df = q.query_rank(rank, start_time=start_time, end_time=end_time)
-            df.index.name = 'time'
-            df.index = pd.to_datetime(df.index)
-            return df
+
+            def query() -> pd.DataFrame:
+                df = q.query_rank(rank, start_time=start_time, end_time=end_time, columns=columns)
+                df.index.name = 'time'
+                df.index = pd.to_datetime(df.index)
+                return df
+
+            return self.memoize(q, 'get_rank', (rank, start_time, end_time, columns), query)
 
         else:
             logger.warning(f"Unsupported language: {lang}")
 
+    @compacting
     def get_ngram(self,
                   ngram: str,
                   lang: str = 'en',
                   start_time: Optional[datetime] = None,
                   end_time: Optional[datetime] = None,
-                  only_indexed: bool = False) -> pd.DataFrame:
+                  only_indexed: bool = False,
+                  columns: Optional[list] = None) -> pd.DataFrame:
         """Query database for an ngram timeseries
 
         Args:
@@ -139,12 +498,13 @@ class Storywrangler:
             start_time: starting date for the query
             end_time: ending date for the query
             only_indexed: only search ngrams that are indexed in the database
+            columns: columns to return (default: all columns)
 
         Returns:
             dataframe of ngrams usage over time
         """
 
-        n = len(nparser(ngram, parser=self.parser, n=1))
+        n = ngram_order(ngram, self.parser)
 
         if self.check_if_indexed(lang, n) != n:
 
@@ -156,14 +516,12 @@ class Storywrangler:
                 if self.ngrams_languages.get(lang) is not None:
                     ngrams = list(nparser(ngram, parser=self.parser, n=1).keys())
 
-                    df = q.query_ngrams_array(
-                        ngrams,
-                        start_time=start_time,
-                        end_time=end_time,
+                    return self.memoize(
+                        q,
+                        'get_ngram',
+                        (ngrams, start_time, end_time, columns),
+                        partial(self.query_array, q, ngrams, start_time, end_time, columns),
                     )
-                    df['time'] = pd.to_datetime(df['time'])
-                    df.set_index(['time', 'ngram'], inplace=True)
-                    return df
                 else:
                     logger.warning(f"Unsupported language: {lang}")
 
@@ -171,97 +529,125 @@ class Storywrangler:
             q = self.select_database(f"{n}grams", lang)
 
             if self.ngrams_languages.get(lang) is not None:
-                logging.info(f"Retrieving {self.ngrams_languages.get(lang)}: {n}gram -- '{ngram}'")
-
-                df = q.query_ngram(
-                    ngram,
-                    start_time=start_time,
-                    end_time=end_time,
-                )
+                logger.info(f"Retrieving {self.ngrams_languages.get(lang)}: {n}gram -- '{ngram}'")
+
+                def query() -> pd.DataFrame:
+                    if self.cache is None:
+                        df = q.query_ngram(
+                            ngram,
+                            start_time=start_time,
+                            end_time=end_time,
+                            columns=columns,
+                        )
+                    else:
+                        df = self.query_timeseries(q, [ngram], start_time, end_time, columns)[ngram]
+
+                    df.index.name = 'time'
+                    df.index = pd.to_datetime(df.index)
+                    return df
 
-                df.index.name = 'time'
-                df.index = pd.to_datetime(df.index)
-                return df
+                return self.memoize(q, 'get_ngram', (ngram, start_time, end_time, columns), query)
 
             else:
                 logger.warning(f"Unsupported language: {lang}")
 
+    @compacting
     def get_ngrams_array(self,
                          ngrams_list: list,
                          lang: str = 'en',
                          start_time: Optional[datetime] = None,
-                         end_time: Optional[datetime] = None) -> pd.DataFrame:
+                         end_time: Optional[datetime] = None,
+                         columns: Optional[list] = None) -> pd.DataFrame:
         """Query database for an array ngram timeseries
 
+        Ngrams may mix orders: they are partitioned by ngram order,
+        and each collection is queried once for all of its ngrams,
+        running up to `max_workers` collections concurrently.
+
         Args:
             ngrams_list: list of strings to query mongo
             lang: target language (iso code)
             start_time: starting date for the query
             end_time: ending date for the query
+            columns: columns to return (default: all columns)
 
         Returns:
             dataframe of ngrams usage over time
         """
-        n = len(nparser(ngrams_list[0], parser=self.parser, n=1))
-        q = self.select_database(f"{n}grams", lang)
-
         if self.ngrams_languages.get(lang) is not None:
-            logger.info(f"Retrieving: {len(ngrams_list)} {n}grams ...")
+            groups = self.group_array(ngrams_list, lang)
+            if not groups:
+                return None
+
+            def query_group(ngrams: str, words: list) -> pd.DataFrame:
+                logger.info(f"Retrieving: {len(words)} {ngrams} ...")
+                q = self.select_database(ngrams, lang)
+                return self.memoize(
+                    q,
+                    'get_ngrams_array',
+                    (words, start_time, end_time, columns),
+                    partial(self.query_array, q, words, start_time, end_time, columns),
+                )
 
-            df = q.query_ngrams_array(
-                ngrams_list,
-                start_time=start_time,
-                end_time=end_time,
-            )
-            df['time'] = pd.to_datetime(df['time'])
-            df.set_index(['time', 'ngram'], inplace=True)
-            return df
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(groups))) as pool:
+                frames = list(pool.map(query_group, groups.keys(), groups.values()))
+
+            return frames[0] if len(frames) == 1 else pd.concat(frames)
 
         else:
             logger.warning(f"Unsupported language: {lang}")
 
+    @compacting
     def get_ngrams_tuples(self,
                           ngrams_list: [(str, str)],
                           start_time: Optional[datetime] = None,
-                          end_time: Optional[datetime] = None) -> pd.DataFrame:
+                          end_time: Optional[datetime] = None,
+                          columns: Optional[list] = None) -> pd.DataFrame:
         """Query database for an array ngram timeseries
 
+        Tuples are grouped by database collection (ngram order and language),
+        and each collection is queried once for all of its ngrams,
+        running up to `max_workers` collections concurrently.
+
         Args:
             ngrams_list: list of tuples (ngram, lang)
             start_time: starting date for the query
             end_time: ending date for the query
+            columns: columns to return (default: all columns)
 
         Returns:
             dataframe of ngrams usage over time
         """
+        groups, keys = self.group_tuples(ngrams_list)
 
-        ngrams = []
-        pbar = tqdm(ngrams_list, desc='Retrieving', leave=True, unit="")
-
-        for w, lang in pbar:
-            n = len(nparser(w, parser=self.parser, n=1))
-            pbar.set_description(f"Retrieving: ({self.ngrams_languages.get(lang)}) {w.rstrip()}")
-
-            q = self.select_database(f"{n}grams", lang)
-            df = q.query_ngram(
-                w,
-                start_time=start_time,
-                end_time=end_time,
+        def query_group(ngrams: str, lang: str, words: list) -> dict:
+            q = self.select_database(ngrams, lang)
+            return self.memoize(
+                q,
+                'get_ngrams_tuples',
+                (words, start_time, end_time, columns),
+                partial(self.query_timeseries, q, words, start_time, end_time, columns),
             )
 
-            df["ngram"] = w
-            df["lang"] = self.ngrams_languages.get(lang) \
-                if self.ngrams_languages.get(lang) is not None else "All"
+        frames = {}
+        with track(self.progress, 'Retrieving', len(groups)) as pbar, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {
+                pool.submit(query_group, ngrams, lang, words): (ngrams, lang)
+                for (ngrams, lang), words in groups.items()
+            }
 
-            df.index.name = 'time'
-            df.index = pd.to_datetime(df.index)
-            df.set_index([df.index, 'ngram', 'lang'], inplace=True)
-            ngrams.append(df)
-            pbar.refresh()
+            for future in as_completed(futures):
+                ngrams, lang = futures[future]
+                frames[(ngrams, lang)] = future.result()
+
+                if pbar is not None:
+                    pbar.set_description(f"Retrieving: ({self.ngrams_languages.get(lang)}) {ngrams}")
+                    pbar.update()
 
-        ngrams = pd.concat(ngrams)
-        return ngrams
+        return self.stitch_tuples(ngrams_list, keys, frames)
 
+    @compacting
     def get_lang(self,
                  lang: Optional[str] = None,
                  start_time: Optional[datetime] = None,
@@ -277,22 +663,26 @@ class Storywrangler:
             dataframe of language over time
         """
 
-        q = Query("languages", "languages")
+        q = Query("languages", "languages", client=self.client, progress=self.progress)
 
-        logging.info(f"Retrieving: {lang} -- {self.supported_languages.get(lang)}")
+        logger.info(f"Retrieving: {lang} -- {self.supported_languages.get(lang)}")
 
         if self.supported_languages.get(lang) is not None:
-            df = q.query_languages(
-                lang,
-                start_time,
-                end_time,
-            )
-            df.index = pd.to_datetime(df.index)
-            df.index.name = 'time'
-            return df
+            def query() -> pd.DataFrame:
+                df = q.query_languages(
+                    lang,
+                    start_time,
+                    end_time,
+                )
+                df.index = pd.to_datetime(df.index)
+                df.index.name = 'time'
+                return df
+
+            return self.memoize(q, 'get_lang', (lang, start_time, end_time), query)
         else:
             logger.warning(f"Unsupported language: {lang}")
 
+    @compacting
     def get_zipf_dist(self,
                       date: datetime,
                       lang: str = 'en',
@@ -301,7 +691,8 @@ class Storywrangler:
                       min_count: Optional[int] = None,
                       top_n: Optional[int] = None,
                       rt: bool = True,
-                      ngram_filter: str = None) -> pd.DataFrame:
+                      ngram_filter: str = None,
+                      columns: Optional[list] = None) -> pd.DataFrame:
         """Query database for ngram Zipf distribution for a given day
 
         Args:
@@ -315,6 +706,7 @@ class Storywrangler:
             ngram_filter: name of regex filter for ngrams
             ("handles", "hashtags", "handles_hashtags",
             "no_handles_hashtags", or "latin"; default is None)
+            columns: columns to return (default: all columns)
 
         Returns:
             dataframe of ngrams
@@ -326,21 +718,177 @@ class Storywrangler:
             logger.info(f"Retrieving {self.ngrams_languages.get(lang)} {ngrams} for {date.date()} ...")
 
             q = self.select_database(ngrams, lang)
-            df = q.query_day(
-                date,
+
+            def query() -> pd.DataFrame:
+                df = self.day_snapshot(q, date, partial(q.query_day, date))
+
+                if df is not None:
+                    df = q.filter_day(
+                        df,
+                        max_rank=max_rank,
+                        min_count=min_count,
+                        top_n=top_n,
+                        rt=rt,
+                        ngram_order=ngram_order,
+                        ngram_filter=ngram_filter,
+                        columns=columns,
+                    )
+                else:
+                    df = q.query_day(
+                        date,
+                        max_rank=max_rank,
+                        min_count=min_count,
+                        top_n=top_n,
+                        rt=rt,
+                        ngram_order=ngram_order,
+                        ngram_filter=ngram_filter,
+                        columns=columns,
+                    )
+
+                df.index.name = 'ngram'
+                return df
+
+            return self.memoize(
+                q,
+                'get_zipf_dist',
+                (date, max_rank, min_count, top_n, rt, ngram_filter, columns),
+                query,
+            )
+
+        else:
+            logger.warning(f"Unsupported language: {lang}")
+
+    @compacting
+    def get_zipf_dists(self,
+                       start_time: datetime,
+                       end_time: datetime,
+                       lang: str = 'en',
+                       ngrams: str = '1grams',
+                       max_rank: Optional[int] = None,
+                       min_count: Optional[int] = None,
+                       top_n: Optional[int] = None,
+                       rt: bool = True,
+                       ngram_filter: str = None,
+                       columns: Optional[list] = None,
+                       by_day: bool = False) -> Union[pd.DataFrame, dict]:
+        """Query database for ngram Zipf distributions of every day in a date range,
+        running up to `max_workers` days concurrently
+
+        Each day is fetched and decoded by `get_zipf_dist` (with the same filters, snapshots, and result cache),
+        so at most `max_workers` queries are in flight at once.
+
+        Args:
+            start_time: first day
+            end_time: last day
+            lang: target language (iso code)
+            ngrams: target ngram collection ("1grams", "2grams", "3grams")
+            max_rank: Max rank cutoff (default is None)
+            min_count: min count cutoff (default is None)
+            top_n: maximum number of ngrams to return per day (default is None)
+            rt: a toggle to apply the filters above on ATs or OTs (w/out RTs)
+            ngram_filter: name of regex filter for ngrams
+            ("handles", "hashtags", "handles_hashtags",
+            "no_handles_hashtags", or "latin"; default is None)
+            columns: columns to return (default: all columns)
+            by_day: return a dict of dataframes keyed by day instead of a single dataframe
+
+        Returns:
+            dataframe of ngrams indexed by (time, ngram), or dict of dataframes of ngrams keyed by day
+        """
+
+        if self.ngrams_languages.get(lang) is not None:
+            logger.info(
+                f"Retrieving {self.ngrams_languages.get(lang)} {ngrams} from {start_time.date()} to {end_time.date()} ..."
+            )
+
+            days = list(pd.date_range(start_time, end_time, freq='D').to_pydatetime())
+            if not days:
+                logger.warning(f"Empty date range: {start_time.date()} to {end_time.date()}")
+                return None
+
+            fetch = partial(
+                self.get_zipf_dist,
+                lang=lang,
+                ngrams=ngrams,
                 max_rank=max_rank,
                 min_count=min_count,
                 top_n=top_n,
                 rt=rt,
-                ngram_order=ngram_order,
-                ngram_filter=ngram_filter
+                ngram_filter=ngram_filter,
+                columns=columns,
             )
-            df.index.name = 'ngram'
-            return df
+
+            frames = {}
+            with track(self.progress, 'Retrieving', len(days), unit="day") as pbar, \
+                    ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                # run each day in a copy of the caller's context (see `compacting`)
+                futures = [pool.submit(contextvars.copy_context().run, fetch, d) for d in days]
+                for day, future in zip(days, futures):
+                    frames[day] = future.result()
+                    if pbar is not None:
+                        pbar.update()
+
+            if by_day:
+                return frames
+
+            return pd.concat(frames.values(), keys=pd.DatetimeIndex(days), names=['time', 'ngram'])
 
         else:
             logger.warning(f"Unsupported language: {lang}")
 
+    def iter_zipf_dist(self,
+                       date: datetime,
+                       lang: str = 'en',
+                       ngrams: str = '1grams',
+                       max_rank: Optional[int] = None,
+                       min_count: Optional[int] = None,
+                       rt: bool = True,
+                       ngram_filter: str = None,
+                       columns: Optional[list] = None,
+                       chunk_size: int = 100000) -> Iterator[pd.DataFrame]:
+        """Stream ngram Zipf distribution for a given day in chunks, as they arrive from the database
+
+        Chunks keep the columns of `get_zipf_dist`,
+        but come in database order rather than sorted by count.
+
+        Args:
+            date: target date
+            lang: target language (iso code)
+            ngrams: target ngram collection ("1grams", "2grams", "3grams")
+            max_rank: Max rank cutoff (default is None)
+            min_count: min count cutoff (default is None)
+            rt: a toggle to apply the filters above on ATs or OTs (w/out RTs)
+            ngram_filter: name of regex filter for ngrams
+            ("handles", "hashtags", "handles_hashtags",
+            "no_handles_hashtags", or "latin"; default is None)
+            columns: columns to return (default: all columns)
+            chunk_size: maximum number of ngrams per chunk (default is 100000)
+
+        Returns:
+            iterator over dataframes of ngrams
+        """
+
+        if self.ngrams_languages.get(lang) is not None:
+            logger.info(f"Streaming {self.ngrams_languages.get(lang)} {ngrams} for {date.date()} ...")
+
+            q = self.select_database(ngrams, lang)
+            for df in q.iter_day(
+                date,
+                max_rank=max_rank,
+                min_count=min_count,
+                rt=rt,
+                ngram_order=get_ngram_int(ngrams),
+                ngram_filter=ngram_filter,
+                columns=columns,
+                chunk_size=chunk_size,
+            ):
+                df.index.name = 'ngram'
+                yield df
+
+        else:
+            logger.warning(f"Unsupported language: {lang}")
+
+    @compacting
     def get_divergence(self,
                        date: datetime,
                        lang: str = 'en',
@@ -348,7 +896,8 @@ class Storywrangler:
                        max_rank: Optional[int] = None,
                        top_n: Optional[int] = None,
                        rt: bool = True,
-                       ngram_filter: str = None) -> pd.DataFrame:
+                       ngram_filter: str = None,
+                       columns: Optional[list] = None) -> pd.DataFrame:
         """Get a list of narratively trending ngrams for a given day
 
         Args:
@@ -361,6 +910,7 @@ class Storywrangler:
             ngram_filter: name of regex filter for ngrams
             ("handles", "hashtags", "handles_hashtags",
             "no_handles_hashtags", or "latin"; default is None)
+            columns: columns to return (default: all columns)
 
         Returns (pd.DataFrame):
             dataframe of ngrams
@@ -371,37 +921,200 @@ class Storywrangler:
                 f"Retrieving {self.supported_languages.get('en')} RTD {ngrams} for {date.date()} ..."
             )
 
-            q = Query(f"rd_{ngrams}", lang)
-            df = q.query_divergence(
-                date,
-                max_rank=max_rank,
-                rt=rt,
-                top_n=top_n,
-                ngram_filter=ngram_filter
+            q = Query(f"rd_{ngrams}", lang, client=self.client, progress=self.progress)
+
+            def query() -> pd.DataFrame:
+                df = self.day_snapshot(q, date, partial(q.query_divergence, date))
+
+                if df is not None:
+                    df = q.filter_divergence(
+                        df,
+                        max_rank=max_rank,
+                        top_n=top_n,
+                        rt=rt,
+                        ngram_filter=ngram_filter,
+                        columns=columns,
+                    )
+                else:
+                    df = q.query_divergence(
+                        date,
+                        max_rank=max_rank,
+                        rt=rt,
+                        top_n=top_n,
+                        ngram_filter=ngram_filter,
+                        columns=columns,
+                    )
+
+                df.index.name = 'ngram'
+                return df
+
+            return self.memoize(
+                q,
+                'get_divergence',
+                (date, max_rank, top_n, rt, ngram_filter, columns),
+                query,
             )
-            df.index.name = 'ngram'
-            return df
         else:
             logger.warning(f"Unsupported language: {lang}")
 
+    def period_distribution(self,
+                            period,
+                            lang: str = 'en',
+                            ngrams: str = '1grams') -> (Optional[pd.DataFrame], datetime):
+        """Counts of a Zipf distribution of a day, or of every day in a (start, end) period, and its last day"""
+        days, end = self.period_days(period)
+        frames = self.get_zipf_dists(days[0], end, lang=lang, ngrams=ngrams, columns=['count', 'count_no_rt'], by_day=True)
+        return self.merge_days(list(frames.values()) if frames else []), end
+
+    @compacting
+    def compute_divergence(self,
+                           first,
+                           second,
+                           lang: str = 'en',
+                           ngrams: str = '1grams',
+                           lang_2: Optional[str] = None,
+                           alpha: float = 1 / 4,
+                           max_rank: Optional[int] = None,
+                           top_n: Optional[int] = None,
+                           rt: bool = True,
+                           ngram_filter: str = None,
+                           columns: Optional[list] = None) -> pd.DataFrame:
+        """Compute rank-turbulence divergence between any two days (or periods) from their Zipf distributions
+
+        Unlike `get_divergence`, which reads contributions precomputed against the year before,
+        contributions are computed locally (see `storywrangling.rtd`) for any pair of days, periods, or languages.
+
+        Args:
+            first: reference date, or (start, end) dates of a reference period
+            second: current date, or (start, end) dates of a current period
+            lang: target language (iso code)
+            ngrams: target ngram collection ("1grams", "2grams", "3grams")
+            lang_2: language of the current distribution (default: same as `lang`)
+            alpha: rank-turbulence parameter (default: 1/4, like `get_divergence`)
+            max_rank: Max rank change cutoff (default is None)
+            top_n: maximum number of ngrams to return (default is None)
+            rt: a toggle to apply the filters above on ATs or OTs (w/out RTs)
+            ngram_filter: name of regex filter for ngrams
+            ("handles", "hashtags", "handles_hashtags",
+            "no_handles_hashtags", or "latin"; default is None)
+            columns: columns to return (default: all columns)
+
+        Returns:
+            dataframe of ngrams (same columns as `get_divergence`)
+        """
+        lang_2 = lang_2 if lang_2 is not None else lang
+
+        if self.ngrams_languages.get(lang) is not None and self.ngrams_languages.get(lang_2) is not None:
+            logger.info(f"Computing RTD {ngrams} between {lang} {first} and {lang_2} {second} ...")
+
+            zipf_1, time_1 = self.period_distribution(first, lang, ngrams)
+            zipf_2, time_2 = self.period_distribution(second, lang_2, ngrams)
+
+            if zipf_1 is not None and zipf_2 is not None:
+                return self.rank_divergence(
+                    self.select_database(ngrams, lang_2),
+                    zipf_1,
+                    zipf_2,
+                    time_1,
+                    time_2,
+                    alpha=alpha,
+                    max_rank=max_rank,
+                    top_n=top_n,
+                    rt=rt,
+                    ngram_order=get_ngram_int(ngrams),
+                    ngram_filter=ngram_filter,
+                    columns=columns,
+                )
 
+            else:
+                logger.warning(f"No Zipf distribution found for {first if zipf_1 is None else second}")
+        else:
+            logger.warning(f"Unsupported language: {lang if self.ngrams_languages.get(lang) is None else lang_2}")
+
+    @compacting
     def get_rd_timeseries(self,
                       dates: tuple,
                       lang: str = 'en',
                       ngrams: str = '1grams',
-                      rt: bool = True) -> pd.DataFrame:
+                      rt: bool = True,
+                      columns: Optional[list] = None) -> pd.DataFrame:
         if self.supported_languages.get(lang) is not None:
             logger.info(
                 f"Retrieving {self.supported_languages.get('en')} RTD {ngrams} from {dates[0].date()} to {dates[1].date()} ..."
             )
 
-            q = Query(f"rd_{ngrams}", lang)
-            df = q.query_rd_timeseries(
-                dates,
-                rt=rt,
+            q = Query(f"rd_{ngrams}", lang, client=self.client, progress=self.progress)
+
+            def query() -> pd.DataFrame:
+                df = q.query_rd_timeseries(
+                    dates,
+                    rt=rt,
+                    columns=columns,
+                )
+                df.index.name = 'ngram'
+                return df
+
+            return self.memoize(q, 'get_rd_timeseries', (dates, rt, columns), query)
+        else:
+            logger.warning(f"Unsupported language: {lang}")
+
+    @compacting
+    def get_divergences(self,
+                        start_time: datetime,
+                        end_time: datetime,
+                        lang: str = 'en',
+                        ngrams: str = '1grams',
+                        max_rank: Optional[int] = None,
+                        top_n: Optional[int] = None,
+                        rt: bool = True,
+                        ngram_filter: str = None,
+                        columns: Optional[list] = None) -> pd.DataFrame:
+        """Get the narratively trending ngrams of every day in a date range, in a single query
+
+        Unlike `get_rd_timeseries`, ngrams trending on several days keep one row per day.
+
+        Args:
+            start_time: first day
+            end_time: last day
+            lang: target language (iso code)
+            ngrams: target ngram collection ("1grams", "2grams")
+            max_rank: Max rank cutoff (default is None)
+            top_n: maximum number of ngrams to return per day (default is None)
+            rt: a toggle to apply the filters above on ATs or OTs (w/out RTs)
+            ngram_filter: name of regex filter for ngrams
+            ("handles", "hashtags", "handles_hashtags",
+            "no_handles_hashtags", or "latin"; default is None)
+            columns: columns to return (default: all columns)
+
+        Returns (pd.DataFrame):
+            dataframe of ngrams indexed by (time_2, ngram), sorted by day then contribution
+        """
+        if self.supported_languages.get(lang) is not None:
+            logger.info(
+                f"Retrieving {self.supported_languages.get('en')} RTD {ngrams} "
+                f"from {start_time.date()} to {end_time.date()} ..."
+            )
+
+            q = Query(f"rd_{ngrams}", lang, client=self.client, progress=self.progress)
+
+            def query() -> pd.DataFrame:
+                return q.query_divergences(
+                    start_time,
+                    end_time,
+                    max_rank=max_rank,
+                    top_n=top_n,
+                    rt=rt,
+                    ngram_order=get_ngram_int(ngrams),
+                    ngram_filter=ngram_filter,
+                    columns=columns,
+                )
+
+            return self.memoize(
+                q,
+                'get_divergences',
+                (start_time, end_time, max_rank, top_n, rt, ngram_filter, columns),
+                query,
             )
-            df.index.name = 'ngram'
-            return df
         else:
             logger.warning(f"Unsupported language: {lang}")
 
@@ -0,0 +1,120 @@
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import sys
+
+sys.path.append('./')
+
+import asyncio
+import logging
+import unittest
+import pandas as pd
+from datetime import datetime
+from storywrangling import Storywrangler, Realtime, AsyncStorywrangler, AsyncRealtime
+
+
+class AsyncTesting(unittest.TestCase):
+    def __init__(self, *args, **kwargs):
+        super(AsyncTesting, self).__init__(*args, **kwargs)
+
+        self.api = Storywrangler()
+
+        self.start = datetime(2010, 1, 1)
+        self.end = datetime(2020, 1, 1)
+
+        self.lang_example = "en"
+        self.ngram_example = "Black Lives Matter"
+        self.multilang_example = [
+            ('Christmas', 'en'),
+            ('Pasqua', 'it'),
+            ('eleição', 'pt'),
+            ('World Cup', 'en'),
+        ]
+        self.realtime_example = [
+            ('covid19', 'en'),
+            ('cuarentena', 'es'),
+        ]
+
+    def test_sync_entry_points(self):
+        with self.assertRaises(TypeError):
+            with AsyncStorywrangler():
+                pass
+
+        assert not isinstance(AsyncStorywrangler(), Storywrangler)
+        assert not isinstance(AsyncRealtime(), Realtime)
+
+        for method in ['query_timeseries', 'query_array', 'cached_timeseries', 'day_snapshot', 'prefetch_snapshots']:
+            assert not hasattr(AsyncStorywrangler(), method)
+
+        assert not hasattr(AsyncRealtime(), 'watch')
+
+        for option in ['backend', 'cache_dir', 'snapshot_dir', 'result_cache_size']:
+            with self.assertRaises(TypeError):
+                AsyncStorywrangler(**{option: None})
+
+        with self.assertRaises(TypeError):
+            AsyncRealtime(result_cache_size=None)
+
+    def test_get_ngram(self):
+        async def query():
+            async with AsyncStorywrangler() as api:
+                return await api.get_ngram(
+                    self.ngram_example,
+                    self.lang_example,
+                    start_time=self.start,
+                    end_time=self.end
+                )
+
+        df = asyncio.run(query())
+        expected_df = self.api.get_ngram(
+            self.ngram_example,
+            self.lang_example,
+            start_time=self.start,
+            end_time=self.end
+        )
+        logging.info(df)
+        pd.testing.assert_frame_equal(df, expected_df)
+
+    def test_get_ngrams_tuples(self):
+        async def query():
+            async with AsyncStorywrangler(max_concurrency=2) as api:
+                return await api.get_ngrams_tuples(
+                    self.multilang_example,
+                    start_time=self.start,
+                    end_time=self.end,
+                )
+
+        df = asyncio.run(query())
+        expected_df = self.api.get_ngrams_tuples(
+            self.multilang_example,
+            start_time=self.start,
+            end_time=self.end,
+        )
+        logging.info(df)
+        pd.testing.assert_frame_equal(df, expected_df)
+
+    def test_concurrent_zipf_dists(self):
+        async def query():
+            async with AsyncStorywrangler() as api:
+                return await asyncio.gather(*[
+                    api.get_zipf_dist(date=self.end, lang=lang, top_n=100)
+                    for lang in ['en', 'es', 'pt']
+                ])
+
+        for df in asyncio.run(query()):
+            logging.info(df)
+            assert not df.empty
+
+    def test_realtime_get_ngrams_tuples(self):
+        async def query():
+            async with AsyncRealtime() as api:
+                return await api.get_ngrams_tuples(self.realtime_example)
+
+        df = asyncio.run(query())
+        logging.info(df)
+        assert not df.empty
+
+
+if __name__ == '__main__':
+    unittest.main()
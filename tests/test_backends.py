@@ -0,0 +1,160 @@
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import sys
+
+sys.path.append('./')
+
+import logging
+import tempfile
+import unittest
+import pandas as pd
+from datetime import datetime
+from storywrangling import Storywrangler
+from storywrangling.backends import SQLiteBackend
+
+
+def ngram_doc(word: str, time: datetime, count: int, rank: int, freq: float) -> dict:
+    return {
+        "word": word,
+        "time": time,
+        "counts": count,
+        "count_noRT": count // 2,
+        "rank": rank,
+        "rank_noRT": rank,
+        "freq": freq,
+        "freq_noRT": freq / 2,
+    }
+
+
+def divergence_doc(ngram: str, time: datetime, contribution: float, rank_1: int, rank_2: int) -> dict:
+    return {
+        "ngram": ngram,
+        "time_1": time.replace(year=time.year - 1),
+        "time_2": time,
+        "rd_contribution": contribution,
+        "rd_contribution_noRT": contribution / 2,
+        "normed_rd": contribution,
+        "normed_rd_noRT": contribution / 2,
+        "rank_change": rank_1 - rank_2,
+        "rank_change_noRT": rank_1 - rank_2,
+        "rank_1": rank_1,
+        "rank_1_noRT": rank_1,
+        "rank_2": rank_2,
+        "rank_2_noRT": rank_2,
+    }
+
+
+class SQLiteBackendTesting(unittest.TestCase):
+    """Queries of a small local replica, without the Storywrangler server"""
+
+    def __init__(self, *args, **kwargs):
+        super(SQLiteBackendTesting, self).__init__(*args, **kwargs)
+
+        self.lang_example = "en"
+        self.days = [datetime(2020, 1, 1), datetime(2020, 1, 2), datetime(2020, 1, 3)]
+        self.ngrams_cols = [
+            "count",
+            "count_no_rt",
+            "rank",
+            "rank_no_rt",
+            "freq",
+            "freq_no_rt"
+        ]
+
+    def setUp(self):
+        self.replica_dir = tempfile.TemporaryDirectory()
+        self.backend = SQLiteBackend(self.replica_dir.name)
+        self.api = Storywrangler(backend=self.backend, progress=False)
+
+        d1, d2, d3 = self.days
+        self.backend['1grams'][self.lang_example].insert_many([
+            ngram_doc("hello", d1, 30, 1, 0.5),
+            ngram_doc("#tag", d1, 20, 2, 0.3),
+            ngram_doc("@user", d1, 10, 3, 0.2),
+            ngram_doc("hello", d2, 40, 1, 0.8),
+            ngram_doc("@user", d2, 10, 2, 0.2),
+            ngram_doc("#tag", d3, 50, 1, 0.9),
+            ngram_doc("hello", d3, 5, 2, 0.1),
+        ])
+        self.backend['rd_1grams'][self.lang_example].insert_many([
+            divergence_doc("hello", d1, 0.5, 3, 1),
+            divergence_doc("#tag", d1, 0.3, 1, 2),
+            divergence_doc("@user", d1, 0.2, 2, 3),
+            divergence_doc("hello", d2, 0.6, 2, 1),
+            divergence_doc("@user", d2, 0.4, 1, 2),
+        ])
+
+    def tearDown(self):
+        self.replica_dir.cleanup()
+
+    def expected_ngram(self, rows: list, days: list) -> pd.DataFrame:
+        return pd.DataFrame(rows, columns=self.ngrams_cols, index=pd.DatetimeIndex(days, name='time'))
+
+    def test_get_ngram(self):
+        df = self.api.get_ngram("hello", self.lang_example, start_time=self.days[0], end_time=self.days[-1])
+        logging.info(df)
+        expected_df = self.expected_ngram(
+            [[30, 15, 1, 1, 0.5, 0.25], [40, 20, 1, 1, 0.8, 0.4], [5, 2, 2, 2, 0.1, 0.05]],
+            self.days,
+        )
+        pd.testing.assert_frame_equal(df, expected_df, check_index_type=False)
+
+    def test_get_ngram_missing_days(self):
+        df = self.api.get_ngram("#tag", self.lang_example, start_time=self.days[0], end_time=self.days[-1])
+        logging.info(df)
+        expected_df = self.expected_ngram(
+            [[20, 10, 2, 2, 0.3, 0.15], [None] * 6, [50, 25, 1, 1, 0.9, 0.45]],
+            self.days,
+        ).astype(float)
+        pd.testing.assert_frame_equal(df, expected_df, check_index_type=False)
+
+    def test_get_zipf_dist(self):
+        df = self.api.get_zipf_dist(self.days[0], self.lang_example, top_n=2)
+        logging.info(df)
+        expected_df = pd.DataFrame(
+            [[30, 15, 1, 1, 0.5, 0.25], [20, 10, 2, 2, 0.3, 0.15]],
+            columns=self.ngrams_cols,
+            index=pd.Index(["hello", "#tag"], name='ngram'),
+        )
+        pd.testing.assert_frame_equal(df, expected_df)
+
+        df = self.api.get_zipf_dist(self.days[0], self.lang_example, max_rank=2, columns=['count'])
+        pd.testing.assert_frame_equal(df, expected_df[['count']])
+
+        df = self.api.get_zipf_dist(self.days[0], self.lang_example, ngram_filter="hashtags")
+        pd.testing.assert_frame_equal(df, expected_df.loc[["#tag"]])
+
+    def test_get_divergences(self):
+        df = self.api.get_divergences(self.days[0], self.days[1], lang=self.lang_example, ngrams='1grams', top_n=2)
+        logging.info(df)
+
+        assert list(df.index) == [
+            (self.days[0], "hello"),
+            (self.days[0], "#tag"),
+            (self.days[1], "hello"),
+            (self.days[1], "@user"),
+        ]
+        assert list(df['rd_contribution']) == [0.5, 0.3, 0.6, 0.4]
+        assert list(df['rank_change']) == [2, -1, 1, -1]
+        assert list(df['time_1']) == [datetime(2019, 1, 1)] * 2 + [datetime(2019, 1, 2)] * 2
+
+    def test_replicate(self):
+        with tempfile.TemporaryDirectory() as replica_dir:
+            replica = SQLiteBackend(replica_dir)
+            copied = replica.replicate(self.backend, '1grams', self.lang_example, self.days[1], self.days[1])
+            assert copied == 2
+
+            api = Storywrangler(backend=replica, progress=False)
+            df = api.get_ngram("hello", self.lang_example, start_time=self.days[1], end_time=self.days[1])
+            expected_df = self.api.get_ngram("hello", self.lang_example, start_time=self.days[1], end_time=self.days[1])
+            pd.testing.assert_frame_equal(df, expected_df)
+
+            # copying the same day again replaces its documents
+            assert replica.replicate(self.backend, '1grams', self.lang_example, self.days[1], self.days[1]) == 2
+            assert len(list(replica['1grams'][self.lang_example].find())) == 2
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,9 @@ import warnings
 warnings.filterwarnings("ignore")
 
 import unittest
-from storywrangling import Realtime
+import pandas as pd
+from datetime import datetime, timedelta
+from storywrangling import Realtime, RealtimeQuery
 
 
 class RealtimeTesting(unittest.TestCase):
@@ -63,6 +65,33 @@ class RealtimeTesting(unittest.TestCase):
         logging.info(df)
         assert not df.empty
 
+    def test_watch(self):
+        watcher = self.api.watch(
+            self.array_example,
+            lang=self.lang_example,
+        )
+        updates = watcher.poll()
+        logging.info(updates)
+        assert len(updates) == len(self.array_example)
+        assert not watcher.frames[(self.array_example[0].lower(), self.lang_example)].empty
+
+        # at most one batch lands between two polls
+        updates = watcher.poll()
+        assert all(len(df) <= 1 for df in updates.values())
+
+    def test_delta_query(self):
+        q = RealtimeQuery('realtime_1grams', self.lang_example, client=self.api.client)
+        last = q.last_updated - timedelta(minutes=15)
+        query, starts = q.prepare_delta_query({'cat': last, 'dog': None})
+        logging.info(query)
+
+        # not capped at the cached last batch, which may be older than the batches already landed
+        assert query == {"$or": [
+            {"word": {"$in": ['cat']}, "time": {"$gte": q.last_updated}},
+            {"word": {"$in": ['dog']}, "time": {"$gte": q.reference_date}},
+        ]}
+        assert starts == {'cat': q.last_updated, 'dog': q.reference_date}
+
     def test_get_zipf_dist(self):
         df = self.api.get_zipf_dist(
             lang=self.lang_example,
@@ -90,6 +119,51 @@ class RealtimeTesting(unittest.TestCase):
         logging.info(df)
         assert df['count'].min() >= 1000
 
+    def test_get_zipf_dists_rollup(self):
+        start = datetime.utcnow() - timedelta(hours=6)
+        df = self.api.get_zipf_dists(
+            start,
+            lang=self.lang_example,
+            ngrams='1grams',
+            max_rank=100,
+            rollup='h',
+        )
+        logging.info(df)
+        assert not df.empty
+        assert df.index.names == ['time', 'ngram']
+        assert (df.index.get_level_values('time').minute == 0).all()
+
+    def test_rollup_case_variants(self):
+        q = RealtimeQuery('realtime_1grams', self.lang_example, client=self.api.client)
+        times = pd.DatetimeIndex(['2021-03-01 10:00', '2021-03-01 10:00', '2021-03-01 10:15', '2021-03-01 10:15'])
+        batches = pd.DataFrame(
+            {
+                'count': [30, 10, 20, 5],
+                'count_no_rt': [15, 5, 10, 5],
+                'rank': [1, 3, 1, 2],
+                'rank_no_rt': [1, 3, 1, 2],
+                'freq': [0.3, 0.1, 0.2, 0.05],
+                'freq_no_rt': [0.15, 0.05, 0.1, 0.05],
+                'r_rel': [1.0, 0.5, 1.0, 0.5],
+            },
+            index=pd.MultiIndex.from_arrays([times, ['cat', 'cat', 'cat', 'dog']], names=['time', 'ngram']),
+        )
+
+        df = q.rollup(batches, 'h')
+        logging.info(df)
+        cat = df.loc[(pd.Timestamp('2021-03-01 10:00'), 'cat')]
+        assert cat['count'] == 60 and cat['count_no_rt'] == 30
+        self.assertAlmostEqual(cat['freq'], (0.4 + 0.2) / 2)
+        self.assertAlmostEqual(cat['freq_no_rt'], (0.2 + 0.1) / 2)
+        self.assertAlmostEqual(cat['r_rel'], (0.75 + 1.0) / 2)
+        assert cat['rank'] == 1
+
+        # dog only shows up in one of the two batches of the hour
+        dog = df.loc[(pd.Timestamp('2021-03-01 10:00'), 'dog')]
+        self.assertAlmostEqual(dog['freq'], 0.05 / 2)
+        self.assertAlmostEqual(dog['r_rel'], 0.5 / 2)
+        assert dog['count'] == 5 and dog['rank'] == 2
+
 
 if __name__ == '__main__':
     unittest.main()
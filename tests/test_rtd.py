@@ -0,0 +1,70 @@
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import sys
+
+sys.path.append('./')
+
+import unittest
+import numpy as np
+import pandas as pd
+from storywrangling.rtd import rank_turbulence_divergence
+
+
+def zipf(counts: dict) -> pd.DataFrame:
+    return pd.DataFrame({"count": list(counts.values())}, index=pd.Index(list(counts), name='ngram'))
+
+
+class RTDTesting(unittest.TestCase):
+    """Rank-turbulence divergence of small hand-made distributions"""
+
+    def __init__(self, *args, **kwargs):
+        super(RTDTesting, self).__init__(*args, **kwargs)
+
+        # ranks 1, 2.5, 2.5 (+ 4 for "d") and 2, 1, 3 (+ 4 for "c")
+        self.zipf_1 = zipf({"a": 10, "b": 5, "c": 5})
+        self.zipf_2 = zipf({"a": 3, "b": 7, "d": 1})
+
+    def test_identical(self):
+        df = rank_turbulence_divergence(self.zipf_1, self.zipf_1)
+
+        assert (df['rd_contribution'] == 0).all()
+        assert (df['normed_rd'] == 0).all()
+        assert list(df['rank_1']) == list(df['rank_2'])
+
+    def test_disjoint(self):
+        df = rank_turbulence_divergence(self.zipf_1, zipf({"x": 4, "y": 2}))
+
+        assert np.isclose(df['normed_rd'].sum(), 1)
+        assert df.loc['x', 'rank_1'] == df.loc['y', 'rank_1'] == 4.5
+        assert df.loc['a', 'rank_2'] == df.loc['b', 'rank_2'] == df.loc['c', 'rank_2'] == 4
+
+    def test_ranks(self):
+        df = rank_turbulence_divergence(self.zipf_1, self.zipf_2, alpha=0).sort_index()
+
+        assert list(df.index) == ["a", "b", "c", "d"]
+        assert list(df['rank_1']) == [1, 2.5, 2.5, 4]
+        assert list(df['rank_2']) == [2, 1, 4, 3]
+
+        # alpha = 0: log ratios of ranks, ordered b > a > c > d
+        expected = np.abs(np.log([1 / 2, 2.5 / 1, 2.5 / 4, 4 / 3]))
+        np.testing.assert_allclose(df['rd_contribution'], expected)
+
+        # positions by contribution, positive for ngrams rising in the second distribution
+        assert list(df['rank_change']) == [-2, 1, -3, 4]
+
+    def test_alpha_inf(self):
+        df = rank_turbulence_divergence(self.zipf_1, self.zipf_2, alpha=np.inf).sort_index()
+
+        # only the highest of both ranks counts
+        np.testing.assert_allclose(df['rd_contribution'], [1, 1, 1 / 2.5, 1 / 3])
+        assert list(np.sign(df['rank_change'])) == [-1, 1, -1, 1]
+
+    def test_negative_alpha(self):
+        with self.assertRaises(ValueError):
+            rank_turbulence_divergence(self.zipf_1, self.zipf_2, alpha=-1)
+
+
+if __name__ == '__main__':
+    unittest.main()
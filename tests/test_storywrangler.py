@@ -7,10 +7,13 @@ import sys
 sys.path.append('./')
 
 import logging
+import tempfile
 import unittest
+import importlib.util
 import pandas as pd
-from datetime import datetime
-from storywrangling import Storywrangler
+from datetime import datetime, timedelta
+from storywrangling import Storywrangler, ProgressHook, Query
+from storywrangling.metadata import MetadataCache, CollectionMetadata, utcnow
 
 
 class NgramsTesting(unittest.TestCase):
@@ -104,6 +107,15 @@ class NgramsTesting(unittest.TestCase):
             "no_punc"
         ]
 
+    def test_shared_resources(self):
+        api = Storywrangler()
+        self.assertIs(api.parser, self.api.parser)
+        self.assertIs(api.indexed_languages, self.api.indexed_languages)
+
+        df = api.get_ngram(self.test_1gram, self.lang_example)
+        logging.info(df)
+        assert not df.empty
+
     def test_1grams_database(self):
         df = self.api.get_ngram(
             self.test_1gram,
@@ -160,6 +172,95 @@ class NgramsTesting(unittest.TestCase):
         )
         logging.info(df)
 
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), "requires pyarrow")
+    def test_get_ngram_cached(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            api = Storywrangler(cache_dir=cache_dir)
+
+            for _ in range(2):
+                df = api.get_ngram(
+                    self.ngram_example,
+                    self.lang_example,
+                    start_time=self.start,
+                    end_time=self.end
+                )
+                pd.testing.assert_frame_equal(
+                    df[self.ngrams_cols],
+                    self.api.get_ngram(
+                        self.ngram_example,
+                        self.lang_example,
+                        start_time=self.start,
+                        end_time=self.end
+                    )[self.ngrams_cols],
+                )
+
+            assert api.cache.size > 0
+            api.cache.invalidate()
+            assert api.cache.size == 0
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), "requires pyarrow")
+    def test_get_ngrams_array_cached(self):
+        start = datetime(2019, 12, 1)
+        expected_df = self.api.get_ngrams_array(self.array_example, self.lang_example, start_time=start, end_time=self.end)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            api = Storywrangler(cache_dir=cache_dir)
+
+            for _ in range(2):
+                df = api.get_ngrams_array(self.array_example, self.lang_example, start_time=start, end_time=self.end)
+                logging.info(df.dtypes)
+                pd.testing.assert_frame_equal(df, expected_df)
+
+    def test_metadata_expiration(self):
+        cache = MetadataCache()
+        expected = cache.expected('D')
+        present = CollectionMetadata(self.start, expected, 'time', ())
+        late = CollectionMetadata(self.start, expected - timedelta(days=1), 'time', ())
+
+        assert cache.expires(present) == cache.expiration('D')
+        # yesterday has not landed yet: look again soon instead of caching it until midnight
+        assert cache.expires(late) <= utcnow() + cache.retry
+
+    def test_get_ngram_result_cache(self):
+        api = Storywrangler(result_cache_size=64 * 1024 ** 2)
+        expected_df = self.api.get_ngram(self.ngram_example, self.lang_example)
+
+        for _ in range(2):
+            df = api.get_ngram(self.ngram_example, self.lang_example)
+            pd.testing.assert_frame_equal(df, expected_df)
+            df['count'] = -1
+
+        stats = api.result_cache.stats
+        assert stats.hits == 1 and stats.misses == 1
+        assert 0 < stats.size <= stats.max_bytes
+
+    def test_get_ngrams_array_mixed_orders(self):
+        df = self.api.get_ngrams_array([self.test_1gram, self.test_2gram], self.lang_example)
+        expected_df = self.api.get_ngrams_array([self.test_2gram], self.lang_example)
+        logging.info(df)
+
+        assert set(df.index.get_level_values('ngram')) == {self.test_1gram, self.test_2gram}
+        pd.testing.assert_frame_equal(df.xs(self.test_2gram, level='ngram', drop_level=False), expected_df)
+
+    def test_get_ngrams_array_compact(self):
+        api = Storywrangler(compact=True)
+        expected_df = self.api.get_ngrams_array(self.array_example, self.lang_example)
+        df = api.get_ngrams_array(self.array_example, self.lang_example)
+        logging.info(df.dtypes)
+
+        assert df['count'].dtype == 'Int32' and df['freq'].dtype == 'float32'
+        assert isinstance(df.index.levels[1], pd.CategoricalIndex)
+        assert df.attrs['bytes_saved'] > 0
+        pd.testing.assert_series_equal(df['count'].astype(float), expected_df['count'].astype(float), check_index=False)
+
+    def test_get_ngrams_array_not_indexed(self):
+        ngrams = [self.ngram_isindexed_example, "bonjour"]
+        df = self.api.get_ngrams_array(ngrams, self.lang_isindexed_example, start_time=self.start, end_time=self.end)
+        logging.info(df)
+
+        # the 3gram is searched in its collection even though it is not indexed for the language
+        assert set(df.index.get_level_values('ngram')) == set(ngrams)
+
     def test_get_indexed_ngram(self):
         df = self.api.get_ngram(
             self.ngram_isindexed_example,
@@ -257,6 +358,25 @@ class NgramsTesting(unittest.TestCase):
         logging.info(df)
         assert not df.empty
 
+    def test_get_zipf_dist_progress(self):
+        reports = []
+        hook = ProgressHook(lambda desc, done, total: reports.append(done), every=2)
+
+        df = Storywrangler(progress=hook).get_zipf_dist(
+            date=self.end,
+            lang=self.lang_example,
+            ngrams='1grams',
+        )
+        logging.info(reports)
+        assert reports and reports[-1] == len(df)
+
+        quiet_df = Storywrangler(progress=None).get_zipf_dist(
+            date=self.end,
+            lang=self.lang_example,
+            ngrams='1grams',
+        )
+        pd.testing.assert_frame_equal(df, quiet_df)
+
     def test_get_zipf_dist_max_rank(self):
         df = self.api.get_zipf_dist(
             date=self.end,
@@ -305,6 +425,65 @@ class NgramsTesting(unittest.TestCase):
         logging.info(df)
         assert not df.empty
 
+    def test_iter_zipf_dist(self):
+        chunks = list(self.api.iter_zipf_dist(
+            date=self.end,
+            lang=self.lang_example,
+            ngrams='1grams',
+            max_rank=1000,
+            chunk_size=100,
+        ))
+        df = self.api.get_zipf_dist(
+            date=self.end,
+            lang=self.lang_example,
+            ngrams='1grams',
+            max_rank=1000,
+        )
+        logging.info(chunks[0])
+        assert all(len(chunk) <= 100 for chunk in chunks)
+        assert sum(len(chunk) for chunk in chunks) == len(df)
+        assert list(chunks[0].columns) == list(df.columns)
+
+    def test_get_zipf_dists(self):
+        start = self.end - timedelta(days=2)
+        df = self.api.get_zipf_dists(
+            start,
+            self.end,
+            lang=self.lang_example,
+            ngrams='1grams',
+            top_n=10,
+        )
+        logging.info(df)
+        assert df.index.names == ['time', 'ngram']
+        assert df.groupby(level='time').size().max() <= 10
+
+        expected = self.api.get_zipf_dist(self.end, lang=self.lang_example, ngrams='1grams', top_n=10)
+        pd.testing.assert_frame_equal(df.loc[self.end], expected, check_names=False)
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), "requires pyarrow")
+    def test_get_zipf_dist_snapshot(self):
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            api = Storywrangler(snapshot_dir=snapshot_dir)
+
+            for _ in range(2):
+                df = api.get_zipf_dist(
+                    date=self.end,
+                    lang=self.lang_example,
+                    ngrams='1grams',
+                    ngram_filter='hashtags',
+                    top_n=100
+                )
+                expected_df = self.api.get_zipf_dist(
+                    date=self.end,
+                    lang=self.lang_example,
+                    ngrams='1grams',
+                    ngram_filter='hashtags',
+                    top_n=100
+                )
+                pd.testing.assert_frame_equal(df.sort_index(), expected_df.sort_index())
+
+            assert api.snapshots.days('1grams', self.lang_example) == {self.end}
+
     def test_get_divergence_1grams(self):
         df = self.api.get_divergence(
             date=self.end,
@@ -347,6 +526,51 @@ class NgramsTesting(unittest.TestCase):
             logging.info(df)
             assert not df.empty
 
+    def test_get_divergences(self):
+        start = self.end - timedelta(days=2)
+        df = self.api.get_divergences(
+            start,
+            self.end,
+            lang=self.lang_example,
+            ngrams='1grams',
+            top_n=10,
+        )
+        logging.info(df)
+        assert df.index.names == ['time_2', 'ngram']
+        assert df.groupby(level='time_2').size().max() <= 10
+        assert df.index.get_level_values('time_2').min() >= start
+
+        # same as one query per day
+        expected = self.api.get_divergence(self.end, lang=self.lang_example, ngrams='1grams', top_n=10)
+        assert set(df.loc[self.end].index) == set(expected.index)
+
+    def test_get_divergences_without_topn(self):
+        start = self.end - timedelta(days=2)
+        q = Query('rd_1grams', self.lang_example, client=self.api.client, progress=False)
+        expected = q.query_divergences(start, self.end, top_n=10)
+
+        # $sort/$push/$slice pipeline of servers older than MongoDB 5.2
+        q.group_topn = False
+        df = q.query_divergences(start, self.end, top_n=10)
+        logging.info(df)
+        pd.testing.assert_frame_equal(df, expected)
+
+    def test_compute_divergence(self):
+        df = self.api.compute_divergence(
+            datetime(2019, 1, 1),
+            self.end,
+            lang=self.lang_example,
+            ngrams='1grams',
+        )
+        logging.info(df)
+        assert list(df.columns) == self.api.select_database('1grams', self.lang_example).div_cols
+        assert df['rd_contribution'].is_monotonic_decreasing
+        assert df['rank_change'].abs().iloc[0] == 1
+
+        # contributions of both years, as in the precomputed collection
+        expected = self.api.get_divergence(self.end, lang=self.lang_example, ngrams='1grams', top_n=10)
+        assert set(df.index[:10]) & set(expected.index)
+
 
 if __name__ == '__main__':
     unittest.main()